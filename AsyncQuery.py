@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+"""AsyncQuery.py
+
+Runs the queries of the stats views away from the gtk thread.
+
+A QueryRunner owns a worker thread with a database connection of its own.
+Rows are handed back to the gtk thread in pages through gobject.idle_add, so
+a view fills while the rest of a big result is still being fetched and the
+window keeps responding. cancel() drops whatever was asked for before it:
+the running query is interrupted where the backend allows it and pages that
+were already on their way are not delivered.
+"""
+
+import L10n
+_ = L10n.get_translation()
+
+import threading
+import Queue
+import logging
+import traceback
+
+import gobject
+
+import Database
+
+log = logging.getLogger("db")
+
+PAGE_SIZE = 500     # rows passed to the gtk thread at a time
+
+class QueryRunner:
+    def __init__(self, config, sql, page_size = PAGE_SIZE):
+        gobject.threads_init()
+        self.config = config
+        self.sql = sql
+        self.page_size = page_size
+        self.db = None              # made by the worker thread, sqlite connections can't change threads
+        self.generation = 0         # bumped by cancel(), a query of an older generation is abandoned
+        self.running = False        # True while the worker waits for the db
+        self.jobs = Queue.Queue()
+        self.worker = None
+
+    def run(self, query, args = None, page = None, done = None, error = None):
+        """Queue query (and its args) and return at once.
+
+           page(colnames, rows) is called on the gtk thread for every page of rows,
+           colnames as in cursor.description, then done() once all rows are
+           in, or error(exc) if the query failed. None of them are called for a
+           query cancelled by cancel()."""
+        if self.worker is None or not self.worker.isAlive():
+            self.worker = threading.Thread(target = self.work, name = "QueryRunner")
+            self.worker.setDaemon(True)
+            self.worker.start()
+        self.jobs.put((self.generation, query, args, page, done, error))
+
+    def cancel(self):
+        """Abandon every query asked for so far."""
+        self.generation += 1
+        db = self.db
+        if db is not None and self.running:
+            # stop a long query server side where the db api allows it
+            try:
+                if db.backend == Database.Database.SQLITE:
+                    db.connection.interrupt()
+                elif db.backend == Database.Database.PGSQL:
+                    db.connection.cancel()
+            except Exception:
+                pass
+
+    def close(self):
+        self.cancel()
+        self.jobs.put(None)
+
+    def current(self, generation):
+        return generation == self.generation
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            (generation, query, args, page, done, error) = job
+            if not self.current(generation):
+                continue
+            try:
+                if self.db is None:
+                    self.db = Database.Database(self.config, sql = self.sql)
+                cursor = self.db.get_cursor()
+                self.running = True     # sqlite does much of the work while rows are fetched
+                try:
+                    if args is None:
+                        cursor.execute(query)
+                    else:
+                        cursor.execute(query, args)
+                    colnames = [desc[0] for desc in cursor.description]
+                    while self.current(generation):
+                        rows = cursor.fetchmany(self.page_size)
+                        if not rows:
+                            break
+                        if page:
+                            gobject.idle_add(self.deliver, generation, page, colnames, rows)
+                finally:
+                    self.running = False
+                cursor.close()
+                self.db.rollback()
+                if done:
+                    gobject.idle_add(self.deliver, generation, done)
+            except Exception, e:
+                try:
+                    self.db.rollback()
+                except Exception:
+                    pass
+                if not self.current(generation):
+                    continue    # most likely interrupted by cancel()
+                log.error(_("Query failed: %s") % e)
+                log.debug(traceback.format_exc())
+                if error:
+                    gobject.idle_add(self.deliver, generation, error, e)
+
+    def deliver(self, generation, callback, *args):
+        # on the gtk thread: a page could have been queued just before a cancel()
+        if self.current(generation):
+            callback(*args)
+        return False
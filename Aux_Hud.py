@@ -97,6 +97,16 @@ class Simple_HUD(Aux_Base.Aux_Seats):
         # this is a call to whatever is in self.aw_class_window but it isn't obvious
         container.create_contents(i)
 
+    def update_gui(self, new_hand_id):
+        """Compute the stats of every seat in one pass, the stat boxes pick
+           their values up from self.numbers in update_contents."""
+        stat_names = [stat for row in self.stats for stat in row if stat]
+        players = [self.get_id_from_seat(i) for i in self.m_windows.keys() if i != "common"]
+        self.numbers = Stats.compute_stats(self.hud.stat_dict, [p for p in players if p is not None],
+                                           stat_names, self.hud.hand_instance)
+        self.numbers_stat_dict = self.hud.stat_dict
+        super(Simple_HUD, self).update_gui(new_hand_id)
+
     def update_contents(self, container, i):
         # this is a call to whatever is in self.aw_class_window but it isn't obvious
         container.update_contents(i)
@@ -193,11 +203,16 @@ class Simple_stat(object):
         self.widget = self.eb
         self.stat_dict = None
         self.hud = aw.hud
+        self.aw = aw
 
     def update(self, player_id, stat_dict):
         self.stat_dict = stat_dict     # So the Simple_stat obj always has a fresh stat_dict
         self.eb.stat_dict = stat_dict
-        self.number = Stats.do_stat(stat_dict, player_id, self.stat, self.hud.hand_instance)
+        if getattr(self.aw, 'numbers_stat_dict', None) is stat_dict:
+            # already computed for all seats by Simple_HUD.update_gui
+            self.number = self.aw.numbers.get(player_id, {}).get(self.stat)
+        else:
+            self.number = Stats.do_stat(stat_dict, player_id, self.stat, self.hud.hand_instance)
         if self.number:
             self.lab.set_text( str(self.number[1]))
 
@@ -43,6 +43,7 @@ import xml.dom.minidom
 from xml.dom.minidom import Node
 
 import platform
+import threading
 if platform.system() == 'Windows':
     import winpaths
     winpaths_appdata = winpaths.get_appdata()
@@ -596,6 +597,13 @@ class Import:
         self.callFpdbHud        = string_to_bool(node.getAttribute("callFpdbHud")      , default=False)
         self.fastStoreHudCache  = string_to_bool(node.getAttribute("fastStoreHudCache"), default=False)
         self.saveStarsHH        = string_to_bool(node.getAttribute("saveStarsHH")      , default=False)
+        self.dupeFilter         = string_to_bool(node.getAttribute("dupeFilter")       , default=False)
+        self.equityCache        = string_to_bool(node.getAttribute("equityCache")      , default=True)
+        self.siteCache          = string_to_bool(node.getAttribute("siteCache")        , default=True)
+        try:
+            self.summaryBatch   = int(node.getAttribute("summaryBatch"))
+        except ValueError:
+            self.summaryBatch   = 500
         if node.getAttribute("importFilters"):
             self.importFilters = node.getAttribute("importFilters").split(",")
         else:
@@ -1105,6 +1113,11 @@ class Config:
         with codecs.open(file, 'w', 'utf-8') as f:
             #self.doc.writexml(f)
             f.write( self.wrap_long_lines( self.doc.toxml() ) )
+        # callers edit self.doc directly, so the rest of a shared config is stale now
+        with _shared_lock:
+            for entry in _shared_configs.values():
+                if entry[1] is self:
+                    entry[0] = None
 
     def wrap_long_lines(self, s):
         lines = [ self.wrap_long_line(l) for l in s.splitlines() ]
@@ -1464,6 +1477,18 @@ class Config:
         try:    imp['fastStoreHudCache'] = self.imp.fastStoreHudCache
         except:  imp['fastStoreHudCache'] = False
 
+        try:    imp['dupeFilter'] = self.imp.dupeFilter
+        except:  imp['dupeFilter'] = False
+
+        try:    imp['equityCache'] = self.imp.equityCache
+        except:  imp['equityCache'] = True
+
+        try:    imp['siteCache'] = self.imp.siteCache
+        except:  imp['siteCache'] = True
+
+        try:    imp['summaryBatch'] = self.imp.summaryBatch
+        except:  imp['summaryBatch'] = 500
+
         try:    imp['importFilters'] = self.imp.importFilters
         except:  imp['importFilters'] = []
 
@@ -1690,6 +1715,32 @@ class Config:
     def get_gui_cash_stat_params(self):
         return( self.gui_cash_stats )
 
+def file_stamp(file):
+    """(mtime, size) of file, None if it can't be read."""
+    try:
+        st = os.stat(file)
+    except (OSError, TypeError):
+        return None
+    return (st.st_mtime, st.st_size)
+
+_shared_configs = {}    # (file, dbname) --> [stamp, Config]
+_shared_lock = threading.RLock()
+
+def get_shared_config(file = None, dbname = ''):
+    """Return the Config for file/dbname shared by the whole process.
+
+       The xml is parsed the first time the config is asked for and again only when
+       the file has changed on disk since, so modules and tools can call this
+       wherever they need the config instead of each parsing their own copy."""
+    key = (file, dbname or '')
+    with _shared_lock:
+        entry = _shared_configs.get(key)
+        if entry is not None and entry[0] is not None and entry[0] == file_stamp(entry[1].file):
+            return entry[1]
+        config = Config(file = file, dbname = dbname)
+        _shared_configs[key] = [file_stamp(config.file), config]
+        return config
+
 if __name__== "__main__":
     set_logfile(u"fpdb-log.txt")
     c = Config()
@@ -48,6 +48,11 @@ import pytz
 import csv
 import logging
 import random
+import threading
+import bisect
+import hashlib
+import struct
+import cPickle
 
 re_char = re.compile('[^a-zA-Z]')
 re_insert = re.compile("insert\sinto\s(?P<TABLENAME>[A-Za-z]+)\s(?P<COLUMNS>\(.+?\))\s+values", re.DOTALL)
@@ -82,6 +87,10 @@ except ImportError:
 
 DB_VERSION = 216
 
+# HandsPlayers.position grouped for the starthands stat: blinds, late, middle, early
+STARTHANDS_POSITIONS = {'B': 'b', 'S': 'b', '0': 'l', '1': 'l', '2': 'm', '3': 'm', '4': 'm',
+                        '5': 'e', '6': 'e', '7': 'e', '8': 'e', '9': 'e'}
+
 # Variance created as sqlite has a bunch of undefined aggregate functions.
 
 class VARIANCE:
@@ -104,6 +113,18 @@ def adapt_decimal(d):
 
 def convert_decimal(s):
     return Decimal(s)
+
+def to_unicode(s):
+    """Text from the db or Charset.to_db_utf8 as unicode, so that both compare equal"""
+    if isinstance(s, unicode):
+        return s
+    return s.decode('utf-8', 'replace')
+
+def utc_offset_hours():
+    """Hours to add to local time to get UTC, from 0 to 23. utcnow() and now() are read
+       a few microseconds apart, so the difference is rounded to whole hours"""
+    tz = datetime.utcnow() - datetime.now()
+    return int(round((tz.days*86400 + tz.seconds) / 3600.0)) % 24
     
     
 # These are for appendStats. Insert new stats at the right place, because
@@ -609,9 +630,18 @@ CACHE_KEYS = [
     'street4Aggressors'
     ]
 
+# Key columns of the cache tables, in the order of the bulk dict keys
+CACHE_TABLE_KEYS = {
+    'HudCache'       : ['gametypeId', 'playerId', 'seats', 'position', 'tourneyTypeId', 'styleKey'],
+    'CardsCache'     : ['weekId', 'monthId', 'gametypeId', 'tourneyTypeId', 'playerId', 'startCards'],
+    'PositionsCache' : ['weekId', 'monthId', 'gametypeId', 'tourneyTypeId', 'playerId', 'seats', 'maxPosition', 'position'],
+    }
+
 
 class Database:
 
+    DUPE_BATCH = 500        # siteHandNos or player names looked up per query (sqlite allows 999 parameters)
+
     MYSQL_INNODB = 2
     PGSQL = 3
     SQLITE = 4
@@ -858,6 +888,8 @@ class Database:
         self._hero = None
         self._has_lock = False
         self.printdata = False
+        self.handfilter = None         # HandFilter of the hands in the db, set by the Importer
+        self.starthands = {}           # (fileId, type, limitType, playerId): starthands buckets, see get_starthands
         self.resetCache()
         self.resetBulkCache()
         
@@ -890,7 +922,7 @@ class Database:
                 self.wrongDbVersion = False
             
             self.gtcache    = None       # GameTypeId cache 
-            self.tcache     = None       # TourneyId cache
+            self.tcache     = None       # Tourneys cache, see getTourneyCache
             self.pcache     = None       # PlayerId cache
             self.tpcache    = None       # TourneysPlayersId cache
 
@@ -1244,6 +1276,38 @@ class Database:
                 'hilo':row[5],'sb':row[6],'bb':row[7], 'sbet':row[8],'bbet':row[9], 'currency':row[10], 'gametypeId':row[11]}
         return gameinfo
         
+    def get_starthands(self, hand_id, player_id):
+        """The holdem start hands player_id played in the hh file of hand_id, for the
+           starthands stat. Returns a dict of sets of (startCards, position group) keyed by
+           how the hand was played: 'defendBB', 'raised', 'calledRaise' or 'limped'.
+
+           The buckets are kept per file and player, and only hands newer than the
+           last one seen are fetched from the db."""
+        c = self.get_cursor()
+        c.execute(self.sql.query['get_starthands_file'].replace('%s', self.sql.query['placeholder']), (hand_id, ))
+        row = c.fetchone()
+        if row is None:
+            return {}
+        key = tuple(row) + (player_id, )
+        if key not in self.starthands:
+            self.starthands[key] = {'lastId': 0, 'buckets': {'defendBB': set(), 'raised': set(), 'calledRaise': set(), 'limped': set()}}
+        cache = self.starthands[key]
+        if hand_id > cache['lastId']:
+            c.execute(self.sql.query['get_starthands'].replace('%s', self.sql.query['placeholder']),
+                      tuple(row) + (player_id, cache['lastId']))
+            for (hid, startCards, aggr, calledRaise, position) in c.fetchall():
+                position = STARTHANDS_POSITIONS.get(str(position), 'X')
+                if position == 'b' and calledRaise:
+                    cache['buckets']['defendBB'].add((startCards, position))
+                elif aggr:
+                    cache['buckets']['raised'].add((startCards, position))
+                elif calledRaise:
+                    cache['buckets']['calledRaise'].add((startCards, position))
+                else:
+                    cache['buckets']['limped'].add((startCards, position))
+                cache['lastId'] = max(cache['lastId'], hid)
+        return cache['buckets']
+
 #   Query 'get_hand_info' does not exist, so it seems
 #    def get_hand_info(self, new_hand_id):
 #        c = self.connection.cursor()
@@ -1343,9 +1407,7 @@ class Database:
         if row and row[0]:
             self.hand_1day_ago = int(row[0])
                 
-        tz = datetime.utcnow() - datetime.today()
-        tz_offset = tz.seconds/3600
-        tz_day_start_offset = self.day_start + tz_offset
+        tz_day_start_offset = self.day_start + utc_offset_hours()
         
         d = timedelta(days=hud_days, hours=tz_day_start_offset)
         now = datetime.utcnow() - d
@@ -1369,7 +1431,12 @@ class Database:
                                           }
                            , hero_id = -1
                            , num_seats = 6
+                           , store = None
+                           , deltas = None
                            ):
+        """Stats of the players in hand. If the importer sent the hand's HudCache lines
+           (deltas) and a HudStatStore is given, the stats come from the store whenever it
+           holds all the players, and are added to it when they had to be queried."""
         stat_range   = hud_params['stat_range']
         agg_bb_mult = hud_params['agg_bb_mult']
         seats_style = hud_params['seats_style']
@@ -1437,9 +1504,23 @@ class Database:
         #elif h_stat_range == 'H':
         #    h_stylekey = date_nhands_ago  needs array by player here ...
 
-        # lookup gametypeId from hand
-        handinfo = self.get_gameinfo_from_hid(hand)
-        gametypeId = handinfo["gametypeId"]
+        if store is not None and deltas is not None and stat_range != 'S' and h_stat_range != 'S':
+            gametypeId = deltas['gametypeId']
+            key   = (gametypeId, seats_min, seats_max, stylekey, agg_bb_mult)
+            h_key = (gametypeId, h_seats_min, h_seats_max, h_stylekey, h_agg_bb_mult)
+            for mult in (agg_bb_mult, h_agg_bb_mult):
+                if not store.has_gametypes(gametypeId, mult):
+                    store.set_gametypes(gametypeId, mult, self.get_hud_gametypes(gametypeId, mult))
+            stat_dict = store.get_stats(hero_id, deltas, h_key, key)
+            if stat_dict is not None:
+                return stat_dict
+            stat_dict = {}
+            last_hand = self.get_last_hand()
+        else:
+            store = None
+            # lookup gametypeId from hand
+            handinfo = self.get_gameinfo_from_hid(hand)
+            gametypeId = handinfo["gametypeId"]
 
         query = 'get_stats_from_hand_aggregated'
         subs = (hand
@@ -1462,8 +1543,19 @@ class Database:
                     t_dict[name.lower()] = val
                 stat_dict[t_dict['player_id']] = t_dict
 
+        # the stats only go to the store if no hand was stored while they were queried:
+        # such a hand is in the stats but newer than last_hand, and would be added again
+        if store is not None and self.get_last_hand() == last_hand:
+            store.load(last_hand, hero_id, h_key, key, stat_dict)
         return stat_dict
 
+    def get_hud_gametypes(self, gametypeId, agg_bb_mult):
+        """Ids of the gametypes whose stats get_stats_from_hand_aggregated adds up for gametypeId"""
+        c = self.get_cursor()
+        q = self.sql.query['get_hud_gametypes'].replace('%s', self.sql.query['placeholder'])
+        c.execute(q, (agg_bb_mult, agg_bb_mult, gametypeId))
+        return set(row[0] for row in c.fetchall())
+
     # uses query on handsplayers instead of hudcache to get stats on just this session
     def get_stats_from_hand_session(self, hand, stat_dict, hero_id
                                    ,stat_range, seats_min, seats_max
@@ -1555,9 +1647,15 @@ class Database:
         self.ttnew      = set()      # TourneyTypes new
         self.wmold      = set()      # WeeksMonths old
         self.wmnew      = set()      # WeeksMonths new
+        self.cachejournal = {}       # hand id --> [tourneyTypeId, weekId, monthId] its cache lines were stored with, see journalHands
         self.gtcache    = None       # GameTypeId cache 
-        self.tcache     = None       # TourneyId cache
         self.pcache     = None       # PlayerId cache
+        self.resetTourneyCache()
+
+    def resetTourneyCache(self):
+        """Forget the tourneys looked up so far. The importers call it for every file, so
+           the cached rows are never older than the file being imported."""
+        self.tcache     = None       # Tourneys cache, see getTourneyCache
         self.tpcache    = None       # TourneysPlayersId cache
 
     def get_last_insert_id(self, cursor=None):
@@ -2312,8 +2410,16 @@ class Database:
                 
         return query
 
-    def rebuild_cache(self, h_start=None, v_start=None, table = 'HudCache', ttid = None, wmid = None):
-        """clears hudcache and rebuilds from the individual handsplayers records"""
+    def rebuild_cache(self, h_start=None, v_start=None, table = 'HudCache', progress = None, threads = None):
+        """Rebuilds a cache table from the individual handsplayers records.
+
+           The lines are written to <table>Rebuild a gametype at a time and copied over the
+           cache in one transaction once every gametype is done, the HUD keeps using the old
+           lines until then. Hands imported while the rebuild runs are added as it's copied.
+           On postgres and mysql threads (default 4) connections rebuild gametypes at once.
+           An interrupted rebuild carries on from the gametypes it had finished, unless it
+           was started with other hero or villain start dates.
+           progress(done, total) is called from this thread after each gametype."""
         stime = time()
         # derive list of program owner's player ids
         self.hero = {}                               # name of program owner indexed by site id
@@ -2337,55 +2443,146 @@ class Database:
                 h_start = self.hero_hudstart_def
             if not v_start:
                 v_start = self.villain_hudstart_def
-                
-        if not ttid and not wmid:
-            self.get_cursor().execute(self.sql.query['clear%s' % table])
-            self.commit()
         
-        if not ttid:
+        where = {}
+        for (type, tourneys) in (('ring', "hp.tourneysPlayersId IS NULL"), ('tour', "hp.tourneysPlayersId >= 0")):
             if self.hero_ids is None:
-                if wmid:
-                    where = "WHERE g.type = 'ring' AND weekId = %s and monthId = %s<hero_where>" % wmid
-                else:
-                    where = "WHERE g.type = 'ring'<hero_where>"
+                where[type] = "WHERE g.type = '%s'<hero_where>" % type
             else:
-                where =   "where (((    hp.playerId not in " + str(tuple(self.hero_ids.values())) \
-                        + "       and h.startTime > '" + v_start + "')" \
-                        + "   or (    hp.playerId in " + str(tuple(self.hero_ids.values())) \
-                        + "       and h.startTime > '" + h_start + "'))" \
-                        + "   AND hp.tourneysPlayersId IS NULL)"
-            rebuild_sql_cash = self.sql.query['rebuildCache'].replace('%s', self.sql.query['placeholder'])
-            rebuild_sql_cash = rebuild_sql_cash.replace('<tourney_join_clause>', "")
-            rebuild_sql_cash = rebuild_sql_cash.replace('<where_clause>', where)
-            rebuild_sql_cash = self.replace_statscache('ring', table, rebuild_sql_cash)
-            #print rebuild_sql_cash 
-            self.get_cursor().execute(rebuild_sql_cash)
+                where[type] = "where (((    hp.playerId not in " + str(tuple(self.hero_ids.values())) \
+                            + "       and h.startTime > '" + v_start + "')" \
+                            + "   or (    hp.playerId in " + str(tuple(self.hero_ids.values())) \
+                            + "       and h.startTime > '" + h_start + "'))" \
+                            + "   AND " + tourneys + ")"
+        
+        columns = ', '.join(CACHE_TABLE_KEYS[table] + CACHE_KEYS)
+        q = {}
+        for name in ('create_cache_rebuild', 'create_cache_rebuild_state', 'insert_cache_rebuild_state',
+                     'select_cache_rebuild_state', 'select_cache_rebuild_done', 'copy_cache_rebuild',
+                     'drop_cache_rebuild', 'drop_cache_rebuild_state', 'lock_cache_rebuild'):
+            q[name] = self.sql.query[name].replace('<tablename>', table).replace('<columns>', columns)
+            q[name] = q[name].replace('%s', self.sql.query['placeholder'])
+        
+        c = self.get_cursor()
+        state = (h_start or '', v_start or '')
+        try:
+            c.execute(q['select_cache_rebuild_state'])
+            row = c.fetchone()
+        except:
+            self.rollback()     # no rebuild to resume
+            row = None
+        if row is None or tuple(row[1:]) != state:
+            for name in ('drop_cache_rebuild', 'drop_cache_rebuild_state'):
+                try:
+                    c.execute(q[name])
+                    self.commit()
+                except:
+                    self.rollback()
+            lastHandId = self.get_last_hand() or 0
+            c.execute(q['create_cache_rebuild'])
+            c.execute(q['create_cache_rebuild_state'])
+            c.execute(q['insert_cache_rebuild_state'], (lastHandId,) + state)
             self.commit()
-            #print _("Rebuild cache(cash) took %.1f seconds") % (time() - stime,)
-
-        if ttid:
-            where = "WHERE t.tourneyTypeId = %s<hero_where>" % ttid
-        elif self.hero_ids is None:
-            if wmid:
-                where = "WHERE g.type = 'tour' AND weekId = %s and monthId = %s<hero_where>" % wmid
-            else:
-                where = "WHERE g.type = 'tour'<hero_where>"
         else:
-            where =   "where (((    hp.playerId not in " + str(tuple(self.hero_ids.values())) \
-                    + "       and h.startTime > '" + v_start + "')" \
-                    + "   or (    hp.playerId in " + str(tuple(self.hero_ids.values())) \
-                    + "       and h.startTime > '" + h_start + "'))" \
-                    + "   AND hp.tourneysPlayersId >= 0)"
-        rebuild_sql_tourney = self.sql.query['rebuildCache'].replace('%s', self.sql.query['placeholder'])
-        rebuild_sql_tourney = rebuild_sql_tourney.replace('<tourney_join_clause>', """INNER JOIN Tourneys t ON (t.id = h.tourneyId)""")
-        rebuild_sql_tourney = rebuild_sql_tourney.replace('<where_clause>', where)
-        rebuild_sql_tourney = self.replace_statscache('tour', table, rebuild_sql_tourney)
-        #print rebuild_sql_tourney
-        self.get_cursor().execute(rebuild_sql_tourney)
+            lastHandId = row[0]
+            log.info(_("Resuming the rebuild of %s") % table)
+        
+        # hands imported after the rebuild started are in the cache already, they're added
+        # when the rebuild is copied over it
+        partition = " AND h.gametypeId = <gametypeId> AND h.id <= %d" % int(lastHandId)
+        rebuild = {}
+        for type in ('ring', 'tour'):
+            rebuild[type] = self.sql.query['rebuildCache'].replace('%s', self.sql.query['placeholder'])
+            if type == 'tour':
+                rebuild[type] = rebuild[type].replace('<tourney_join_clause>', """INNER JOIN Tourneys t ON (t.id = h.tourneyId)""")
+            else:
+                rebuild[type] = rebuild[type].replace('<tourney_join_clause>', "")
+            rebuild[type] = rebuild[type].replace('<where_clause>', where[type] + partition)
+            rebuild[type] = self.replace_statscache(type, table, rebuild[type])
+            rebuild[type] = rebuild[type].replace('insert into ' + table, 'insert into ' + table + 'Rebuild', 1)
+        
+        c.execute(q['select_cache_rebuild_done'])
+        finished = set(r[0] for r in c.fetchall())
+        c.execute(self.sql.query['getGametypeTypes'])
+        gametypes = c.fetchall()
+        self.commit()
+        jobs, results = Queue.Queue(), Queue.Queue()
+        for (gtid, type) in gametypes:
+            if gtid not in finished:
+                jobs.put((gtid, rebuild[type]))
+        done, total = len(gametypes) - jobs.qsize(), len(gametypes)
+        if progress:
+            progress(done, total)
+        
+        if threads is None:
+            threads = 4
+        workers = 0
+        if self.backend != self.SQLITE:
+            workers = min(threads, jobs.qsize())
+        for i in xrange(workers):
+            t = threading.Thread(target=self.rebuild_partitions, args=(None, jobs, results))
+            t.setDaemon(True)
+            t.start()
+        while done < total:
+            if not workers:
+                self.rebuild_partitions(self, jobs, results, 1)
+            (gtid, error) = results.get()
+            if error is not None:
+                raise error
+            done += 1
+            if progress:
+                progress(done, total)
+        
+        # a hand stored between the catch-up select and the copy would be in neither, so the
+        # cache is locked first: mysql's serializable reads block new hands, postgres blocks
+        # writes to the table, sqlite takes the write lock. The lock goes with the commit
+        self.commit()
+        c.execute(q['lock_cache_rebuild'])
+        bulk = {}
+        for type in ('ring', 'tour'):
+            c.execute(self.cacheSelect(table, type, where[type] + " AND h.id > %d" % int(lastHandId)))
+            self.addCacheRows(bulk, table, type, c.fetchall())
+        c.execute(self.sql.query['clear%s' % table])
+        c.execute(q['copy_cache_rebuild'])
+        if not self.storeCacheBulk(table, bulk):
+            self.storeCacheLines(table, bulk)
         self.commit()
-        #print _("Rebuild hudcache took %.1f seconds") % (time() - stime,)
+        for name in ('drop_cache_rebuild', 'drop_cache_rebuild_state'):
+            c.execute(q[name])
+        self.commit()
+        log.info(_("Rebuilding %s took %.1f seconds") % (table, time() - stime))
     #end def rebuild_cache
     
+    def rebuild_partitions(self, db, jobs, results, limit = None):
+        """Run the rebuild queries queued by rebuild_cache, each in its own transaction, and
+           put (gametypeId, None) or (gametypeId, exception) on results. db None: a thread
+           with its own connection"""
+        try:
+            if db is None:
+                db = Database(self.config, sql = self.sql)
+            c = db.get_cursor()
+        except Exception, e:
+            results.put((None, e))
+            return
+        while limit is None or limit > 0:
+            try:
+                (gtid, query) = jobs.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                c.execute(query.replace('<gametypeId>', str(gtid)))
+                db.commit()
+                results.put((gtid, None))
+            except Exception, e:
+                db.rollback()
+                results.put((gtid, e))
+                break
+            if limit is not None:
+                limit -= 1
+        if db is not self:
+            db.disconnect()
+    #end def rebuild_partitions
+    
     def update_timezone(self, tz_name):
         select_W     = self.sql.query['select_W'].replace('%s', self.sql.query['placeholder'])
         select_M     = self.sql.query['select_M'].replace('%s', self.sql.query['placeholder'])
@@ -2395,6 +2592,7 @@ class Database:
         c = self.get_cursor()
         c.execute("SELECT id, sessionStart, weekId wid, monthId mid FROM Sessions")
         sessions = self.fetchallDict(c,['id','sessionStart','wid', 'mid'])
+        moved = {}
         for s in sessions:
             utc_start = pytz.utc.localize(s['sessionStart'])
             tz = pytz.timezone(tz_name)
@@ -2411,6 +2609,8 @@ class Database:
                 c.execute(update_WM_S, row)
                 self.wmold.add((s['wid'], s['mid']))
                 self.wmnew.add((wid, mid))
+                moved[s['id']] = (s['wid'], s['mid'])
+        self.journalSessionHands(moved)
         self.commit()
         self.cleanUpWeeksMonths()
 
@@ -2524,7 +2724,8 @@ class Database:
     #end def lock_for_insert
     
     def resetBulkCache(self, reconnect=False):
-        self.siteHandNos = []         # cache of siteHandNo
+        self.siteHandNos = set()      # keys of the hands stored by this import
+        self.dupeHands   = {}         # key: already in Hands, looked up by checkDuplicates
         self.hbulk       = []         # Hands bulk inserts
         self.bbulk       = []         # Boards bulk inserts
         self.hpbulk      = []         # HandsPlayers bulk inserts
@@ -2535,7 +2736,8 @@ class Database:
         self.hsbulk      = []         # HandsStove bulk inserts
         self.htbulk      = []         # HandsPots bulk inserts
         self.tbulk       = {}         # Tourneys bulk updates
-        self.s          = {'bk': []} # Sessions bulk updates
+        self.s           = {'bk': SessionIntervals()} # Sessions bulk updates
+        self.sh          = {}         # hand ids of each Sessions id
         self.sc          = {}         # SessionsCache bulk updates
         self.tc          = {}         # TourneysCache bulk updates
         self.hids        = []         # hand ids in order of hand bulk inserts
@@ -2729,41 +2931,35 @@ class Database:
         """Update cached statistics. If update fails because no record exists, do an insert."""
                 
         if pdata:   
-            tz = datetime.utcnow() - datetime.today()
-            tz_offset = tz.seconds/3600
-            tz_day_start_offset = self.day_start + tz_offset
-            
-            d = timedelta(hours=tz_day_start_offset)
-            starttime_offset = starttime - d
-            styleKey = datetime.strftime(starttime_offset, 'd%y%m%d')
+            styleKey = self.getHudStyleKey(starttime)
             seats = len(pids)
             
         pos = {'B':'B', 'S':'S', 0:'D', 1:'C', 2:'M', 3:'M', 4:'M', 5:'E', 6:'E', 7:'E', 8:'E', 9:'E' }
             
         for p in pdata:
             player_stats = pdata.get(p)
-            garbageTourneyTypes = player_stats['tourneyTypeId'] in self.ttnew or player_stats['tourneyTypeId'] in self.ttold
-            if self.import_options['hhBulkPath'] == "" or not garbageTourneyTypes:
-                position = pos[player_stats['position']]
-                k =   (gid
-                      ,pids[p]
-                      ,seats
-                      ,position if self.build_full_hudcache else '0'
-                      ,player_stats['tourneyTypeId']
-                      ,styleKey if self.build_full_hudcache else 'A000000'
-                      )
-                player_stats['n'] = 1
-                line = [int(player_stats[s]) if isinstance(player_stats[s],bool) else player_stats[s] for s in CACHE_KEYS]
-                    
-                hud = self.hcbulk.get(k)
-                # Add line to the old line in the hudcache.
-                if hud is not None:
-                    for idx,val in enumerate(line):
-                        hud[idx] += val
-                else:
-                    self.hcbulk[k] = line
+            position = pos[player_stats['position']]
+            k =   (gid
+                  ,pids[p]
+                  ,seats
+                  ,position if self.build_full_hudcache else '0'
+                  ,player_stats['tourneyTypeId']
+                  ,styleKey if self.build_full_hudcache else 'A000000'
+                  )
+            player_stats['n'] = 1
+            line = [int(player_stats[s]) if isinstance(player_stats[s],bool) else player_stats[s] for s in CACHE_KEYS]
                 
-        if doinsert:
+            hud = self.hcbulk.get(k)
+            # Add line to the old line in the hudcache.
+            if hud is not None:
+                for idx,val in enumerate(line):
+                    hud[idx] += val
+            else:
+                self.hcbulk[k] = line
+            
+        if doinsert and self.storeCacheBulk('HudCache', self.hcbulk):
+            self.commit()
+        elif doinsert:
             update_hudcache = self.sql.query['update_hudcache']
             update_hudcache = update_hudcache.replace('%s', self.sql.query['placeholder'])
             insert_hudcache = self.sql.query['insert_hudcache']
@@ -2824,7 +3020,7 @@ class Database:
             weekdate   = datetime(local.year, local.month, local.day)
             weekStart  = weekdate - timedelta(days=weekdate.weekday())
        
-        j, hand = None, {}
+        hand = {}
         for p, id in pids.iteritems():
             if id in heroes:
                 hand['startTime']  = startTime.replace(tzinfo=None)
@@ -2833,55 +3029,33 @@ class Database:
                 hand['ids'] = [hid]
                 hand['tourneys'] = set()
         
-        id = []
         if hand:
+            bk = self.s['bk']
             lower = hand['startTime']-THRESHOLD
             upper = hand['startTime']+THRESHOLD
-            for i in range(len(self.s['bk'])):
-                if (((lower  <= self.s['bk'][i]['sessionEnd'])
-                and  (upper  >= self.s['bk'][i]['sessionStart']))
-                or   (tid in self.s['bk'][i]['tourneys'])):
-                    if ((hand['startTime'] <= self.s['bk'][i]['sessionEnd']) 
-                    and (hand['startTime'] >= self.s['bk'][i]['sessionStart'])):
-                         id.append(i)
-                    elif hand['startTime'] < self.s['bk'][i]['sessionStart']:
-                         self.s['bk'][i]['sessionStart'] = hand['startTime']
-                         self.s['bk'][i]['weekStart']    = hand['weekStart']
-                         self.s['bk'][i]['monthStart']   = hand['monthStart']
-                         id.append(i)
-                    elif hand['startTime'] > self.s['bk'][i]['sessionEnd']:
-                         self.s['bk'][i]['sessionEnd'] = hand['startTime']
-                         id.append(i)
-            if len(id) == 1:
-                j = id[0]
-                self.s['bk'][j]['ids'] += [hid]
-                if tid: self.s['bk'][j]['tourneys'].add(tid)
-            elif len(id) > 1:
-                merged = {}
-                merged['ids'] = [hid]
-                merged['tourneys'] = set()
-                if tid: merged['tourneys'].add(tid) 
-                for n in id:
-                    h = self.s['bk'][n]
-                    if not merged.get('sessionStart') or merged.get('sessionStart') > h['sessionStart']:
-                        merged['sessionStart'] = h['sessionStart']
-                        merged['weekStart'] = h['weekStart']
-                        merged['monthStart'] = h['monthStart']
-                    if not merged.get('sessionEnd') or merged.get('sessionEnd') < h['sessionEnd']:
-                        merged['sessionEnd'] = h['sessionEnd']
-                    merged['ids'] += h['ids']
-                    merged['tourneys'].union(h['tourneys'])
-                    self.s['bk'][n]['delete'] = True
-                    
-                self.s['bk'] = [item for item in self.s['bk'] if not item.get('delete')]
-                self.s['bk'].append(merged)
-            elif len(id) == 0:
-                j = len(self.s['bk'])
+            found = bk.find(lower, upper, tid)
+            for s in found:
+                bk.remove(s)
+                if hand['startTime'] < s['sessionStart']:
+                    s['sessionStart'] = hand['startTime']
+                    s['weekStart']    = hand['weekStart']
+                    s['monthStart']   = hand['monthStart']
+                elif hand['startTime'] > s['sessionEnd']:
+                    s['sessionEnd'] = hand['startTime']
+            if found:
+                found[0]['ids'].append(hid)
+            else:
                 hand['id'] = None
                 hand['sessionStart'] = hand['startTime']
                 hand['sessionEnd']   = hand['startTime']
-                if tid: hand['tourneys'].add(tid)
-                self.s['bk'].append(hand)
+                found = [hand]
+            if tid: found[0]['tourneys'].add(tid)
+            start = min(s['sessionStart'] for s in found)
+            end   = max(s['sessionEnd'] for s in found)
+            for s in bk.find(start, end):
+                bk.remove(s)
+                found.append(s)
+            bk.add(bk.merge(found))
         
         if doinsert:
             select_S     = self.sql.query['select_S'].replace('%s', self.sql.query['placeholder'])
@@ -2897,11 +3071,11 @@ class Database:
             update_S_H   = self.sql.query['update_S_H'].replace('%s', self.sql.query['placeholder'])
             delete_S     = self.sql.query['delete_S'].replace('%s', self.sql.query['placeholder'])
             c = self.get_cursor()
-            for i in range(len(self.s['bk'])):                
-                lower = self.s['bk'][i]['sessionStart'] - THRESHOLD
-                upper = self.s['bk'][i]['sessionEnd']   + THRESHOLD
-                tourneys = self.s['bk'][i]['tourneys']
-                if (self.s['bk'][i]['tourneys']):
+            for bk in self.s['bk'].ordered():
+                lower = bk['sessionStart'] - THRESHOLD
+                upper = bk['sessionEnd']   + THRESHOLD
+                tourneys = bk['tourneys']
+                if (bk['tourneys']):
                     toursql = 'OR SC.id in (SELECT DISTINCT sessionId FROM Tourneys T WHERE T.id in (%s))' % ', '.join(str(t) for t in tourneys)
                     q = select_S.replace('<TOURSELECT>', toursql)
                 else:
@@ -2914,29 +3088,29 @@ class Database:
                     week, month = r[0]['weekStart'],    r[0]['monthStart']
                     wid, mid    = r[0]['weekId'],       r[0]['monthId']
                     update, updateW, updateM = False, False, False
-                    if self.s['bk'][i]['sessionStart'] < start:
-                        start, update = self.s['bk'][i]['sessionStart'], True
-                        if self.s['bk'][i]['weekStart'] != week:
-                            week, updateW = self.s['bk'][i]['weekStart'], True
-                        if self.s['bk'][i]['monthStart'] != month:
-                            month, updateM = self.s['bk'][i]['monthStart'], True
+                    if bk['sessionStart'] < start:
+                        start, update = bk['sessionStart'], True
+                        if bk['weekStart'] != week:
+                            week, updateW = bk['weekStart'], True
+                        if bk['monthStart'] != month:
+                            month, updateM = bk['monthStart'], True
                         if (updateW or updateM):
                             self.wmold.add((wid, mid))
-                    if self.s['bk'][i]['sessionEnd'] > end:
-                        end, update = self.s['bk'][i]['sessionEnd'], True
+                            self.journalSessionHands({r[0]['id']: (wid, mid)})
+                    if bk['sessionEnd'] > end:
+                        end, update = bk['sessionEnd'], True
                     if updateW:  wid = self.insertOrUpdate('weeks', c, (week,), select_W, insert_W)
                     if updateM:  mid = self.insertOrUpdate('months', c, (month,), select_M, insert_M)
                     if (updateW or updateM):
                         self.wmnew.add((wid, mid))
                     if update: 
                         c.execute(update_S, [wid, mid, start, end, r[0]['id']])
-                    for h in  self.s['bk'][i]['ids']:
-                        self.s[h] = {'id': r[0]['id'], 'wid': wid, 'mid': mid}
+                    self.setSessionIds(bk['ids'], r[0]['id'], wid, mid)
                 elif (num > 1):
-                    start, end, wmold, merge = None, None, set(), []
+                    start, end, wmold, merge, moved = None, None, set(), [], {}
                     for n in r: merge.append(n['id'])
                     merge.sort()
-                    r.append(self.s['bk'][i])
+                    r.append(bk)
                     for n in r:
                         if 'weekId' in n:
                             wmold.add((n['weekId'],  n['monthId']))    
@@ -2960,34 +3134,40 @@ class Database:
                     if len(wmold)>0:
                         self.wmold = self.wmold.union(wmold)
                         self.wmnew.add((wid, mid))
+                        for n in r[:-1]:
+                            if (n['weekId'], n['monthId']) != (wid, mid):
+                                moved[n['id']] = (n['weekId'], n['monthId'])
+                        self.journalSessionHands(moved)
                     row = [wid, mid, start, end]
                     c.execute(insert_S, row)
                     sid = self.get_last_insert_id(c)
-                    for h in self.s['bk'][i]['ids']:
-                        self.s[h] = {'id': sid, 'wid': wid, 'mid': mid}
+                    self.setSessionIds(bk['ids'], sid, wid, mid)
                     for m in merge:
-                        for h, n in self.s.iteritems():
-                            if h!='bk' and n['id'] == m:
-                                self.s[h] = {'id': sid, 'wid': wid, 'mid': mid}
+                        self.setSessionIds(self.sh.pop(m, []), sid, wid, mid)
                         c.execute(update_S_TC,(sid, m))
                         c.execute(update_S_SC,(sid, m))
                         c.execute(update_S_T, (sid, m))
                         c.execute(update_S_H, (sid, m))
                         c.execute(delete_S, (m,))
                 elif (num == 0):
-                    start   =  self.s['bk'][i]['sessionStart']
-                    end     =  self.s['bk'][i]['sessionEnd']
-                    week    =  self.s['bk'][i]['weekStart']
-                    month   =  self.s['bk'][i]['monthStart']
+                    start   =  bk['sessionStart']
+                    end     =  bk['sessionEnd']
+                    week    =  bk['weekStart']
+                    month   =  bk['monthStart']
                     wid = self.insertOrUpdate('weeks', c, (week,), select_W, insert_W)
                     mid = self.insertOrUpdate('months', c, (month,), select_M, insert_M)
                     row = [wid, mid, start, end]
                     c.execute(insert_S, row)
                     sid = self.get_last_insert_id(c)
-                    for h in self.s['bk'][i]['ids']:
-                        self.s[h] = {'id': sid, 'wid': wid, 'mid': mid}
+                    self.setSessionIds(bk['ids'], sid, wid, mid)
             self.commit()
     
+    def setSessionIds(self, hids, sid, wid, mid):
+        """Record the session, week and month of hands hids, and index them under the session"""
+        for h in hids:
+            self.s[h] = {'id': sid, 'wid': wid, 'mid': mid}
+        self.sh.setdefault(sid, []).extend(hids)
+    
     def storeSessionsCache(self, hid, pids, startTime, gametypeId, gametype, pdata, heroes, doinsert = False):
         """Update cached cash sessions. If no record exists, do an insert"""      
         THRESHOLD    = timedelta(seconds=int(self.sessionTimeout * 60))
@@ -3173,6 +3353,73 @@ class Database:
                 self.executemany(c, insert_TC, inserts)
             self.commit()
     
+    def getHudStyleKey(self, starttime):
+        """HudCache styleKey of a hand started at starttime"""
+        tz_day_start_offset = self.day_start + utc_offset_hours()
+        
+        d = timedelta(hours=tz_day_start_offset)
+        starttime_offset = starttime - d
+        return datetime.strftime(starttime_offset, 'd%y%m%d')
+
+    def get_hud_deltas(self, gid, gametype, pids, starttime, pdata):
+        """The HudCache lines storeHudCache adds for one hand, in a form that can be sent
+           to the HUD with the hand id (see HudStatStore). Each player's line is the seat
+           number followed by the CACHE_KEYS values"""
+        players = {}
+        for p in pdata:
+            player_stats = pdata.get(p)
+            player_stats['n'] = 1
+            players[pids[p]] = [player_stats['seatNo']] + [int(player_stats[s]) for s in CACHE_KEYS]
+        return {'gametypeId' : gid
+               ,'seats'      : len(pids)
+               ,'styleKey'   : self.getHudStyleKey(starttime) if self.build_full_hudcache else 'A000000'
+               ,'bigblind'   : int(Decimal(gametype['bb'])*100)
+               ,'players'    : players
+               }
+
+    def storeCacheBulk(self, table, bulk):
+        """Add the lines of bulk, a dict of key tuple: CACHE_KEYS totals, to a cache table
+           in a handful of statements instead of a select and an update per key.
+           The lines are loaded into a temporary table, the rows already in the cache
+           are updated with one joined UPDATE and the missing keys inserted from it.
+           Returns False if the backend has no bulk queries, the caller then updates
+           the cache a key at a time"""
+        if 'update_cache_bulk' not in self.sql.query:
+            return False
+        if not bulk:
+            return True
+        keys = CACHE_TABLE_KEYS[table]
+        columns = keys + CACHE_KEYS
+        join_clause = []
+        for k in keys:
+            if k == 'tourneyTypeId':
+                join_clause.append(self.sql.query['cache_bulk_nullsafe'].replace('<column>', k))
+            else:
+                join_clause.append(self.sql.query['cache_bulk_equal'].replace('<column>', k))
+        set_clause = [self.sql.query['cache_bulk_set'].replace('<column>', s) for s in CACHE_KEYS]
+        subs = {'<tablename>'   : table,
+                '<bulktable>'   : table + 'Bulk',
+                '<columns>'     : ', '.join(columns),
+                '<join_clause>' : ' AND '.join(join_clause),
+                '<set_clause>'  : ', '.join(set_clause)}
+        q = {}
+        for name in ('create_cache_bulk', 'update_cache_bulk', 'insert_cache_bulk', 'drop_cache_bulk'):
+            q[name] = self.sql.query[name]
+            for k, v in subs.iteritems():
+                q[name] = q[name].replace(k, v)
+        insert = "insert into %s (%s) values (%s)" % (subs['<bulktable>'], subs['<columns>'],
+                                                      ', '.join([self.sql.query['placeholder']] * len(columns)))
+        c = self.get_cursor()
+        c.execute(q['drop_cache_bulk'])    # in case a failed store left it
+        c.execute(q['create_cache_bulk'])
+        try:
+            self.executemany(c, insert, [list(k) + line for k, line in bulk.iteritems()])
+            c.execute(q['update_cache_bulk'])
+            c.execute(q['insert_cache_bulk'])
+        finally:
+            self.dropTemporaryTable(c, q['drop_cache_bulk'])
+        return True
+            
     def storeCardsCache(self, hid, pids, startTime, gametypeId, tourneyTypeId, pdata, heroes, tz_name, doinsert):
         """Update cached cards statistics. If update fails because no record exists, do an insert."""
 
@@ -3206,18 +3453,19 @@ class Database:
             for k, l in self.dcbulk.iteritems():
                 sc = self.s.get(k[0])
                 if sc != None:                    
-                    garbageWeekMonths = (sc['wid'], sc['mid']) in self.wmnew or (sc['wid'], sc['mid']) in self.wmold
-                    garbageTourneyTypes = k[2] in self.ttnew or k[2] in self.ttold
-                    if self.import_options['hhBulkPath'] == "" or (not garbageWeekMonths and not garbageTourneyTypes):
-                        n = (sc['wid'], sc['mid'], k[1], k[2], k[3], k[4])
-                        startCards = dccache.get(n)
-                        # Add line to the old line in the hudcache.
-                        if startCards is not None:
-                            for idx,val in enumerate(l):
-                                dccache[n][idx] += val
-                        else:
-                            dccache[n] = l
+                    n = (sc['wid'], sc['mid'], k[1], k[2], k[3], k[4])
+                    startCards = dccache.get(n)
+                    # Add line to the old line in the hudcache.
+                    if startCards is not None:
+                        for idx,val in enumerate(l):
+                            dccache[n][idx] += val
+                    else:
+                        dccache[n] = l
 
+            if self.storeCacheBulk('CardsCache', dccache):
+                self.commit()
+                return
+            
             c = self.get_cursor()
             for k, item in dccache.iteritems():
                 if k[3]:
@@ -3277,17 +3525,18 @@ class Database:
             for k, l in self.pcbulk.iteritems():
                 sc = self.s.get(k[0])
                 if sc != None:
-                    garbageWeekMonths = (sc['wid'], sc['mid']) in self.wmnew or (sc['wid'], sc['mid']) in self.wmold
-                    garbageTourneyTypes = k[2] in self.ttnew or k[2] in self.ttold
-                    if self.import_options['hhBulkPath'] == "" or (not garbageWeekMonths and not garbageTourneyTypes):
-                        n = (sc['wid'], sc['mid'], k[1], k[2], k[3], k[4], k[5], k[6])         
-                        positions = pccache.get(n)
-                        # Add line to the old line in the hudcache.
-                        if positions is not None:
-                            for idx,val in enumerate(l):
-                                pccache[n][idx] += val
-                        else:
-                            pccache[n] = l
+                    n = (sc['wid'], sc['mid'], k[1], k[2], k[3], k[4], k[5], k[6])         
+                    positions = pccache.get(n)
+                    # Add line to the old line in the hudcache.
+                    if positions is not None:
+                        for idx,val in enumerate(l):
+                            pccache[n][idx] += val
+                    else:
+                        pccache[n] = l
+            
+            if self.storeCacheBulk('PositionsCache', pccache):
+                self.commit()
+                return
             
             c = self.get_cursor()
             for k, item in pccache.iteritems():
@@ -3384,23 +3633,83 @@ class Database:
         return id
 
     def isDuplicate(self, siteId, siteHandNo, heroSeat, publicDB):
-        q = self.sql.query['isAlreadyInDB'].replace('%s', self.sql.query['placeholder'])
         if publicDB:
             key = (siteHandNo, siteId, heroSeat)
-            q = q.replace('<heroSeat>', ' AND heroSeat=%s').replace('%s', self.sql.query['placeholder'])
         else:
             key = (siteHandNo, siteId)
-            q = q.replace('<heroSeat>', '')
         if key in self.siteHandNos:
             return True
-        c = self.get_cursor()
-        c.execute(q, key)
-        result = c.fetchall()
-        if len(result) > 0:
+        dupe = self.dupeHands.pop(key, None)
+        if dupe is None:
+            q = self.sql.query['isAlreadyInDB'].replace('%s', self.sql.query['placeholder'])
+            if publicDB:
+                q = q.replace('<heroSeat>', ' AND heroSeat=%s').replace('%s', self.sql.query['placeholder'])
+            else:
+                q = q.replace('<heroSeat>', '')
+            c = self.get_cursor()
+            c.execute(q, key)
+            dupe = len(c.fetchall()) > 0
+        if dupe:
             return True
-        self.siteHandNos.append(key)
+        self.siteHandNos.add(key)
+        if self.handfilter is not None:
+            self.handfilter.add(self.handfilter.key(siteHandNo, siteId, heroSeat))
         return False
     
+    def checkDuplicates(self, hands, publicDB):
+        """Look up which of hands, a list of (siteId, siteHandNo, heroSeat), are already in Hands,
+           a few hundred hands per query, so that isDuplicate can answer them without a query.
+           Hands the handfilter has never seen are known to be new and are not looked up."""
+        handfilter = self.handfilter
+        if handfilter is not None and handfilter.publicDB != publicDB:
+            handfilter = None
+        lookup = {}     # siteId: {normalised key: key}
+        for (siteId, siteHandNo, heroSeat) in hands:
+            if publicDB:
+                key = (siteHandNo, siteId, heroSeat)
+            else:
+                key = (siteHandNo, siteId)
+            if key in self.siteHandNos or key in self.dupeHands:
+                continue
+            try:
+                nkey = (long(siteHandNo),) + key[1:]
+            except (TypeError, ValueError):
+                continue            # left to isDuplicate
+            if handfilter is not None and nkey not in handfilter:
+                self.dupeHands[key] = False
+                continue
+            lookup.setdefault(siteId, {})[nkey] = key
+        
+        q = self.sql.query['getHandKeysBySite'].replace('%s', self.sql.query['placeholder'])
+        c = self.get_cursor()
+        for siteId, keys in lookup.iteritems():
+            handNos = list(set(k[0] for k in keys))
+            for i in xrange(0, len(handNos), self.DUPE_BATCH):
+                batch = handNos[i:i+self.DUPE_BATCH]
+                c.execute(q.replace('<handNos>', ', '.join([self.sql.query['placeholder']] * len(batch))),
+                          [siteId] + batch)
+                for (siteHandNo, heroSeat) in c.fetchall():
+                    if publicDB:
+                        nkey = (long(siteHandNo), siteId, heroSeat)
+                    else:
+                        nkey = (long(siteHandNo), siteId)
+                    if nkey in keys:
+                        self.dupeHands[keys[nkey]] = True
+            for key in keys.itervalues():
+                self.dupeHands.setdefault(key, False)
+    
+    def get_hand_keys(self, after = 0):
+        """Yield (siteHandNo, siteId, heroSeat) of the hands with an id above after"""
+        c = self.connection.cursor()
+        c.execute(self.sql.query['getHandKeys'].replace('%s', self.sql.query['placeholder']), (after,))
+        while True:
+            rows = c.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    
+    
     def getSqlPlayerIDs(self, pnames, siteid, hero):
         result = {}
         if(self.pcache == None):
@@ -3418,9 +3727,72 @@ class Database:
 
         return result
     
-    def insertPlayer(self, name, site_id, hero):
-        insert_player = "INSERT INTO Players (name, siteId, hero, chars) VALUES (%s, %s, %s, %s)"
-        insert_player = insert_player.replace('%s', self.sql.query['placeholder'])
+    def prepSqlPlayerIDs(self, hands):
+        """Fill pcache with the ids of every player in hands (or tourney summaries) ahead of
+           getSqlPlayerIDs, so that a file's players are resolved in a few queries per site
+           rather than one or more each"""
+        if(self.pcache == None):
+            self.pcache = LambdaDict(lambda  key:self.insertPlayer(key[0], key[1], key[2]))
+        
+        sites = {}      # siteId: ({player name: is hero}, player names in the order seen)
+        for hand in hands:
+            (players, order) = sites.setdefault(hand.siteId, ({}, []))
+            if isinstance(hand.players, dict):
+                names = hand.players.keys()     # TourneySummary: name --> entries
+            else:
+                names = [p[1] for p in hand.players]
+            for name in names:
+                if (name, hand.siteId, name==hand.hero) not in self.pcache:
+                    if name not in players:
+                        order.append(name)
+                    players[name] = players.get(name) or name==hand.hero
+        
+        c = self.get_cursor()
+        for site_id, (players, order) in sites.iteritems():
+            # names the db may compare as equal (mysql ignores case and trailing spaces) are left to insertPlayer
+            stored = dict((name, self.playerRow(name, site_id, False)[0]) for name in order)
+            names = set(to_unicode(_name) for _name in stored.itervalues())
+            folds = {}
+            rows = self.fetchPlayers(c, site_id, stored.values())
+            for _name in names.union(to_unicode(row[1]) for row in rows):
+                fold = _name.lower().rstrip()
+                folds[fold] = folds.get(fold, 0) + 1
+            found = dict((to_unicode(row[1]), row) for row in rows)
+            
+            new = []
+            for name in order:
+                _name = to_unicode(stored[name])
+                if _name not in found and folds[_name.lower().rstrip()] == 1:
+                    new.append(self.playerRow(name, site_id, players[name]))
+            if new:
+                insert_player = "INSERT INTO Players (name, siteId, hero, chars) VALUES (%s, %s, %s, %s)"
+                c.executemany(insert_player.replace('%s', self.sql.query['placeholder']), new)
+                for row in self.fetchPlayers(c, site_id, [row[0] for row in new]):
+                    found[to_unicode(row[1])] = row
+            
+            for name in order:
+                row = found.get(to_unicode(stored[name]))
+                if row is None:
+                    continue
+                if players[name] and not row[2]:
+                    q = "UPDATE Players SET hero=%s WHERE id=%s"
+                    c.execute(q.replace('%s', self.sql.query['placeholder']), (True, row[0]))
+                self.pcache[(name, site_id, players[name])] = row[0]
+                self.pcache[(name, site_id, False)] = row[0]
+    
+    def fetchPlayers(self, c, site_id, names):
+        """(id, name, hero) of the Players of site_id named in names"""
+        rows = []
+        q = "SELECT id, name, hero FROM Players WHERE siteId=%s AND name IN (<names>)"
+        q = q.replace('%s', self.sql.query['placeholder'])
+        for i in xrange(0, len(names), self.DUPE_BATCH):
+            batch = names[i:i+self.DUPE_BATCH]
+            c.execute(q.replace('<names>', ', '.join([self.sql.query['placeholder']] * len(batch))), [site_id] + batch)
+            rows += c.fetchall()
+        return rows
+    
+    def playerRow(self, name, site_id, hero):
+        """(name, siteId, hero, chars) to insert into Players"""
         _name = Charset.to_db_utf8(name)[:32]
         if re_char.match(_name[0]):
             char = '123'
@@ -3428,8 +3800,12 @@ class Database:
             char = _name[0] + '1'
         else:
             char = _name[:2]
-        
-        key = (_name, site_id, hero, char.upper())
+        return (_name, site_id, hero, char.upper())
+    
+    def insertPlayer(self, name, site_id, hero):
+        insert_player = "INSERT INTO Players (name, siteId, hero, chars) VALUES (%s, %s, %s, %s)"
+        insert_player = insert_player.replace('%s', self.sql.query['placeholder'])
+        key = self.playerRow(name, site_id, hero)
         
         #NOTE/FIXME?: MySQL has ON DUPLICATE KEY UPDATE
         #Usage:
@@ -3534,15 +3910,25 @@ class Database:
         return result
     #end def getTourneyTypesIds
     
+    def getTourneyCache(self, siteId, tourNo):
+        """The cached Tourneys data of a tourney, all the hands of an MTT file share it:
+           type       the getTourneyTypeIdByTourneyNo row as a dict, None until read
+           id         Tourneys.id, None until read
+           startTime, endTime  the times to be written by flushTourneyCache
+           changed    the times that differ from the db
+           tourney    the Tourneys row as a dict, read by prepTourneySummaries
+           players    {(playerId, entryId): TourneysPlayers row as a dict}, likewise"""
+        if(self.tcache == None):
+            self.tcache = {}
+        tour = self.tcache.get((siteId, tourNo))
+        if tour is None:
+            tour = {'type': None, 'id': None, 'startTime': None, 'endTime': None, 'changed': set(),
+                    'tourney': None, 'players': None}
+            self.tcache[(siteId, tourNo)] = tour
+        return tour
+
     def getSqlTourneyTypeIDs(self, hand):
-        #if(self.ttcache == None):
-        #    self.ttcache = LambdaDict(lambda  key:self.insertTourneyType(key[0], key[1], key[2]))
-            
-        #tourneydata =   (hand.siteId, hand.buyinCurrency, hand.buyin, hand.fee, hand.gametype['category'],
-        #                 hand.gametype['limitType'], hand.maxseats, hand.isSng, hand.isKO, hand.koBounty, hand.isProgressive,
-        #                 hand.isRebuy, hand.rebuyCost, hand.isAddOn, hand.addOnCost, hand.speed, hand.isShootout, hand.isMatrix)
-        
-        result = self.createOrUpdateTourneyType(hand) #self.ttcache[(hand.tourNo, hand.siteId, tourneydata)]
+        result = self.createOrUpdateTourneyType(hand, self.getTourneyCache(hand.siteId, hand.tourNo))
 
         return result
     
@@ -3558,16 +3944,24 @@ class Database:
             return True
         return False
     
-    def createOrUpdateTourneyType(self, obj):
+    def createOrUpdateTourneyType(self, obj, tour = None):
+        """The TourneyTypes id of obj's tourney, the type is created or updated as needed.
+           tour is the tcache entry of the tourney: its row is only read from the db once."""
         ttid, _ttid, updateDb = None, None, False
         setattr(obj, 'limitType', obj.gametype['limitType'])
         cursor = self.get_cursor()
-        q = self.sql.query['getTourneyTypeIdByTourneyNo'].replace('%s', self.sql.query['placeholder'])
-        cursor.execute(q, (obj.tourNo, obj.siteId))
-        result=cursor.fetchone()
+        if tour is not None and tour['type'] is not None:
+            resultDict = tour['type']
+        else:
+            q = self.sql.query['getTourneyTypeIdByTourneyNo'].replace('%s', self.sql.query['placeholder'])
+            cursor.execute(q, (obj.tourNo, obj.siteId))
+            result=cursor.fetchone()
+            resultDict = None
+            if result != None:
+                columnNames=[desc[0].lower() for desc in cursor.description]
+                resultDict = dict(zip(columnNames, result))
         
-        if result != None:
-            columnNames=[desc[0].lower() for desc in cursor.description]
+        if resultDict != None:
             expectedValues = (('buyin', 'buyin'), ('fee', 'fee'), ('buyinCurrency', 'currency'), ('limitType', 'limittype'), ('isSng', 'sng'), ('maxseats', 'maxseats')
                              , ('isKO', 'knockout'), ('koBounty', 'kobounty'), ('isProgressive', 'progressive'), ('isRebuy', 'rebuy'), ('rebuyCost', 'rebuycost')
                              , ('isAddOn', 'addon'), ('addOnCost','addoncost'), ('speed', 'speed'), ('isShootout', 'shootout')
@@ -3576,7 +3970,6 @@ class Database:
                              , ('isHomeGame', 'homegame'), ('isNewToGame', 'newtogame'), ('isSplit', 'split'), ('isFifty50', 'fifty50'), ('isTime', 'time')
                              , ('timeAmt', 'timeamt'), ('isSatellite', 'satellite'), ('isDoubleOrNothing', 'doubleornothing'), ('isCashOut', 'cashout')
                              , ('isOnDemand', 'ondemand'), ('isFlighted', 'flighted'), ('isGuarantee', 'guarantee'), ('guaranteeAmt', 'guaranteeamt'))
-            resultDict = dict(zip(columnNames, result))
             ttid = resultDict["id"]
             for ev in expectedValues:
                 objField, dbField = ev
@@ -3586,10 +3979,10 @@ class Database:
                 elif self.defaultTourneyTypeValue(dbVal, objVal, objField) and objVal:#object has this value but DB doesnt, so update DB
                     updateDb=True
                     oldttid = ttid
-        if not result or updateDb:
+        if resultDict == None or updateDb:
             if obj.gametype['mix']!='none':
                 category, limitType = obj.gametype['mix'], 'mx'
-            elif result != None and resultDict['limittype']=='mx':
+            elif resultDict != None and resultDict['limittype']=='mx':
                 category, limitType = resultDict['category'], 'mx'
             else:
                 category, limitType = obj.gametype['category'], obj.gametype['limitType']
@@ -3615,10 +4008,16 @@ class Database:
                 ttid = self.get_last_insert_id(cursor)
             if updateDb:
                 #print 'DEBUG createOrUpdateTourneyType:', 'old', oldttid, 'new', ttid, row
+                q = self.sql.query['selectHandsByTourneyNo'].replace('%s', self.sql.query['placeholder'])
+                cursor.execute(q, (obj.siteId, obj.tourNo))
+                self.journalHands([h[0] for h in cursor.fetchall()], tourneyTypeId = oldttid)
                 q = self.sql.query['updateTourneyTypeId'].replace('%s', self.sql.query['placeholder'])
                 cursor.execute(q, (ttid, obj.siteId, obj.tourNo))
                 self.ttold.add(oldttid)
                 self.ttnew.add(ttid)
+        if tour is not None:
+            # a new or changed row is read again by the next hand of the tourney
+            tour['type'] = None if updateDb else resultDict
         return ttid
     
     def cleanUpTourneyTypes(self):
@@ -3631,48 +4030,28 @@ class Database:
                 tables = ('CardsCache', 'PositionsCache')
             else:
                 tables = set([])
+            self.repairCaches(tables)
             select = self.sql.query['selectTourneyWithTypeId'].replace('%s', self.sql.query['placeholder'])
             delete = self.sql.query['deleteTourneyTypeId'].replace('%s', self.sql.query['placeholder'])
             cursor = self.get_cursor()
             for ttid in self.ttold:
-                for t in tables:
-                    statement = 'clear%sTourneyType' % t
-                    clear  = self.sql.query[statement].replace('%s', self.sql.query['placeholder'])
-                    cursor.execute(clear, (ttid,))
-                self.commit()                
                 cursor.execute(select, (ttid,))
                 result=cursor.fetchone()
                 if not result:
                     cursor.execute(delete, (ttid,))
                     self.commit()
-            for ttid in self.ttnew:
-                for t in tables:
-                    statement = 'clear%sTourneyType' % t
-                    clear  = self.sql.query[statement].replace('%s', self.sql.query['placeholder'])
-                    cursor.execute(clear, (ttid,))
-                self.commit()
-            for t in tables:
-                statement = 'fetchNew%sTourneyTypeIds' % t
-                fetch  = self.sql.query[statement].replace('%s', self.sql.query['placeholder'])
-                cursor.execute(fetch)
-                for id in cursor.fetchall():
-                    self.rebuild_cache(None, None, t, id[0])
                 
                     
     def cleanUpWeeksMonths(self):
         if self.cacheSessions and self.wmold:
+            self.repairCaches(('CardsCache', 'PositionsCache'))
             selectWeekId = self.sql.query['selectSessionWithWeekId'].replace('%s', self.sql.query['placeholder'])
             selectMonthId = self.sql.query['selectSessionWithMonthId'].replace('%s', self.sql.query['placeholder'])
             deleteWeekId = self.sql.query['deleteWeekId'].replace('%s', self.sql.query['placeholder'])
             deleteMonthId = self.sql.query['deleteMonthId'].replace('%s', self.sql.query['placeholder'])
             cursor = self.get_cursor()
-            weeks, months, wmids = set(), set(), set()
+            weeks, months = set(), set()
             for (wid, mid) in self.wmold:
-                for t in ('CardsCache', 'PositionsCache'):
-                    statement = 'clear%sWeeksMonths' % t
-                    clear  = self.sql.query[statement].replace('%s', self.sql.query['placeholder'])
-                    cursor.execute(clear, (wid, mid))
-                self.commit()
                 weeks.add(wid)
                 months.add(mid)
             
@@ -3689,26 +4068,135 @@ class Database:
                 if not result:
                     cursor.execute(deleteMonthId, (mid,))
                     self.commit()
-                    
-            for (wid, mid) in self.wmnew:
-                for t in ('CardsCache', 'PositionsCache'):
-                    statement = 'clear%sWeeksMonths' % t
-                    clear  = self.sql.query[statement].replace('%s', self.sql.query['placeholder'])
-                    cursor.execute(clear, (wid, mid))
-                self.commit()
-                    
-            if self.wmold:
-                for t in ('CardsCache', 'PositionsCache'):
-                    statement = 'fetchNew%sWeeksMonths' % t
-                    fetch  = self.sql.query[statement].replace('%s', self.sql.query['placeholder'])
-                    cursor.execute(fetch)
-                    for (wid, mid) in cursor.fetchall():
-                        wmids.add((wid, mid))         
-                for wmid in wmids:
-                    for t in ('CardsCache', 'PositionsCache'):
-                        self.rebuild_cache(None, None, t, None, wmid)
             self.commit()
             
+    def journalHands(self, hids, tourneyTypeId = None, weekId = None, monthId = None):
+        """Remember the tourneyTypeId, or weekId and monthId, the cache lines of the hands
+           hids were stored with before they change. The first value given for a hand is
+           kept, its lines still have that one. See repairCaches"""
+        for hid in hids:
+            entry = self.cachejournal.setdefault(hid, [None, None, None])
+            if entry[0] is None:
+                entry[0] = tourneyTypeId
+            if entry[1] is None and weekId is not None:
+                entry[1], entry[2] = weekId, monthId
+    
+    def journalSessionHands(self, sessions):
+        """journalHands for the hands stored in sessions, a dict of session id --> the
+           (weekId, monthId) the session had"""
+        if not sessions:
+            return
+        q = self.sql.query['selectHandsBySessionIds'].replace('%s', self.sql.query['placeholder'])
+        c = self.get_cursor()
+        ids = sessions.keys()
+        for i in xrange(0, len(ids), self.DUPE_BATCH):
+            batch = ids[i:i+self.DUPE_BATCH]
+            c.execute(q.replace('<sessionIds>', ', '.join([self.sql.query['placeholder']] * len(batch))), batch)
+            for (hid, sid) in c.fetchall():
+                (wid, mid) = sessions[sid]
+                self.journalHands((hid,), weekId = wid, monthId = mid)
+    
+    def mergeJournal(self, journal):
+        """Add the cachejournal of another Database, e.g. the one of a parser process"""
+        for hid, (ttid, wid, mid) in journal.iteritems():
+            self.journalHands((hid,), ttid, wid, mid)
+    
+    def repairCaches(self, tables):
+        """Move the cache lines of the hands in the journal to the tourney type, week and
+           month the hands have now, instead of rebuilding the affected parts of the caches.
+           The journaled hands are aggregated with the rebuildCache select twice, keyed as
+           their lines were stored and as they are now, and the difference is added to each
+           table in one pass. Lines left without hands are deleted"""
+        if not self.cachejournal:
+            return
+        c = self.get_cursor()
+        c.execute(self.sql.query['drop_cache_journal'])     # in case a failed repair left it
+        c.execute(self.sql.query['create_cache_journal'])
+        try:
+            self.repairCacheTables(c, tables)
+        finally:
+            self.dropTemporaryTable(c, self.sql.query['drop_cache_journal'])
+        self.commit()
+        self.cachejournal = {}
+    
+    def repairCacheTables(self, c, tables):
+        """The body of repairCaches, with the journal loaded into CacheJournal"""
+        insert = self.sql.query['insert_cache_journal'].replace('%s', self.sql.query['placeholder'])
+        self.executemany(c, insert, [[hid] + entry for hid, entry in self.cachejournal.iteritems()])
+        for table in tables:
+            bulk = {}
+            for type in ('ring', 'tour'):
+                where = "WHERE g.type = '%s'" % type
+                if table == 'HudCache':
+                    if type == 'ring':
+                        continue    # no week or month in the hudcache, ring lines never move
+                    where += " AND j.tourneyTypeId IS NOT NULL"
+                now = self.cacheSelect(table, type, where, "INNER JOIN CacheJournal j ON (j.handId = h.id)")
+                stored = now.replace('t.tourneyTypeId', 'COALESCE(j.tourneyTypeId, t.tourneyTypeId)')
+                stored = stored.replace('s.weekId', 'COALESCE(j.weekId, s.weekId)')
+                stored = stored.replace('s.monthId', 'COALESCE(j.monthId, s.monthId)')
+                for (sign, select) in ((1, now), (-1, stored)):
+                    c.execute(select)
+                    self.addCacheRows(bulk, table, type, c.fetchall(), sign)
+            bulk = dict((k, line) for (k, line) in bulk.iteritems() if any(line))
+            if not self.storeCacheBulk(table, bulk):
+                self.storeCacheLines(table, bulk)
+            c.execute(self.sql.query['clear%sEmpty' % table])
+    
+    def dropTemporaryTable(self, c, query):
+        """Drop a temporary table from a finally clause. A failure is only logged, so that
+           it doesn't hide the error being raised, the table is dropped before its next use"""
+        try:
+            c.execute(query)
+        except Exception, e:
+            log.debug(_("Could not drop temporary table: %s") % e)
+    
+    def cacheSelect(self, table, type, where, join = ""):
+        """The select of the rebuildCache query of table, the cache lines of the hands
+           matched by where"""
+        if type == 'tour':
+            join = "INNER JOIN Tourneys t ON (t.id = h.tourneyId)\n                " + join
+        q = self.sql.query['rebuildCache'].replace('<tourney_join_clause>', join)
+        q = q.replace('<where_clause>', where)
+        q = self.replace_statscache(type, table, q)
+        return q[q.index('SELECT'):]
+    
+    def addCacheRows(self, bulk, table, type, rows, sign = 1):
+        """Add the rows of a cacheSelect to bulk, the cache lines by key as storeCacheBulk
+           takes them. sign -1 takes them away"""
+        keys = CACHE_TABLE_KEYS[table]
+        nkeys = len(keys) if type == 'tour' else len(keys) - 1
+        for row in rows:
+            k = list(row[:nkeys])
+            if type == 'ring':
+                k.insert(keys.index('tourneyTypeId'), None)
+            line = bulk.setdefault(tuple(k), [0] * len(CACHE_KEYS))
+            for idx, val in enumerate(row[nkeys:]):
+                line[idx] += sign * (val or 0)
+    
+    def storeCacheLines(self, table, bulk):
+        """Add the lines of bulk to a cache table a key at a time, where storeCacheBulk
+           can't be used"""
+        name = table.lower()
+        tix = CACHE_TABLE_KEYS[table].index('tourneyTypeId')
+        select_ring = self.sql.query['select_%s_ring' % name].replace('%s', self.sql.query['placeholder'])
+        select_tour = self.sql.query['select_%s_tour' % name].replace('%s', self.sql.query['placeholder'])
+        update = self.sql.query['update_%s' % name].replace('%s', self.sql.query['placeholder'])
+        insert = self.sql.query['insert_%s' % name].replace('%s', self.sql.query['placeholder'])
+        c, inserts = self.get_cursor(), []
+        for k, item in bulk.iteritems():
+            if k[tix]:
+                c.execute(select_tour, list(k))
+            else:
+                c.execute(select_ring, list(k[:tix]) + list(k[tix+1:]))
+            result = c.fetchone()
+            if result:
+                c.execute(update, list(item) + [result[0]])
+            else:
+                inserts.append(list(k) + list(item))
+        if inserts:
+            self.executemany(c, insert, inserts)
+            
     def rebuild_caches(self):
         if self.callHud and self.cacheSessions:
             tables = ('HudCache','CardsCache', 'PositionsCache')
@@ -3726,6 +4214,7 @@ class Database:
         self.ttnew = set()
         self.wmold = set()
         self.wmnew = set()
+        self.cachejournal = {}
         
     def cleanRequired(self):
         if self.ttold or self.wmold:
@@ -3733,45 +4222,124 @@ class Database:
         return False
     
     def getSqlTourneyIDs(self, hand): 
-        result = None
-        c = self.get_cursor()
-        q = self.sql.query['getTourneyByTourneyNo']
-        q = q.replace('%s', self.sql.query['placeholder'])
+        """The Tourneys id of the hand's tourney. The Tourneys row is read or inserted for
+           the first hand only, new start and end times are written by flushTourneyCache."""
+        tour = self.getTourneyCache(hand.siteId, hand.tourNo)
         t = hand.startTime.replace(tzinfo=None)
-        c.execute (q, (hand.siteId, hand.tourNo))
+        if tour['id'] == None:
+            c = self.get_cursor()
+            q = self.sql.query['getTourneyByTourneyNo']
+            q = q.replace('%s', self.sql.query['placeholder'])
+            c.execute (q, (hand.siteId, hand.tourNo))
 
-        tmp = c.fetchone()
-        if (tmp == None): 
-            c.execute (self.sql.query['insertTourney'].replace('%s', self.sql.query['placeholder']),
-                        (hand.tourneyTypeId, None, hand.tourNo, None, None,
-                         t, t, hand.tourneyName, None, None, None, None, None, None))
-            result = self.get_last_insert_id(c)
-        else:
-            result = tmp[0]
+            tmp = c.fetchone()
+            if (tmp == None): 
+                c.execute (self.sql.query['insertTourney'].replace('%s', self.sql.query['placeholder']),
+                            (hand.tourneyTypeId, None, hand.tourNo, None, None,
+                             t, t, hand.tourneyName, None, None, None, None, None, None))
+                tour['id'] = self.get_last_insert_id(c)
+                tour['startTime'], tour['endTime'] = t, t
+                return tour['id']
+            tour['id'] = tmp[0]
             columnNames = [desc[0] for desc in c.description]
             resultDict = dict(zip(columnNames, tmp))
             if self.backend == self.PGSQL:
-                startTime, endTime = resultDict['starttime'], resultDict['endtime']
+                tour['startTime'], tour['endTime'] = resultDict['starttime'], resultDict['endtime']
             else:
-                startTime, endTime = resultDict['startTime'], resultDict['endTime']
+                tour['startTime'], tour['endTime'] = resultDict['startTime'], resultDict['endTime']
                 
-            if (startTime == None or t < startTime):
-                q = self.sql.query['updateTourneyStart'].replace('%s', self.sql.query['placeholder'])
-                c.execute(q, (t, result))
-            elif (endTime == None or t > endTime):
-                q = self.sql.query['updateTourneyEnd'].replace('%s', self.sql.query['placeholder'])
-                c.execute(q, (t, result))                
+        if (tour['startTime'] == None or t < tour['startTime']):
+            tour['startTime'] = t
+            tour['changed'].add('startTime')
+        elif (tour['endTime'] == None or t > tour['endTime']):
+            tour['endTime'] = t
+            tour['changed'].add('endTime')
+        return tour['id']
+
+    def flushTourneyCache(self):
+        """Write the start and end times the hands of the cached tourneys moved. The updates
+           only ever widen a tourney, should another importer have widened it meanwhile."""
+        if not self.tcache:
+            return
+        c = self.get_cursor()
+        updateStart = self.sql.query['updateTourneyStart'].replace('%s', self.sql.query['placeholder'])
+        updateEnd = self.sql.query['updateTourneyEnd'].replace('%s', self.sql.query['placeholder'])
+        for tour in self.tcache.itervalues():
+            if 'startTime' in tour['changed']:
+                c.execute(updateStart, (tour['startTime'], tour['id'], tour['startTime']))
+            if 'endTime' in tour['changed']:
+                c.execute(updateEnd, (tour['endTime'], tour['id'], tour['endTime']))
+            tour['changed'].clear()
+
+    def prepTourneySummaries(self, summaries):
+        """Read the players, TourneyTypes, Tourneys and TourneysPlayers rows of summaries into
+           pcache and tcache ahead of TourneySummary.insertOrUpdate, a few queries per site
+           for the lot rather than several for each summary"""
+        self.prepSqlPlayerIDs(summaries)
+        sites = {}      # siteId: {siteTourneyNo: tourNo as in the summary}
+        for summary in summaries:
+            try:
+                sites.setdefault(summary.siteId, {})[long(summary.tourNo)] = summary.tourNo
+            except (TypeError, ValueError):
+                pass    # looked up by insertOrUpdate
+        
+        c = self.get_cursor()
+        selectTypes = self.sql.query['getTourneyTypesByTourneyNos'].replace('%s', self.sql.query['placeholder'])
+        selectTourneys = self.sql.query['getTourneysByTourneyNos'].replace('%s', self.sql.query['placeholder'])
+        tours = {}      # Tourneys id: tcache entry
+        for site_id, tourNos in sites.iteritems():
+            nos = tourNos.keys()
+            for i in xrange(0, len(nos), self.DUPE_BATCH):
+                batch = nos[i:i+self.DUPE_BATCH]
+                marks = ', '.join([self.sql.query['placeholder']] * len(batch))
+                c.execute(selectTypes.replace('<tourNos>', marks), [site_id] + batch)
+                columnNames = [desc[0].lower() for desc in c.description]
+                for row in c.fetchall():
+                    tour = self.getTourneyCache(site_id, tourNos[long(row[0])])
+                    tour['type'] = dict(zip(columnNames[1:], row[1:]))
+                c.execute(selectTourneys.replace('<tourNos>', marks), [site_id] + batch)
+                columnNames = [desc[0] for desc in c.description]
+                tourNoIdx = [name.lower() for name in columnNames].index('sitetourneyno')
+                for row in c.fetchall():
+                    tour = self.getTourneyCache(site_id, tourNos[long(row[tourNoIdx])])
+                    tour['tourney'] = dict(zip(columnNames, row))
+                    tour['players'] = {}
+                    tours[row[0]] = tour
+        
+        for (tourneyId, players) in self.fetchTourneysPlayers(c, tours.keys()).iteritems():
+            tours[tourneyId]['players'] = players
+
+    def fetchTourneysPlayers(self, c, tourneyIds):
+        """{tourneyId: {(playerId, entryId): TourneysPlayers row as a dict}} of the tourneys in tourneyIds"""
+        result = {}
+        q = self.sql.query['getTourneysPlayersByTourneyIds']
+        for i in xrange(0, len(tourneyIds), self.DUPE_BATCH):
+            batch = tourneyIds[i:i+self.DUPE_BATCH]
+            c.execute(q.replace('<tourneyIds>', ', '.join([self.sql.query['placeholder']] * len(batch))), batch)
+            columnNames = [desc[0] for desc in c.description]
+            for row in c.fetchall():
+                # id, tourneyId, playerId, entryId, ...
+                result.setdefault(row[1], {})[(row[2], row[3])] = dict(zip(columnNames, row))
         return result
     
-    def createOrUpdateTourney(self, summary):
+    def createOrUpdateTourney(self, summary, tour = None):
+        """Returns the Tourneys id of summary, and 'insert' or 'update' when the row was
+           written. tour is the tcache entry of the tourney, see prepTourneySummaries."""
         cursor = self.get_cursor()
-        q = self.sql.query['getTourneyByTourneyNo'].replace('%s', self.sql.query['placeholder'])
-        cursor.execute(q, (summary.siteId, summary.tourNo))
+        change = None
+        if tour is not None and tour['tourney'] is not None:
+            resultDict = tour['tourney']
+        else:
+            q = self.sql.query['getTourneyByTourneyNo'].replace('%s', self.sql.query['placeholder'])
+            cursor.execute(q, (summary.siteId, summary.tourNo))
 
-        columnNames=[desc[0] for desc in cursor.description]
-        result=cursor.fetchone()
+            columnNames=[desc[0] for desc in cursor.description]
+            result=cursor.fetchone()
+            resultDict = None
+            if result != None:
+                resultDict = dict(zip(columnNames, result))
 
-        if result != None:
+        if resultDict != None:
             if self.backend == self.PGSQL:
                 expectedValues = (('comment','comment'), ('tourneyName','tourneyname')
                         ,('totalRebuyCount','totalrebuycount'), ('totalAddOnCount','totaladdoncount')
@@ -3783,7 +4351,6 @@ class Database:
                         ,('prizepool','prizepool'), ('startTime','startTime'), ('entries','entries')
                         ,('commentTs','commentTs'), ('endTime','endTime'), ('added', 'added'), ('addedCurrency', 'addedCurrency'))
             updateDb=False
-            resultDict = dict(zip(columnNames, result))
 
             tourneyId = resultDict["id"]
             for ev in expectedValues :
@@ -3804,6 +4371,7 @@ class Database:
                        summary.added, summary.addedCurrency, tourneyId
                       )
                 cursor.execute(q, row)
+                change = 'update'
         else:
             startTime, endTime = None, None
             if (summary.startTime!=None): startTime = summary.startTime.replace(tzinfo=None)
@@ -3819,7 +4387,13 @@ class Database:
                 print ("###### End Tourneys ########")
             cursor.execute (self.sql.query['insertTourney'].replace('%s', self.sql.query['placeholder']), row)
             tourneyId = self.get_last_insert_id(cursor)
-        return tourneyId
+            change = 'insert'
+            if tour is not None:
+                tour['players'] = {}
+        if self.tcache:
+            # another summary or hand of the tourney reads its rows again
+            self.tcache.pop((summary.siteId, summary.tourNo), None)
+        return (tourneyId, change)
     #end def createOrUpdateTourney
 
     def getTourneyPlayerInfo(self, siteName, tourneyNo, playerName):
@@ -3838,32 +4412,36 @@ class Database:
     def getSqlTourneysPlayersIDs(self, hand):
         result = {}
         if(self.tpcache == None):
-            self.tpcache = LambdaDict(lambda  key:self.insertTourneysPlayers(key[0], key[1], key[2]))
+            self.tpcache = {}       # tourneyId --> {(playerId, entryId): TourneysPlayers id}
+        tplayers = self.tpcache.get(hand.tourneyId)
+        if tplayers is None:
+            tplayers = self.tpcache[hand.tourneyId] = self.fetchTourneysPlayersIds(hand.tourneyId)
+
+        missing = [hand.dbid_pids[player[1]] for player in hand.players
+                   if (hand.dbid_pids[player[1]], hand.entryId) not in tplayers]
+        if missing:
+            self.insertTourneysPlayers(hand.tourneyId, hand.entryId, missing)
+            tplayers.update(self.fetchTourneysPlayersIds(hand.tourneyId))
 
         for player in hand.players:
             playerId = hand.dbid_pids[player[1]]
-            result[player[1]] = self.tpcache[(playerId,hand.tourneyId,hand.entryId)]
+            result[player[1]] = tplayers[(playerId, hand.entryId)]
 
         return result
     
-    def insertTourneysPlayers(self, playerId, tourneyId, entryId):
-        result = None
+    def fetchTourneysPlayersIds(self, tourneyId):
         c = self.get_cursor()
-        q = self.sql.query['getTourneysPlayersByIds']
+        q = self.sql.query['getTourneysPlayersIdsByTourney']
         q = q.replace('%s', self.sql.query['placeholder'])
+        c.execute (q, (tourneyId,))
+        return dict(((playerId, entryId), id) for (id, playerId, entryId) in c.fetchall())
 
-        c.execute (q, (tourneyId, playerId, entryId))
-
-        tmp = c.fetchone()
-        if (tmp == None): #new player
-            c.execute (self.sql.query['insertTourneysPlayer'].replace('%s',self.sql.query['placeholder'])
-                      ,(tourneyId, playerId, entryId, None, None, None, None, None, None))
-            #Get last id might be faster here.
-            #c.execute ("SELECT id FROM Players WHERE name=%s", (name,))
-            result = self.get_last_insert_id(c)
-        else:
-            result = tmp[0]
-        return result
+    def insertTourneysPlayers(self, tourneyId, entryId, playerIds):
+        """Insert the TourneysPlayers rows of the new players of a tourney in one go"""
+        c = self.get_cursor()
+        q = self.sql.query['insertTourneysPlayer'].replace('%s',self.sql.query['placeholder'])
+        self.executemany(c, q, [(tourneyId, playerId, entryId, None, None, None, None, None, None)
+                                for playerId in playerIds])
     
     def updateTourneyPlayerBounties(self, hand):
         updateDb = False
@@ -3879,22 +4457,21 @@ class Database:
                 updateDb = True
         if updateDb: self.commit()
     
-    def createOrUpdateTourneysPlayers(self, summary):
-        tourneysPlayersIds, tplayers, inserts = {}, [], []
+    def createOrUpdateTourneysPlayers(self, summary, tour = None):
+        """Insert or update the TourneysPlayers rows of summary, returns how many of each.
+           tour is the tcache entry of the tourney, see prepTourneySummaries."""
+        tourneysPlayersIds, inserts, updates = {}, [], []
         cursor = self.get_cursor()
-        cursor.execute (self.sql.query['getTourneysPlayersByTourney'].replace('%s', self.sql.query['placeholder']),
-                            (summary.tourneyId,))
-        result=cursor.fetchall()
-        if result: tplayers += [i for i in result]
+        if tour is not None and tour['players'] is not None:
+            tplayers = tour['players']
+        else:
+            tplayers = self.fetchTourneysPlayers(cursor, [summary.tourneyId]).get(summary.tourneyId, {})
         for player, entries in summary.players.iteritems():
             playerId = summary.dbid_pids[player]
             for entryIdx in range(len(entries)):
                 entryId = entries[entryIdx]
                 if (playerId,entryId) in tplayers:
-                    cursor.execute (self.sql.query['getTourneysPlayersByIds'].replace('%s', self.sql.query['placeholder']),
-                                    (summary.tourneyId, playerId, entryId))
-                    columnNames=[desc[0] for desc in cursor.description]
-                    result=cursor.fetchone()
+                    resultDict = tplayers[(playerId,entryId)]
                     if self.backend == self.PGSQL:
                         expectedValues = (('rank','rank'), ('winnings', 'winnings')
                                 ,('winningsCurrency','winningscurrency'), ('rebuyCount','rebuycount')
@@ -3904,8 +4481,7 @@ class Database:
                                 ,('winningsCurrency','winningsCurrency'), ('rebuyCount','rebuyCount')
                                 ,('addOnCount','addOnCount'), ('koCount','koCount'))
                     updateDb=False
-                    resultDict = dict(zip(columnNames, result))
-                    tourneysPlayersIds[(player,entryId)]=result[0]
+                    tourneysPlayersIds[(player,entryId)]=resultDict['id']
                     for ev in expectedValues :
                         summaryAttribute=ev[0]
                         if ev[0]!="winnings" and ev[0]!="winningsCurrency":
@@ -3917,19 +4493,14 @@ class Database:
                         elif summaryDict[player][entryIdx]!=None and not resultDict[ev[1]]:#object has this value but DB doesnt, so update DB
                             updateDb=True
                     if updateDb:
-                        q = self.sql.query['updateTourneysPlayer'].replace('%s', self.sql.query['placeholder'])
-                        inputs = (summary.ranks[player][entryIdx],
+                        updates.append((summary.ranks[player][entryIdx],
                                   summary.winnings[player][entryIdx],
                                   summary.winningsCurrency[player][entryIdx],
                                   summary.rebuyCounts[player][entryIdx],
                                   summary.addOnCounts[player][entryIdx],
                                   summary.koCounts[player][entryIdx],
                                   tourneysPlayersIds[(player,entryId)]
-                                 )
-                        #print q
-                        #pp = pprint.PrettyPrinter(indent=4)
-                        #pp.pprint(inputs)
-                        cursor.execute(q, inputs)
+                                 ))
                 else:
                     inserts.append((
                         summary.tourneyId, 
@@ -3942,8 +4513,11 @@ class Database:
                         summary.addOnCounts[player][entryIdx],
                         summary.koCounts[player][entryIdx]
                     ))
+        if updates:
+            cursor.executemany(self.sql.query['updateTourneysPlayer'].replace('%s', self.sql.query['placeholder']), updates)
         if inserts:
             self.executemany(cursor, self.sql.query['insertTourneysPlayer'].replace('%s', self.sql.query['placeholder']), inserts)
+        return (len(inserts), len(updates))
             
     
 #end class Database
@@ -3991,6 +4565,267 @@ if __name__=="__main__":
     print _("Press ENTER to continue.")
     sys.stdin.readline()
 
+class HandFilter:
+    """A Bloom filter of the (siteHandNo, siteId[, heroSeat]) keys of the hands in the db, saved
+       between imports. A hand the filter has never seen is new and needs no duplicate query,
+       a hand it may have seen is still looked up (see Database.checkDuplicates).
+
+       The id of the last hand added is saved with the filter, and sync() adds any hand
+       stored since, e.g. by an import with the filter off. A filter newer than the db,
+       full, or built for the other publicDB setting is rebuilt from Hands."""
+
+    def __init__(self, path, publicDB, error_rate = 0.01):
+        self.path = path
+        self.publicDB = publicDB
+        self.error_rate = error_rate
+        self.dirty = False
+        self.reset(0)
+        try:
+            with open(path, 'rb') as f:
+                state = cPickle.load(f)
+            if state['publicDB'] == publicDB and state['error_rate'] == error_rate:
+                self.__dict__.update(state)
+        except (IOError, EOFError, KeyError, TypeError, cPickle.UnpicklingError):
+            pass
+
+    def reset(self, capacity):
+        self.capacity = max(1000000, capacity)
+        self.m = int(-self.capacity * math.log(self.error_rate) / math.log(2)**2)
+        self.k = max(1, int(round(self.m * math.log(2) / self.capacity)))
+        self.bits = bytearray((self.m + 7) / 8)
+        self.count = 0
+        self.lastId = 0
+
+    def key(self, siteHandNo, siteId, heroSeat):
+        if self.publicDB:
+            return (long(siteHandNo), siteId, heroSeat)
+        return (long(siteHandNo), siteId)
+
+    def _positions(self, key):
+        a, b = struct.unpack('<QQ', hashlib.md5(repr(key)).digest())
+        return [(a + i * b) % self.m for i in xrange(self.k)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+        self.dirty = True
+
+    def __contains__(self, key):
+        for p in self._positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def sync(self, db):
+        lastId = db.get_last_hand() or 0
+        if lastId < self.lastId or self.count > self.capacity:
+            log.info(_("Rebuilding the duplicate hand filter"))
+            self.reset(2 * max(self.count, lastId))
+        if lastId > self.lastId:
+            for (siteHandNo, siteId, heroSeat) in db.get_hand_keys(self.lastId):
+                self.add(self.key(siteHandNo, siteId, heroSeat))
+            self.lastId = lastId
+        db.commit()
+
+    def save(self, db):
+        """Bring the filter up to date with db and write it out"""
+        self.sync(db)
+        if not self.dirty:
+            return
+        state = dict((k, getattr(self, k)) for k in ('publicDB', 'error_rate', 'capacity', 'm', 'k', 'bits', 'count', 'lastId'))
+        try:
+            with open(self.path + '.tmp', 'wb') as f:
+                cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(self.path + '.tmp', self.path)
+            self.dirty = False
+        except (IOError, OSError), e:
+            log.error(_("Could not save the duplicate hand filter %s: %s") % (self.path, e))
+
+class SessionIntervals:
+    """The hero's sessions of one bulk import, sorted by sessionStart so the sessions within
+       reach of a hand are found by bisection, with an index of the tourneys played in each.
+
+       Sessions never overlap, so their ends are sorted too. A session stretched to a
+       tourney hand outside its time window is merged with any session it comes to cover."""
+
+    def __init__(self):
+        self.starts   = []      # sessionStart of each session, sorted
+        self.sessions = []      # session dicts in the same order
+        self.tourneys = {}      # tourneyId: session
+        self.seq      = 0       # creation order, the order sessions are written in
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _index(self, session):
+        i = bisect.bisect_left(self.starts, session['sessionStart'])
+        while self.sessions[i] is not session:
+            i += 1
+        return i
+
+    def find(self, lower, upper, tid = None):
+        """Sessions overlapping [lower, upper] or holding tourney tid, in start order"""
+        found = []
+        i = bisect.bisect_right(self.starts, upper) - 1
+        while i >= 0 and self.sessions[i]['sessionEnd'] >= lower:
+            found.append(self.sessions[i])
+            i -= 1
+        found.reverse()
+        session = self.tourneys.get(tid)
+        if session is not None and not [s for s in found if s is session]:
+            found.append(session)
+            found.sort(key=lambda s: s['sessionStart'])
+        return found
+
+    def add(self, session):
+        if 'seq' not in session:
+            session['seq'] = self.seq
+            self.seq += 1
+        i = bisect.bisect_right(self.starts, session['sessionStart'])
+        self.starts.insert(i, session['sessionStart'])
+        self.sessions.insert(i, session)
+        for t in session['tourneys']:
+            self.tourneys[t] = session
+
+    def remove(self, session):
+        i = self._index(session)
+        del self.starts[i]
+        del self.sessions[i]
+        for t in session['tourneys']:
+            if self.tourneys.get(t) is session:
+                del self.tourneys[t]
+
+    def merge(self, sessions):
+        """One session spanning all of sessions (already removed from the index)"""
+        if len(sessions) == 1:
+            return sessions[0]
+        merged = {'ids': [], 'tourneys': set()}
+        for h in sessions:
+            if not merged.get('sessionStart') or merged.get('sessionStart') > h['sessionStart']:
+                merged['sessionStart'] = h['sessionStart']
+                merged['weekStart'] = h['weekStart']
+                merged['monthStart'] = h['monthStart']
+            if not merged.get('sessionEnd') or merged.get('sessionEnd') < h['sessionEnd']:
+                merged['sessionEnd'] = h['sessionEnd']
+            merged['ids'] += h['ids']
+            merged['tourneys'] |= h['tourneys']
+        return merged
+
+    def ordered(self):
+        return sorted(self.sessions, key=lambda s: s['seq'])
+
+class HudStatStore:
+    """Stats of the players seen by the HUD, as get_stats_from_hand_aggregated returns them,
+       kept up to date in memory from the HudCache lines the importer sends with each hand.
+
+       Entries are keyed by (player id, gametype id, seats_min, seats_max, styleKey, agg_bb_mult)
+       and are loaded from the db the first time a player is seen with these hud params.
+       After that a new hand only costs adding its lines to the entries of its players.
+       A 'last N days' stat range moves its styleKey on every day (see init_hud_stat_vars),
+       the entry of the previous window is then dropped and the new one loaded from the db.
+       The store is shared by the read_stdin thread, which adds every hand as it is received
+       (coalesced hands included), and the HUD worker threads."""
+
+    def __init__(self, sql, keep = 500):
+        self.columns = []       # (index in CACHE_KEYS, stat name)
+        for col, name in re.findall(r"sum\(hc\.(\w+)\)\s+AS\s+(\w+)", sql.query['get_stats_from_hand_aggregated']):
+            if col in CACHE_KEYS:
+                self.columns.append((CACHE_KEYS.index(col), name.lower()))
+            else:
+                log.debug("HudStatStore: %s is not in CACHE_KEYS, %s keeps its queried value" % (col, name))
+        self.entries = {}       # key: stats row
+        self.current = {}       # key: id of the last hand included in the entry
+        self.players = {}       # player id: set of keys
+        self.windows = {}       # key without its styleKey: styleKey of the entry held
+        self.gametypes = {}     # (gametype id, agg_bb_mult): ids of the gametypes aggregated
+        self.recent = []        # (hand id, deltas) of the last hands received, see load
+        self.keep = keep
+        self.lock = threading.Lock()
+
+    def has_gametypes(self, gametypeId, agg_bb_mult):
+        return (gametypeId, agg_bb_mult) in self.gametypes
+
+    def set_gametypes(self, gametypeId, agg_bb_mult, gametypes):
+        self.gametypes[(gametypeId, agg_bb_mult)] = gametypes
+
+    def add_hand(self, hand_id, deltas):
+        """Add the lines of a newly imported hand to the entries of its players"""
+        self.lock.acquire()
+        try:
+            self.recent.append((hand_id, deltas))
+            if len(self.recent) > self.keep:
+                del self.recent[0]
+            for pid, delta in deltas['players'].iteritems():
+                for k in self.players.get(pid, ()):
+                    self._add(k, hand_id, deltas, delta)
+        finally:
+            self.lock.release()
+
+    def _add(self, k, hand_id, deltas, delta):
+        if hand_id <= self.current[k]:
+            return
+        self.current[k] = hand_id
+        (pid, gametypeId, seats_min, seats_max, stylekey, agg_bb_mult) = k
+        if (deltas['gametypeId'] in self.gametypes.get((gametypeId, agg_bb_mult), ())
+            and seats_min <= deltas['seats'] <= seats_max
+            and deltas['styleKey'] > stylekey):
+            entry = self.entries[k]
+            for idx, name in self.columns:
+                entry[name] = (entry[name] or 0) + delta[idx+1]
+            entry['bigblind'] = (entry['bigblind'] or 0) + deltas['bigblind']
+
+    def _drop_moved(self, k):
+        """Drop the entry of k's player and params held for another styleKey, a date window
+           that has moved on"""
+        params = k[:4] + k[5:]
+        stylekey = self.windows.get(params)
+        if stylekey is not None and stylekey != k[4]:
+            old = k[:4] + (stylekey,) + k[5:]
+            self.entries.pop(old, None)
+            self.current.pop(old, None)
+            self.players.get(k[0], set()).discard(old)
+        self.windows[params] = k[4]
+
+    def get_stats(self, hero_id, deltas, h_key, key):
+        """stat_dict for the players of a hand, None unless all of them are held"""
+        self.lock.acquire()
+        try:
+            stat_dict = {}
+            for pid, delta in deltas['players'].iteritems():
+                k = (pid,) + (h_key if pid == hero_id else key)
+                self._drop_moved(k)
+                if k not in self.entries:
+                    return None
+                stat_dict[pid] = dict(self.entries[k])
+                stat_dict[pid]['seat'] = delta[0]
+            return stat_dict
+        finally:
+            self.lock.release()
+
+    def load(self, last_hand, hero_id, h_key, key, stat_dict):
+        """Hold the stats queried for a hand. last_hand is the latest hand in the db before
+           the query, the lines of later hands received since are added again"""
+        self.lock.acquire()
+        try:
+            keys = {}
+            for pid, row in stat_dict.iteritems():
+                k = (pid,) + (h_key if pid == hero_id else key)
+                self._drop_moved(k)
+                self.entries[k] = dict(row)
+                self.current[k] = last_hand or 0
+                self.players.setdefault(pid, set()).add(k)
+                keys[pid] = k
+            for hand_id, deltas in self.recent:
+                for pid, delta in deltas['players'].iteritems():
+                    if pid in keys:
+                        self._add(keys[pid], hand_id, deltas, delta)
+        finally:
+            self.lock.release()
+
+
 #Code borrowed from http://push.cx/2008/caching-dictionaries-in-python-vs-ruby
 class LambdaDict(dict):
     def __init__(self, l):
@@ -21,8 +21,13 @@ _ = L10n.get_translation()
 import Card
 from decimal_wrapper import Decimal, ROUND_DOWN
 
+import os
 import sys
 import logging
+import threading
+import cPickle
+from collections import OrderedDict
+from itertools import permutations
 # logging has been set up in fpdb.py or HUD_main.py, use their settings:
 log = logging.getLogger("parser")
 
@@ -30,8 +35,114 @@ try:
     from pokereval import PokerEval
     pokereval = PokerEval()
 except:
-    pokereval = None
-    
+    try:
+        from HandEvaluator import HandEvaluator
+        pokereval = HandEvaluator()
+    except ImportError:
+        pokereval = None
+
+SUIT_PERMUTATIONS = [dict(zip('hdcs', p)) for p in permutations('hdcs')]
+
+class EquityCache:
+    """All-in equities already worked out by getAllInEV, shared by every hand of every import.
+
+       Equity doesn't change under a relabelling of the suits or an exchange of seats, so
+       results are keyed by the smallest suit relabelling of (game, sorted pockets, dead, board)
+       and AhAs v KdKc, KsKh v AcAd etc. are evaluated once. With a path the cache is saved
+       between imports; the oldest entries are dropped past size. A parser process collects
+       the equities it works out and hands them to the importer, which merges and saves them."""
+
+    def __init__(self, size = 200000):
+        self.size = size
+        self.path = None
+        self.items = OrderedDict()
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.new = None     # equities worked out since the last found(), see collect
+
+    def load(self, path):
+        if path == self.path:
+            return
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                items = cPickle.load(f)
+            with self.lock:
+                items.update(self.items)
+                self.items = items
+        except (IOError, EOFError, TypeError, AttributeError, cPickle.UnpicklingError):
+            pass
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        try:
+            with self.lock:
+                with open(self.path + '.tmp', 'wb') as f:
+                    cPickle.dump(self.items, f, cPickle.HIGHEST_PROTOCOL)
+                self.dirty = False
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(self.path + '.tmp', self.path)
+        except (IOError, OSError), e:
+            log.error(_("Could not save the equity cache %s: %s") % (self.path, e))
+
+    def collect(self):
+        """Keep the equities worked out from now on for found()"""
+        with self.lock:
+            self.new = {}
+
+    def found(self):
+        """The equities worked out since collect() or the last call, key: evs"""
+        with self.lock:
+            (new, self.new) = (self.new or {}, {} if self.new is not None else None)
+        return new
+
+    def merge(self, items):
+        """Add the equities found() by another process"""
+        if not items:
+            return
+        with self.lock:
+            for key, evs in items.iteritems():
+                self.items[key] = evs
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+            self.dirty = True
+
+    def key(self, game, pockets, dead, board):
+        """Canonical key of a deal, and for each of its pockets the index of the original pocket"""
+        best = None
+        for suit in SUIT_PERMUTATIONS:
+            relabel = lambda cards: tuple(sorted([c[0] + suit.get(c[1], c[1]) for c in cards if c != '__']))
+            canon = sorted([(relabel(p), i) for i, p in enumerate(pockets)])
+            key = (game, tuple([c[0] for c in canon]), relabel(dead), relabel(board), board.count('__'))
+            if best is None or key < best[0]:
+                best = (key, [c[1] for c in canon])
+        return best
+
+    def equities(self, game, iterations, pockets, dead, board):
+        """The pokereval ev of each pocket"""
+        key, order = self.key(game, pockets, dead, board)
+        with self.lock:
+            evs = self.items.get(key)
+        if evs is None:
+            result = pokereval.poker_eval(game = game, iterations = iterations,
+                                          pockets = [pockets[i] for i in order], dead = dead, board = board)
+            evs = [e['ev'] for e in result['eval']]
+            with self.lock:
+                self.items[key] = evs
+                self.dirty = True
+                if self.new is not None:
+                    self.new[key] = evs
+                if len(self.items) > self.size:
+                    self.items.popitem(last=False)
+        equities = [0] * len(pockets)
+        for ev, i in zip(evs, order):
+            equities[i] = ev
+        return equities
+
+equity_cache = EquityCache()
+
 def _buildStatsInitializer():
     init = {}
     #Init vars that may not be used, but still need to be inserted.
@@ -538,6 +649,9 @@ class DerivedStats():
                 
     def getAllInEV(self, hand, evalgame, holeplayers, boards, streets, holecards):
         startstreet, potId, allInStreets, allplayers = None, 0, hand.allStreets[1:], []
+        stove = {}
+        for j in self.handsstove:
+            stove.setdefault(tuple(j[1:4]), []).append(j)
         for pot, players in hand.pot.pots:
             if potId ==0: pot += (sum(hand.pot.common.values()) + hand.pot.stp)
             potId+=1
@@ -559,14 +673,13 @@ class DerivedStats():
                     if len(players) == len(valid) and (board['allin'] or hand.publicDB):
                         if board['allin'] and not startstreet: startstreet = street
                         if len(valid) > 1:
-                            evs = pokereval.poker_eval(
-                                game = evalgame, 
-                                iterations = Card.iter[streetId],
-                                pockets = [holecards[p]['hole'] for p in valid],
-                                dead = deadcards, 
-                                board = [str(b) for b in board['board'][n]] + (5 - len(board['board'][n])) * ['__']
+                            equities = equity_cache.equities(
+                                evalgame,
+                                Card.iter[streetId],
+                                [holecards[p]['hole'] for p in valid],
+                                deadcards,
+                                [str(b) for b in board['board'][n]] + (5 - len(board['board'][n])) * ['__']
                             )
-                            equities = [e['ev'] for e in evs['eval']]
                         else:
                             equities = [1000]
                         remainder = (1000 - sum(equities)) / Decimal(len(equities))
@@ -578,8 +691,8 @@ class DerivedStats():
                                 rake = Decimal(0) if hand.cashedOut else (hand.rake * (Decimal(pot)/Decimal(hand.totalpot)))
                                 holecards[p]['eq'] += ((pot - rake) * equities[i])/Decimal(10)
                                 holecards[p]['committed'] = 100*hand.pot.committed[p] + 100*hand.pot.common[p]
-                            for j in self.handsstove:
-                                if [pid, streetId, boardId] == j[1:4] and len(valid) == len(hand.pot.contenders):
+                            if len(valid) == len(hand.pot.contenders):
+                                for j in stove.get((pid, streetId, boardId), []):
                                     j[-1] = equities[i]
         for p in holeplayers:
             if holecards[p]['committed'] != 0: 
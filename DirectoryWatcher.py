@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+"""DirectoryWatcher.py
+
+Tells the auto importer which files in the monitored directories changed.
+
+InotifyWatcher gets the changes from the kernel on Linux, so an idle HUD
+costs no syscalls and fileno() can be watched by the gtk main loop to
+import as soon as a hand is written. Elsewhere PollingWatcher stats the
+watched directories, to find new files, and the files changed since the
+watch started, instead of every file in the hand history folders.
+"""
+
+import L10n
+_ = L10n.get_translation()
+
+import os
+import sys
+import errno
+import struct
+import logging
+from time import time
+
+log = logging.getLogger("importer")
+
+RECENT = 43200  # files changed this many seconds before a directory is watched are imported, see Importer.addImportDirectory
+
+def recent_files(dir, recent = RECENT):
+    """The files below dir changed in the last recent seconds, with their (size, mtime)"""
+    files, now = {}, time()
+    for (path, dirs, names) in os.walk(dir):
+        for name in names:
+            file = os.path.join(path, name)
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+            if now - st.st_mtime <= recent:
+                files[file] = (st.st_size, st.st_mtime)
+    return files
+
+class PollingWatcher:
+    """Finds changed files by stat'ing the watched directories and the files seen changing.
+
+       A directory's mtime changes when a file is created in it, a file that is
+       written to shows a new size or mtime. Files that were last changed before
+       the directory was watched are not stat'ed again."""
+
+    def __init__(self):
+        self.dirs = {}      # directory --> mtime
+        self.files = {}     # file --> (size, mtime)
+
+    def fileno(self):
+        return None
+
+    def add(self, dir):
+        for (path, dirs, names) in os.walk(dir):
+            if path not in self.dirs:
+                self.dirs[path] = os.stat(path).st_mtime
+        for (file, stamp) in recent_files(dir).iteritems():
+            self.files.setdefault(file, stamp)
+
+    def changes(self):
+        """The files created, changed or removed since the last call"""
+        changed = set()
+        for (dir, mtime) in self.dirs.items():
+            try:
+                st = os.stat(dir)
+            except OSError:
+                del self.dirs[dir]
+                continue
+            if st.st_mtime == mtime:
+                continue
+            self.dirs[dir] = st.st_mtime
+            for name in os.listdir(dir):
+                path = os.path.join(dir, name)
+                if os.path.isdir(path):
+                    if path not in self.dirs:
+                        self.add(path)
+                        changed.update(recent_files(path))
+                elif path not in self.files:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if time() - st.st_mtime <= RECENT:
+                        self.files[path] = (-1, -1)     # reported below
+        for (file, stamp) in self.files.items():
+            try:
+                st = os.stat(file)
+            except OSError:
+                del self.files[file]
+                changed.add(file)
+                continue
+            if (st.st_size, st.st_mtime) != stamp:
+                self.files[file] = (st.st_size, st.st_mtime)
+                changed.add(file)
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Collects the inotify events of the watched directories and their subdirectories."""
+
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x8, 0x40, 0x80
+    IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_Q_OVERFLOW = 0x100, 0x200, 0x400, 0x4000
+    IN_IGNORED, IN_ISDIR = 0x8000, 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT = struct.Struct('iIII')   # wd, mask, cookie, len of the name following it
+
+    def __init__(self):
+        import ctypes, ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.wds = {}       # watch descriptor --> directory
+        self.roots = []     # directories given to add(), rescanned when the event queue overflowed
+
+    def fileno(self):
+        return self.fd
+
+    def add(self, dir):
+        if dir not in self.roots:
+            self.roots.append(dir)
+        for (path, dirs, names) in os.walk(dir):
+            self._watch(path)
+
+    def _watch(self, dir):
+        if dir in self.wds.itervalues():
+            return
+        wd = self.libc.inotify_add_watch(self.fd, dir.encode(sys.getfilesystemencoding() or 'utf-8') if isinstance(dir, unicode) else dir, self.MASK)
+        if wd < 0:
+            log.warning(_("Could not watch directory %s") % dir)
+        else:
+            self.wds[wd] = dir
+
+    def changes(self):
+        """The files created, changed or removed since the last call"""
+        changed = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not buf:
+                break
+            pos = 0
+            while pos < len(buf):
+                (wd, mask, cookie, length) = self.EVENT.unpack_from(buf, pos)
+                name = buf[pos + self.EVENT.size:pos + self.EVENT.size + length].rstrip('\0')
+                pos += self.EVENT.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    # events were lost, fall back to what a poll would have found
+                    for root in self.roots:
+                        changed.update(recent_files(root))
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.wds.pop(wd, None)
+                    continue
+                if wd not in self.wds or not name:
+                    continue
+                dir = self.wds[wd]
+                if isinstance(dir, unicode):
+                    name = name.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+                path = os.path.join(dir, name)
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        # files may be written to it before the watch is added
+                        for (subdir, dirs, names) in os.walk(path):
+                            self._watch(subdir)
+                        changed.update(recent_files(path))
+                else:
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def watcher():
+    """An InotifyWatcher where the os has inotify, a PollingWatcher otherwise"""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError, TypeError), e:
+        log.info(_("inotify not available (%s), polling the import directories") % e)
+        return PollingWatcher()
@@ -45,10 +45,13 @@ log = logging.getLogger("importer")
 if os.name == "nt":
     import win32console
 
+WATCH_DELAY = 250   # ms between a hh file changing and importing it, a hand is written in several pieces
+
 
 class GuiAutoImport:
     def __init__(self, settings, config, sql = None, parent = None, cli = False):
         self.importtimer = 0
+        self.watchsource = 0    # gobject source waiting for the importer's watcher, see watch_files
         self.settings = settings
         self.config = config
         self.sql = sql
@@ -193,6 +196,24 @@ class GuiAutoImport:
             return True
         return False
 
+    def watch_files(self):
+        """Import as soon as a file changes, if the importer's watcher can tell when that happens.
+           The import timer keeps running for the watchers that can't."""
+        fd = self.importer.watcher.fileno() if self.importer.watcher else None
+        if fd is not None and self.watchsource == 0:
+            self.watchsource = gobject.io_add_watch(fd, gobject.IO_IN, self.files_changed)
+
+    def files_changed(self, source, condition):
+        self.watchsource = 0
+        gobject.timeout_add(WATCH_DELAY, self.import_changed)
+        return False
+
+    def import_changed(self):
+        if self.doAutoImportBool:
+            self.do_import()
+            self.watch_files()
+        return False
+
     def reset_startbutton(self):
         if self.pipe_to_hud is not None:
             self.startButton.set_label(_(u'Stop _Auto Import'))
@@ -294,6 +315,7 @@ class GuiAutoImport:
                     if self.importtimer != 0:
                         gobject.source_remove(self.importtimer)
                     self.importtimer = gobject.timeout_add(interval * 1000, self.do_import)
+                    self.watch_files()
 
             else:
                 self.addText("\n" + _("Auto Import aborted.") + _("Global lock not available."))
@@ -301,6 +323,9 @@ class GuiAutoImport:
             self.doAutoImportBool = False # do_import will return this and stop the gobject callback timer
             self.importer.autoSummaryGrab(True)
             gobject.source_remove(self.importtimer)
+            if self.watchsource != 0:
+                gobject.source_remove(self.watchsource)
+                self.watchsource = 0
             self.settings['global_lock'].release()
             self.addText("\n" + _("Stopping Auto Import.") + _("Global lock released."))
             if self.pipe_to_hud.poll() is not None:
@@ -76,6 +76,8 @@ class GuiBulkImport():
                 #    get the import settings from the gui and save in the importer
                 
                 self.importer.setHandsInDB(self.n_hands_in_db)
+                if self.allowThreads:
+                    self.importer.setThreads(self.spin_threads.get_value_as_int())
                 self.importer.setMode('bulk')
 
                 sitename = 'auto'
@@ -152,6 +154,14 @@ class GuiBulkImport():
         self.table.attach(self.load_button, 2, 3, 1, 2, xpadding=0, ypadding=0, yoptions=gtk.SHRINK)
         self.load_button.show()
 
+#    spin button - threads
+        if self.allowThreads:
+            self.spin_threads = gtk.SpinButton(gtk.Adjustment(value=1, lower=1, upper=16, step_incr=1,
+                                                              page_incr=1, page_size=0), climb_rate=0.0, digits=0)
+            self.spin_threads.set_tooltip_text(_("Number of processes used to parse the files"))
+            self.table.attach(self.spin_threads, 0, 1, 1, 2, xpadding=0, ypadding=0, yoptions=gtk.SHRINK)
+            self.spin_threads.show()
+
 #    label - info
 
         self.progressbar = gtk.ProgressBar()
@@ -213,10 +223,20 @@ def main(argv=None):
         importer.setFTPArchive(True)
     if options.testData:
         importer.setPrintTestData(True)
-    (stored, dups, partial, errs, ttime) = importer.runImport()
+    if options.threads > 1:
+        importer.setThreads(options.threads)
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        (stored, dups, partial, skipped, errs, ttime) = profiler.runcall(importer.runImport)
+        profiler.dump_stats(options.profile)
+    else:
+        (stored, dups, partial, skipped, errs, ttime) = importer.runImport()
     importer.clearFileList()
-    print(_('Bulk import done: Stored: %d, Duplicates: %d, Partial: %d, Errors: %d, Time: %s seconds, Stored/second: %.0f')\
-                     % (stored, dups, partial, errs, ttime, (stored+0.0) / ttime))
+    print(_('Bulk import done: Stored: %d, Duplicates: %d, Partial: %d, Skipped: %d, Errors: %d, Time: %s seconds, Stored/second: %.0f')\
+                     % (stored, dups, partial, skipped, errs, ttime, (stored+0.0) / ttime))
+    if options.timings:
+        print importer.timer
 
 
 if __name__ == '__main__':
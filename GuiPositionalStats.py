@@ -25,6 +25,7 @@ from time import time, strftime
 import Database
 import Filters
 import Charset
+import AsyncQuery
 
 class GuiPositionalStats:
     def __init__(self, config, querylist, debug=True):
@@ -38,6 +39,8 @@ class GuiPositionalStats:
         # create new db connection to avoid conflicts with other threads
         self.db = Database.Database(self.conf, sql=self.sql)
         self.cursor = self.db.cursor
+        # the stats queries run on a connection of their own, see createStatsTable
+        self.runner = AsyncQuery.QueryRunner(self.conf, self.sql)
 
         settings = {}
         settings.update(self.conf.get_db_parameters())
@@ -138,6 +141,7 @@ class GuiPositionalStats:
         print (_("DEBUG:") + " " + _("activesite set to %s") % (self.activesite))
 
     def refreshStats(self, widget, data):
+        self.runner.cancel()
         try: self.stats_vbox.destroy()
         except AttributeError: pass
         self.stats_vbox = gtk.VBox(False, 0)
@@ -178,19 +182,15 @@ class GuiPositionalStats:
 
     def createStatsTable(self, vbox, playerids, sitenos, limits, seats, dates):
 
-        starttime = time()
+        self.starttime = time()
         colalias,colshow,colheading,colxalign,colformat = 0,1,2,3,4
-        row = 0
         col = 0
 
         tmp = self.sql.query['playerStatsByPosition']
         tmp = self.refineQuery(tmp, playerids, sitenos, limits, seats, dates)
         #print "DEBUG:\n%s" % tmp
-        self.cursor.execute(tmp)
-        result = self.cursor.fetchall()
-        colnames = [desc[0].lower() for desc in self.cursor.description]
 
-        liststore = gtk.ListStore(*([str] * len(colnames)))
+        self.liststore = liststore = gtk.ListStore(*([str] * len(self.posncols)))
         view = gtk.TreeView(model=liststore)
         view.set_grid_lines(gtk.TREE_VIEW_GRID_LINES_BOTH)
         vbox.pack_start(view, expand=False, padding=3)
@@ -245,23 +245,37 @@ class GuiPositionalStats:
         #        listcols[col].set_expand(True)
         #        #listcols[col].set_alignment(column[colxalign]) # no effect?
 
-        rows = len(result)
+        # rows are added as the queries return them, totals at the bottom
+        self.last_game, self.last_seats, self.position_rows = "", "", 0
+        self.runner.run(tmp, page = self.addPositionRows, done = self.addBlankRow)
+        tmp = self.sql.query['playerStats']
+        tmp = self.refineQuery(tmp, playerids, sitenos, limits, seats, dates)
+        #print "DEBUG:\n%s" % tmp
+        self.runner.run(tmp, page = self.addTotalRows, done = self.statsLoaded)
+        vbox.show_all()
+
+        self.db.rollback()
+    #end def createStatsTable
 
-        last_game,last_seats,sqlrow = "","",0
+    def addPositionRows(self, colnames, result):
+        """Append a page of positional stats, with a blank row where the game changes"""
+        colnames = dict((name.lower(), i) for (i, name) in enumerate(colnames))
+        avgcol = colnames['avgseats']
+        rows = len(result)
+        sqlrow = 0
         while sqlrow < rows:
             rowprinted=0
             treerow = []
-            avgcol = colnames.index('avgseats')
             for col,colname in enumerate(self.posncols):
                 if colname in colnames:
-                    sqlcol = colnames.index(colname)
+                    sqlcol = colnames[colname]
                 else:
                     continue
                 if result[sqlrow][sqlcol]:
-                    if sqlrow == 0:
+                    if self.position_rows == 0:
                         value = result[sqlrow][sqlcol]
                         rowprinted=1
-                    elif result[sqlrow][0] != last_game:
+                    elif result[sqlrow][0] != self.last_game:
                         value = ' '
 #                    elif 'show' in seats and seats['show'] and result[sqlrow][avgcol] != last_seats: #FIXME 'show' in seats should now be 'show' in groups, but this class doesn't even use the group filters so it can never be set
 #                        value = ' '
@@ -269,61 +283,46 @@ class GuiPositionalStats:
                         value = result[sqlrow][sqlcol]
                         rowprinted=1
                 else:
-                    l = gtk.Label(' ')
                     value = ' '
                 if value and value != -999:
                     treerow.append(value)
                 else:
                     treerow.append(' ')
-            iter = liststore.append(treerow)
-            last_game = result[sqlrow][0]
-            last_seats = result[sqlrow][avgcol]
+            self.liststore.append(treerow)
+            self.last_game = result[sqlrow][0]
+            self.last_seats = result[sqlrow][avgcol]
             if rowprinted:
                 sqlrow = sqlrow+1
-            row = row + 1
-        
-        # show totals at bottom
-        tmp = self.sql.query['playerStats']
-        tmp = self.refineQuery(tmp, playerids, sitenos, limits, seats, dates)
-        #print "DEBUG:\n%s" % tmp
-        self.cursor.execute(tmp)
-        result = self.cursor.fetchall()
-        rows = len(result)
-        colnames = [desc[0].lower() for desc in self.cursor.description]
+                self.position_rows += 1
 
+    def addBlankRow(self):
         # blank row between main stats and totals:
-        col = 0
         treerow = [' ' for x in self.posncols]
-        iter = liststore.append(treerow)
-        row = row + 1
+        self.liststore.append(treerow)
 
-        for sqlrow in range(rows):
+    def addTotalRows(self, colnames, result):
+        colnames = dict((name.lower(), i) for (i, name) in enumerate(colnames))
+        for sqlrow in range(len(result)):
             treerow = []
             for col,colname in enumerate(self.posncols):
                 if colname in colnames:
-                    sqlcol = colnames.index(colname)
+                    sqlcol = colnames[colname]
                 elif colname != "plposition":
                     continue
                 if colname == 'plposition':
-                    l = gtk.Label('Totals')
                     value = 'Totals'
                 elif result[sqlrow][sqlcol]:
-                    l = gtk.Label(result[sqlrow][sqlcol])
                     value = result[sqlrow][sqlcol]
                 else:
-                    l = gtk.Label(' ')
                     value = ' '
                 if value and value != -999:
                     treerow.append(value)
                 else:
                     treerow.append(' ')
-            iter = liststore.append(treerow)
-            row = row + 1
-        vbox.show_all()
+            self.liststore.append(treerow)
 
-        self.db.rollback()
-        print _("Positional Stats page displayed in %4.2f seconds") % (time() - starttime)
-    #end def fillStatsFrame(self, vbox):
+    def statsLoaded(self):
+        print _("Positional Stats page displayed in %4.2f seconds") % (time() - self.starttime)
 
     def refineQuery(self, query, playerids, sitenos, limits, seats, dates):
         if playerids:
@@ -30,6 +30,7 @@ import Card
 import Database
 import Filters
 import Charset
+import AsyncQuery
 
 from TreeViewTooltips import TreeViewTooltips
 
@@ -114,6 +115,8 @@ class GuiRingPlayerStats:
         # create new db connection to avoid conflicts with other threads
         self.db = Database.Database(self.conf, sql=self.sql)
         self.cursor = self.db.cursor
+        # the stats queries run on a connection of their own, see addGrid
+        self.runner = AsyncQuery.QueryRunner(self.conf, self.sql)
 
         settings = {}
         settings.update(self.conf.get_db_parameters())
@@ -227,6 +230,7 @@ class GuiRingPlayerStats:
 
     def refreshStats(self, widget, data):
         #self.last_pos = self.stats_vbox.get_position()
+        self.runner.cancel()
         self.height_inc = None
         #old_len = 0
         #if self.liststore:
@@ -240,14 +244,7 @@ class GuiRingPlayerStats:
         self.stats_frame.add(self.stats_vbox)
         self.fillStatsFrame(self.stats_vbox)
 
-        # set height of top pane
-        # (tried 2 ways, guesstimate using ratio of old to new number of rows and sum of
-        #  heights of parts)
-        new_len = 0
-        if self.liststore:
-            #new_len = len(self.liststore[0])
-            #print "setting to", self.top_pane_height + self.height_inc
-            self.stats_vbox.set_position(self.top_pane_height + self.height_inc)
+        # the height of the top pane is set once its rows are in, see gridLoaded
         #if self.last_pos > 0:
         #    if old_len > 0 and new_len > 0 and new_len <= 10:
         #        self.stats_vbox.set_position(self.last_pos * (new_len+1.9)/(old_len+1.9))
@@ -293,7 +290,8 @@ class GuiRingPlayerStats:
     #end def fillStatsFrame
 
     def createStatsTable(self, vbox, playerids, sitenos, limits, type, seats, groups, dates, games, currencies):
-        startTime = time()
+        self.startTime = time()
+        self.gridsLoading = 1
         show_detail = True
 
         # Scrolled window for summary table
@@ -317,6 +315,7 @@ class GuiRingPlayerStats:
             show_detail = False
 
         if show_detail: 
+            self.gridsLoading = 2
             # Separator
             vbox2 = gtk.VBox(False, 0)
             heading = gtk.Label(self.filterText['handhead'])
@@ -337,23 +336,30 @@ class GuiRingPlayerStats:
             self.addGrid(swin2, 'playerDetailedStats', flags, playerids
                         ,sitenos, limits, type, seats, groups, dates, games, currencies)
 
-        if self.height_inc is None:
-            self.height_inc = 0
-            # need this to check whether scrollbar is visible:
-            while gtk.events_pending(): # see http://faq.pygtk.org/index.py?req=index for more hints (3.7)
-                gtk.main_iteration(False)
-            hs = swin.get_hscrollbar()
-            if hs is not None:
-                #print "hs vis", hs.get_property('visible'), hs.get_property('visible').__class__
-                if hs.get_property('visible'):
-                    self.height_inc = hs.size_request()[1] + swin.style_get_property('scrollbar-spacing')
-            #print "hh set to", self.height_inc
-            self.stats_vbox.set_position(self.top_pane_height + self.height_inc)
-
         self.db.rollback()
-        print (_("Stats page displayed in %4.2f seconds") % (time() - startTime))
     #end def createStatsTable
 
+    def gridLoaded(self, grid, swin, view):
+        """Called when all the rows of a grid are in"""
+        if grid == 0:
+            self.top_pane_height = view.size_request()[1]
+            if self.height_inc is None:
+                self.height_inc = 0
+                # need this to check whether scrollbar is visible:
+                while gtk.events_pending(): # see http://faq.pygtk.org/index.py?req=index for more hints (3.7)
+                    gtk.main_iteration(False)
+                hs = swin.get_hscrollbar()
+                if hs is not None:
+                    #print "hs vis", hs.get_property('visible'), hs.get_property('visible').__class__
+                    if hs.get_property('visible'):
+                        self.height_inc = hs.size_request()[1] + swin.style_get_property('scrollbar-spacing')
+                #print "hh set to", self.height_inc
+            self.stats_vbox.set_position(self.top_pane_height + self.height_inc)
+        self.gridsLoading -= 1
+        if self.gridsLoading == 0:
+            print (_("Stats page displayed in %4.2f seconds") % (time() - self.startTime))
+    #end def gridLoaded
+
     def reset_style_render_func(self, treeviewcolumn, cell, model, iter):
         cell.set_property('foreground', None)
     #end def reset_style_render_func
@@ -421,24 +427,17 @@ class GuiRingPlayerStats:
     
 
     def addGrid(self, vbox, query, flags, playerids, sitenos, limits, type, seats, groups, dates, games, currencies):
-        counter = 0
-        row = 0
-        sqlrow = 0
         if not flags:  holecards,grid = False,0
         else:          holecards,grid = flags[0],flags[2]
 
         tmp = self.sql.query[query]
         tmp = self.refineQuery(tmp, flags, playerids, sitenos, limits, type, seats, groups, dates, games, currencies)
         #print "DEBUG: query: %s" % tmp
-        self.cursor.execute(tmp)
-        result = self.cursor.fetchall()
-        colnames = [desc[0].lower() for desc in self.cursor.description]
 
         # pre-fetch some constant values:
         colshow = colshowsumm
         if groups['posn']:  colshow = colshowposn 
         self.cols_to_show = [x for x in self.columns if x[colshow]]
-        hgametypeid_idx = colnames.index('hgametypeid')
 
         assert len(self.liststore) == grid, "len(self.liststore)="+str(len(self.liststore))+" grid-1="+str(grid)
         self.liststore.append( gtk.ListStore(*([str] * len(self.cols_to_show))) )
@@ -488,13 +487,27 @@ class GuiRingPlayerStats:
             else:
                 self.listcols[grid][col].set_cell_data_func(cellrend, self.reset_style_render_func)
 
-        rows = len(result) # +1 for title row
+        tips = DemoTips(column[colformat])
+        tips.add_view(view)     
+
+        vbox.show_all()
+        view.show()
+
+        # the rows are added as the query returns them
+        self.runner.run(tmp, page = lambda colnames, rows: self.addRows(grid, holecards, colnames, rows),
+                             done = lambda: self.gridLoaded(grid, vbox, view))
+    #end def addGrid
 
-        while sqlrow < rows:
+    def addRows(self, grid, holecards, colnames, result):
+        """Append a page of query results to the grid"""
+        # column positions are looked up once a page rather than for every cell
+        colnames = dict((name.lower(), i) for (i, name) in enumerate(colnames))
+        hgametypeid_idx = colnames['hgametypeid']
+        for sqlrow in xrange(len(result)):
             treerow = []
             for col,column in enumerate(self.cols_to_show):
                 if column[colalias] in colnames:
-                    value = result[sqlrow][colnames.index(column[colalias])]
+                    value = result[sqlrow][colnames[column[colalias]]]
                     if column[colalias] == 'plposition':
                         if value == 'B':
                             value = 'BB'
@@ -505,13 +518,13 @@ class GuiRingPlayerStats:
                 else:
                     if column[colalias] == 'game':
                         if holecards:
-                            value = Card.decodeStartHandValue(result[sqlrow][colnames.index('category')], result[sqlrow][hgametypeid_idx] )
+                            value = Card.decodeStartHandValue(result[sqlrow][colnames['category']], result[sqlrow][hgametypeid_idx] )
                         else:
-                            minbb = result[sqlrow][colnames.index('minbigblind')]
-                            maxbb = result[sqlrow][colnames.index('maxbigblind')]
-                            value = result[sqlrow][colnames.index('limittype')] + ' ' \
-                                    + result[sqlrow][colnames.index('category')].title() + ' ' \
-                                    + result[sqlrow][colnames.index('name')] + ' $'
+                            minbb = result[sqlrow][colnames['minbigblind']]
+                            maxbb = result[sqlrow][colnames['maxbigblind']]
+                            value = result[sqlrow][colnames['limittype']] + ' ' \
+                                    + result[sqlrow][colnames['category']].title() + ' ' \
+                                    + result[sqlrow][colnames['name']] + ' $'
                             if 100 * int(minbb/100.0) != minbb:
                                 value += '%.2f' % (minbb/100.0)
                             else:
@@ -521,8 +534,8 @@ class GuiRingPlayerStats:
                                     value += ' - $' + '%.2f' % (maxbb/100.0)
                                 else:
                                     value += ' - $' + '%.0f' % (maxbb/100.0)
-                            if result[sqlrow][colnames.index('fast')] == 1:
-                                value += ' ' + fast_names[result[sqlrow][colnames.index('name')]]
+                            if result[sqlrow][colnames['fast']] == 1:
+                                value += ' ' + fast_names[result[sqlrow][colnames['name']]]
                     else:
                         continue
                 if value != None and value != -999:
@@ -531,18 +544,7 @@ class GuiRingPlayerStats:
                     treerow.append(' ')
             iter = self.liststore[grid].append(treerow)
             #print treerow
-            sqlrow += 1
-            row += 1
-        tips = DemoTips(column[colformat])
-        tips.add_view(view)     
-
-        vbox.show_all()
-        view.show()
-        if len(self.liststore) == 1:
-            #print "view hieght is ", view.get_allocation().height, view.size_request(), view.get_visible_rect().height, view.get_vadjustment().get_value()
-            self.top_pane_height = view.size_request()[1]
-            #print "saved ", self.top_pane_height
-    #end def addGrid
+    #end def addRows
 
     def refineQuery(self, query, flags, playerids, sitenos, limits, type, seats, groups, dates, games, currencies):
         having = ''
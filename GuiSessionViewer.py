@@ -45,6 +45,7 @@ import Card
 import Database
 import Filters
 import Charset
+import AsyncQuery
 
 import GuiHandViewer
 
@@ -72,6 +73,9 @@ class GuiSessionViewer:
         # create new db connection to avoid conflicts with other threads
         self.db = Database.Database(self.conf, sql=self.sql)
         self.cursor = self.db.cursor
+        # the hands of the sessions are fetched on a connection of their own, see createStatsPane
+        self.runner = AsyncQuery.QueryRunner(self.conf, self.sql)
+        self.hands = []
 
         settings = {}
         settings.update(self.conf.get_db_parameters())
@@ -168,6 +172,7 @@ class GuiSessionViewer:
 
 
     def refreshStats(self, widget, data):
+        self.runner.cancel()
         try: self.stats_vbox.destroy()
         except AttributeError: pass
         self.stats_vbox = gtk.VBox(False, 0)
@@ -219,9 +224,41 @@ class GuiSessionViewer:
         self.createStatsPane(vbox, playerids, sitenos, games, currencies, limits, seats)
 
     def createStatsPane(self, vbox, playerids, sitenos, games, currencies, limits, seats):
-        starttime = time()
+        self.starttime = time()
+        self.hands = []
 
-        (results, quotes) = self.generateDatasets(playerids, sitenos, games, currencies, limits, seats)
+        if DEBUG:
+            self.hands = [ 
+                ( u'10000',  10), ( u'10000',  20), ( u'10000',  30),
+                ( u'20000', -10), ( u'20000', -20), ( u'20000', -30),
+                ( u'30000',  40),
+                ( u'40000',   0),
+                ( u'50000', -40),
+                ( u'60000',  10), ( u'60000',  30), ( u'60000', -20),
+                ( u'70000', -20), ( u'70000',  10), ( u'70000',  30),
+                ( u'80000', -10), ( u'80000', -30), ( u'80000',  20),
+                ( u'90000',  20), ( u'90000', -10), ( u'90000', -30),
+                (u'100000',  30), (u'100000', -50), (u'100000',  30),
+                (u'110000', -20), (u'110000',  50), (u'110000', -20),
+                (u'120000', -30), (u'120000',  50), (u'120000', -30),
+                (u'130000',  20), (u'130000', -50), (u'130000',  20),
+                (u'140000',  40), (u'140000', -40),
+                (u'150000', -40), (u'150000',  40),
+                (u'160000', -40), (u'160000',  80), (u'160000', -40),
+                ]
+            self.showStats(vbox)
+        else:
+            # the graph and table are drawn once all the hands are in
+            q = self.sessionQuery(playerids, sitenos, games, currencies, limits, seats)
+            self.runner.run(q, page = self.addHands, done = lambda: self.showStats(vbox))
+        self.db.rollback()
+    #end def createStatsPane
+
+    def addHands(self, colnames, rows):
+        self.hands.extend(rows)
+
+    def showStats(self, vbox):
+        (results, quotes) = self.generateDatasets(self.hands)
 
         if DEBUG:
             for x in quotes:
@@ -245,17 +282,11 @@ class GuiSessionViewer:
 
         self.addTable(vbox1, results)
 
-        self.db.rollback()
-        print _("Stats page displayed in %4.2f seconds") % (time() - starttime)
-    #end def fillStatsFrame(self, vbox):
-
-    def generateDatasets(self, playerids, sitenos, games, currencies, limits, seats):
-        if (DEBUG): print "DEBUG: Starting generateDatasets"
-        THRESHOLD = 1800     # Min # of secs between consecutive hands before being considered a new session
-        PADDING   = 5        # Additional time in minutes to add to a session, session startup, shutdown etc
-
-        # Get a list of timestamps and profits
+        print _("Stats page displayed in %4.2f seconds") % (time() - self.starttime)
+    #end def showStats
 
+    def sessionQuery(self, playerids, sitenos, games, currencies, limits, seats):
+        """The query for the start times and profits of the hands in the filters"""
         q = self.sql.query['sessionStats']
         start_date, end_date = self.filters.getDates()
         q = q.replace("<datestest>", " BETWEEN '" + start_date + "' AND '" + end_date + "'")
@@ -302,29 +333,12 @@ class GuiSessionViewer:
         nametest = nametest.replace(",)",")")
         q = q.replace("<player_test>", nametest)
         q = q.replace("<ampersand_s>", "%s")
+        return q
 
-        if DEBUG:
-            hands = [ 
-                ( u'10000',  10), ( u'10000',  20), ( u'10000',  30),
-                ( u'20000', -10), ( u'20000', -20), ( u'20000', -30),
-                ( u'30000',  40),
-                ( u'40000',   0),
-                ( u'50000', -40),
-                ( u'60000',  10), ( u'60000',  30), ( u'60000', -20),
-                ( u'70000', -20), ( u'70000',  10), ( u'70000',  30),
-                ( u'80000', -10), ( u'80000', -30), ( u'80000',  20),
-                ( u'90000',  20), ( u'90000', -10), ( u'90000', -30),
-                (u'100000',  30), (u'100000', -50), (u'100000',  30),
-                (u'110000', -20), (u'110000',  50), (u'110000', -20),
-                (u'120000', -30), (u'120000',  50), (u'120000', -30),
-                (u'130000',  20), (u'130000', -50), (u'130000',  20),
-                (u'140000',  40), (u'140000', -40),
-                (u'150000', -40), (u'150000',  40),
-                (u'160000', -40), (u'160000',  80), (u'160000', -40),
-                ]
-        else:
-            self.db.cursor.execute(q)
-            hands = self.db.cursor.fetchall()
+    def generateDatasets(self, hands):
+        if (DEBUG): print "DEBUG: Starting generateDatasets"
+        THRESHOLD = 1800     # Min # of secs between consecutive hands before being considered a new session
+        PADDING   = 5        # Additional time in minutes to add to a session, session startup, shutdown etc
 
         #fixme - nasty hack to ensure that the hands.insert() works 
         # for mysql data.  mysql returns tuples which can't be inserted
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import gtk
+import gobject
 
 #Copyright 2008-2011 Steffen Schaumburg
 #This program is free software: you can redistribute it and/or modify
@@ -21,6 +22,7 @@ _ = L10n.get_translation()
 
 import os
 import sys
+import threading
 
 import Charset
 import Stove
@@ -38,6 +40,9 @@ class GuiStove():
         self.villainrange = ""
         self.conf = config
         self.parent = parent
+        self.flop_worker = 0        # id of the newest flop calculation, older results are dropped
+
+        gobject.threads_init()
 
         self.mainHBox = gtk.HBox(False, 0)
 
@@ -228,17 +233,39 @@ Against the range: {
         self.villainrange = widget.get_text()
 
     def update_flop_output_pane(self, caller, widget):
+        """Start the range calculation in a worker thread, the gui thread
+           only gets progress and the result back through idle callbacks."""
         print (_("DEBUG:") + " " + _("called") + " update_flop_output_pane")
 #         self.stove.set_board_string(self.boardtext)
 #         self.stove.set_hero_cards_string(self.herorange)
 #         self.stove.set_villain_range_string(self.villainrange)
+        self.stove = Stove.Stove()
         self.stove.set_board_string(self.board.get_text())
         self.stove.set_hero_cards_string(self.p1_board.get_text())
         self.stove.set_villain_range_string(self.p2_board.get_text())
+        self.flop_worker += 1
+        self.set_output_label(_("Calculating..."))
+        worker = threading.Thread(target=self.flop_odds_for_range, args=(self.flop_worker, self.stove))
+        worker.daemon = True
+        worker.start()
+
+    def flop_odds_for_range(self, worker, stove):        # This is the thread function
         print (_("DEBUG:") + ("odds_for_range"))
-        self.ev = Stove.odds_for_range(self.stove)
-        print (_("DEBUG:") + " " + ("set_output_label"))
-        self.set_output_label(self.ev.output)
+        progress = lambda done, total: gobject.idle_add(self.flop_progress, worker, done, total)
+        ev = Stove.odds_for_range(stove, progress)
+        gobject.idle_add(self.flop_finished, worker, ev)
+
+    def flop_progress(self, worker, done, total):
+        if worker == self.flop_worker:
+            self.set_output_label(_("Calculating...") + " %d/%d" % (done, total))
+        return False
+
+    def flop_finished(self, worker, ev):
+        if worker == self.flop_worker:
+            print (_("DEBUG:") + " " + ("set_output_label"))
+            self.ev = ev
+            self.set_output_label(self.ev.output)
+        return False
 
 
 
@@ -25,6 +25,7 @@ from time import time, strftime
 
 import Charset
 import TourneyFilters
+import AsyncQuery
 
 colalias,colshow,colheading,colxalign,colformat,coltype = 0,1,2,3,4,5
 
@@ -34,6 +35,8 @@ class GuiTourneyPlayerStats:
         self.db = db
         self.cursor = self.db.cursor
         self.sql = sql
+        # the stats query runs on a connection of its own, see addGrid
+        self.runner = AsyncQuery.QueryRunner(self.conf, self.sql)
         self.main_window = mainwin
         self.debug = debug
         
@@ -108,18 +111,11 @@ class GuiTourneyPlayerStats:
     def addGrid(self, vbox, query, numTourneys, tourneyTypes, playerids, sitenos, seats):
         #print "start of addGrid query", query
         #print "start of addGrid. numTourneys:",numTourneys,"tourneyTypes:", tourneyTypes, "playerids:",playerids
-        counter = 0
-        row = 0
-        sqlrow = 0
         grid=numTourneys #TODO: should this be numTourneyTypes?
         
         query = self.sql.query[query]
         query = self.refineQuery(query, numTourneys, tourneyTypes, playerids, sitenos, seats)
         #print "DEBUG:\n%s" % query
-        self.cursor.execute(query)
-        result = self.cursor.fetchall()
-        #print "result of the big query in addGrid:",result
-        colnames = [desc[0] for desc in self.cursor.description]
 
         # pre-fetch some constant values:
         #self.cols_to_show = [x for x in self.columns if x[colshow]]
@@ -174,36 +170,43 @@ class GuiTourneyPlayerStats:
             else:
                 self.listcols[grid][col].set_cell_data_func(cellrend, self.reset_style_render_func)
 
-        rows = len(result) # +1 for title row
+        # rows are added as the query returns them
+        self.runner.run(query, page = lambda colnames, rows: self.addRows(grid, colnames, rows),
+                        done = self.statsLoaded)
+        vbox.show_all()
+    #end def addGrid
 
-        while sqlrow < rows:
+    def addRows(self, grid, colnames, result):
+        """Append a page of query results to grid"""
+        colnames = dict((name, i) for (i, name) in enumerate(colnames))
+        for sqlrow in range(len(result)):
             treerow = []
             for col,column in enumerate(self.cols_to_show):
                 if column[colalias] in colnames:
-                    value = result[sqlrow][colnames.index(column[colalias])]
+                    value = result[sqlrow][colnames[column[colalias]]]
                 else:
                     value = 111
                 if column[colalias] == 'siteName':
-                    if result[sqlrow][colnames.index('speed')] != 'Normal':
-                        if (result[sqlrow][colnames.index('speed')] == 'Hyper' 
-                            and result[sqlrow][colnames.index('siteName')] ==
+                    if result[sqlrow][colnames['speed']] != 'Normal':
+                        if (result[sqlrow][colnames['speed']] == 'Hyper' 
+                            and result[sqlrow][colnames['siteName']] ==
                             'Full Tilt Poker'):
                             value = value + ' ' + 'Super Turbo'
                         else:
-                            value = value + ' ' + result[sqlrow][colnames.index('speed')]
+                            value = value + ' ' + result[sqlrow][colnames['speed']]
                 if value != None and value != -999:
                     treerow.append(column[colformat] % value)
                 else:
                     treerow.append(' ')
-            #print "addGrid, just before end of big for. grid:",grid,"treerow:",treerow
+            #print "addRows, just before end of big for. grid:",grid,"treerow:",treerow
             iter = self.liststore[grid].append(treerow)
-            sqlrow += 1
-            row += 1
-        vbox.show_all()
-    #end def addGrid
+    #end def addRows
+
+    def statsLoaded(self):
+        print _("Stats page displayed in %4.2f seconds") % (time() - self.startTime)
 
     def createStatsTable(self, vbox, tourneyTypes, playerids, sitenos, seats):
-        startTime = time()
+        self.startTime = time()
         show_detail = True
 
         # Scrolled window for summary table
@@ -214,8 +217,6 @@ class GuiTourneyPlayerStats:
 
         numTourneys = self.filters.getNumTourneys()
         self.addGrid(swin, 'tourneyPlayerDetailedStats', numTourneys, tourneyTypes, playerids, sitenos, seats)
-
-        print _("Stats page displayed in %4.2f seconds") % (time() - startTime)
     #end def createStatsTable
 
     def fillStatsFrame(self, vbox):
@@ -334,6 +335,7 @@ class GuiTourneyPlayerStats:
     #end def refineQuery
 
     def refreshStats(self, widget, data):
+        self.runner.cancel()
         self.last_pos = self.stats_vbox.get_position()
         try: self.stats_vbox.destroy()
         except AttributeError: pass
@@ -26,16 +26,24 @@
 
 Main for FreePokerTools HUD.
 """
+import sys
+if [arg for arg in sys.argv if len(arg) > len('--profile') and '--profile-startup'.startswith(arg)]:
+    # before anything else is imported, so every module gets timed. optparse takes --profile-s too
+    import StartupProfiler
+    StartupProfiler.install()
+
 import L10n
 _ = L10n.init_translation()
 
 #    Standard Library modules
-import sys
 import os
 import thread
+import threading
+import Queue
 import time
 import string
 import logging
+import json
 
 #    pyGTK modules
 import gtk
@@ -54,7 +62,7 @@ import Deck
 
 # get config and set up logger
 Configuration.set_logfile(u"HUD-log.txt")
-c = Configuration.Config(file=options.config, dbname=options.dbname)
+c = Configuration.get_shared_config(file=options.config, dbname=options.dbname)
 log = logging.getLogger("hud")
 
 # get the correct module for the current os
@@ -70,6 +78,8 @@ class HUD_main(gobject.GObject):
     """A main() object to own both the read_stdin thread and the gui."""
 #    This class mainly provides state for controlling the multiple HUDs.
 
+    workers = 3     # threads getting stats from the db, each table is handled by one at a time
+
     def __init__(self, db_name='fpdb'):
         self.db_name = db_name
         self.config = c
@@ -167,7 +177,7 @@ class HUD_main(gobject.GObject):
         gobject.idle_add(idle_check_tables, self)
         return True
 
-    def create_HUD(self, new_hand_id, table, temp_key, max, poker_game, type, stat_dict, cards):
+    def create_HUD(self, db, new_hand_id, table, temp_key, max, poker_game, type, stat_dict, cards):
         """type is "ring" or "tour" used to set hud_params"""
 
         self.hud_dict[temp_key] = Hud.Hud(self, table, max, poker_game, type, self.config)
@@ -179,17 +189,23 @@ class HUD_main(gobject.GObject):
         table.hud = self.hud_dict[temp_key]
     
         self.hud_dict[temp_key].hud_params['new_max_seats'] = None #trigger for seat layout change
-        #fixme - passing self.db_connection into another thread
+        #fixme - passing the worker's db connection into another thread
         # is probably pointless.
-        [aw.update_data(new_hand_id, self.db_connection) for aw in self.hud_dict[temp_key].aux_windows]
+        [aw.update_data(new_hand_id, db) for aw in self.hud_dict[temp_key].aux_windows]
         gobject.idle_add(idle_create, self, new_hand_id, table, temp_key, max, poker_game, type, stat_dict, cards)
 
-    def update_HUD(self, new_hand_id, table_name, config):
-        """Update a HUD gui from inside the non-gui read_stdin thread."""
-        gobject.idle_add(idle_update, self, new_hand_id, table_name, config)
+    def update_HUD(self, new_hand_id, table_name, config, stat_dict):
+        """Update a HUD gui from inside a non-gui worker thread.
+           The stat_dict is handed over to the hud in the gui thread."""
+        gobject.idle_add(idle_update, self, new_hand_id, table_name, config, stat_dict)
 
     def read_stdin(self):            # This is the thread function
-        """Do all the non-gui heavy lifting for the HUD program."""
+        """Read hand numbers from stdin and queue them by table for the worker threads.
+
+           Only the newest hand queued for a table is processed. A table is busy from the
+           moment a worker picks up its hand until the gui has been updated for it
+           (see hand_done), so the stat_dict of a hud is never replaced while the previous
+           hand is still being drawn, and stdin is read while the workers are busy."""
 
 #    This db connection is for the read_stdin thread only. It should not
 #    be passed to HUDs for use in the gui thread. HUD objects should not
@@ -214,25 +230,37 @@ class HUD_main(gobject.GObject):
                 log.info(_("Aux disabled for site %s") % i)
                 aux_disabled_sites.append(i)
 
+        self.stat_store = Database.HudStatStore(self.db_connection.sql)
+        self.pending = {}           # temp_key: newest hand not yet processed for that table
+        self.busy = set()           # temp_keys queued or being processed
+        self.pending_lock = threading.Lock()
+        self.work_queue = Queue.Queue()
+        for i in xrange(self.workers):
+            thread.start_new_thread(self.process_hands, ())
+
         while 1:    # wait for a new hand number on stdin
-            time.sleep(0.45) # pause an arbitrary amount of time
-                            # This throttles thru-put to about 2 or 3
-                            # hands per second.  Otherwise, the downstream
-                            # code can become flooded and errors start to
-                            # occur due to stat_dict being overwritten before
-                            # the previous hand completed processing.
-                            # Flooding normally occurs when the hud "fast forwards"
-                            # at tables where a bunch of hands have already been played
-                            # with the HUD switched off.
             new_hand_id = sys.stdin.readline()
             new_hand_id = string.rstrip(new_hand_id)
+            # the importer may follow the hand number with the hand's HudCache lines
+            (new_hand_id, deltas) = (new_hand_id.split(None, 1) + [None])[:2]
             log.debug(_("Received hand no %s") % new_hand_id)
-            if new_hand_id == "":           # blank line means quit
+            if not new_hand_id:           # blank line means quit
+                for i in xrange(self.workers):
+                    self.work_queue.put(None)
                 self.db_connection.connection.rollback()
                 self.destroy()
                 break # this thread is not always killed immediately with gtk.main_quit()
             self.db_connection.connection.rollback() # release lock from previous iteration
 
+            if deltas:
+                try:
+                    deltas = json.loads(deltas)
+                    deltas['players'] = dict((int(pid), delta) for pid, delta in deltas['players'].iteritems())
+                    self.stat_store.add_hand(int(new_hand_id), deltas)
+                except (ValueError, KeyError):
+                    log.error(_("Bad stats received with hand %s") % new_hand_id)
+                    deltas = None
+
 #    The following block cannot be hoisted outside the while loop, because it would
 #    cause a problem when auto importing into an empty db.
 #    FIXME (corner-case): Because this block only executes once when the hud starts,
@@ -277,127 +305,182 @@ class HUD_main(gobject.GObject):
                 temp_key = "%s Table %s" % (tour_number, tab_number)
             else:
                 temp_key = table_name
-                                
-            if type == "tour":
-                #
-                # Has there been a table-change?  if yes, clean-up the current hud
-                # Two checks are needed,
-                #  if a hand is received for an existing table-number, but the table-title has changed,  kill the old hud
-                #  if a hand is received for a "new" table number, clean-up the old one and create a new hud
-                #
-                if temp_key in self.hud_dict:
-                    # check if our attached window's titlebar has changed, if it has
-                    # this method will emit a "table_changed" signal which will trigger
-                    # a kill
-                    if self.hud_dict[temp_key].table.has_table_title_changed(self.hud_dict[temp_key]):
-                        #table has been renamed; the idle_kill method will housekeep hud_dict
-                        # We will skip this hand, to give time for the idle function
-                        # to complete its' work.  Normal service will be resumed on the next hand
-                        continue # abort processing this hand
-                else:
-                    #check if the tournament number is in the hud_dict under a different table
-                    #if it is, trigger a hud_kill - we can safely drop through the rest of the code
-                    # because this is a brand-new hud being created
-                    for k in self.hud_dict:
-                        if k.startswith(tour_number):
-                            self.table_is_stale(self.hud_dict[k])
-                            continue # this cancels the "for k in...." loop, NOT the outer while: loop
+
+            self.queue_hand(temp_key, (new_hand_id, table_name, max, poker_game, type, site_id,
+                                       site_name, num_seats, tour_number, tab_number, deltas))
+
+    def queue_hand(self, temp_key, hand):
+        """Make hand the next one processed for temp_key, dropping any older hand still queued."""
+        self.pending_lock.acquire()
+        try:
+            if temp_key in self.pending:
+                log.debug(_("Skipping hand %s, a newer hand is queued for %s") % (self.pending[temp_key][0], temp_key))
+            self.pending[temp_key] = hand
+            if temp_key not in self.busy:
+                self.busy.add(temp_key)
+                self.work_queue.put(temp_key)
+        finally:
+            self.pending_lock.release()
+
+    def hand_done(self, temp_key):
+        """The hud for temp_key is up to date, queue the table again if a newer hand came in."""
+        self.pending_lock.acquire()
+        try:
+            if temp_key in self.pending:
+                self.work_queue.put(temp_key)
+            else:
+                self.busy.discard(temp_key)
+        finally:
+            self.pending_lock.release()
+
+    def process_hands(self):         # This is the worker thread function
+        """Get the stats of queued hands and pass them to the huds."""
+        db = Database.Database(self.config)
+        while 1:
+            temp_key = self.work_queue.get()
+            if temp_key is None:
+                break
+            self.pending_lock.acquire()
+            try:
+                hand = self.pending.pop(temp_key)
+            finally:
+                self.pending_lock.release()
+            db.connection.rollback() # release lock from previous iteration
+            try:
+                updating = self.process_hand(db, temp_key, *hand)
+            except:
+                log.exception(_("Error updating HUD for hand %s.") % hand[0])
+                updating = False
+            if not updating:
+                self.hand_done(temp_key)
+        db.connection.rollback()
+
+    def process_hand(self, db, temp_key, new_hand_id, table_name, max, poker_game, type, site_id,
+                     site_name, num_seats, tour_number, tab_number, deltas):
+        """Do all the non-gui heavy lifting for one hand. Returns True if a gui update was
+           scheduled, which calls hand_done once it has run."""
+        if type == "tour":
+            #
+            # Has there been a table-change?  if yes, clean-up the current hud
+            # Two checks are needed,
+            #  if a hand is received for an existing table-number, but the table-title has changed,  kill the old hud
+            #  if a hand is received for a "new" table number, clean-up the old one and create a new hud
+            #
+            if temp_key in self.hud_dict:
+                # check if our attached window's titlebar has changed, if it has
+                # this method will emit a "table_changed" signal which will trigger
+                # a kill
+                if self.hud_dict[temp_key].table.has_table_title_changed(self.hud_dict[temp_key]):
+                    #table has been renamed; the idle_kill method will housekeep hud_dict
+                    # We will skip this hand, to give time for the idle function
+                    # to complete its' work.  Normal service will be resumed on the next hand
+                    return False # abort processing this hand
+            else:
+                #check if the tournament number is in the hud_dict under a different table
+                #if it is, trigger a hud_kill - we can safely drop through the rest of the code
+                # because this is a brand-new hud being created
+                for k in self.hud_dict.keys():
+                    if k.startswith(tour_number):
+                        self.table_is_stale(self.hud_dict[k])
+                        continue # this cancels the "for k in...." loop, NOT the outer while: loop
 
 
 #       detect maxseats changed in hud
 #       if so, kill and create new hud with specified "max"
-            if temp_key in self.hud_dict:
-                try:
-                    newmax = self.hud_dict[temp_key].hud_params['new_max_seats']  # trigger
-                    if newmax and self.hud_dict[temp_key].max != newmax:  # max has changed
-                        self.kill_hud("activate", temp_key)   # kill everything
-                        while temp_key in self.hud_dict: time.sleep(0.5)   # wait for idle_kill to complete
-                        max = newmax   # "max" localvar used in create_HUD call below
-                    self.hud_dict[temp_key].hud_params['new_max_seats'] = None   # reset trigger
-                except:
-                    pass
-                    
+        if temp_key in self.hud_dict:
+            try:
+                newmax = self.hud_dict[temp_key].hud_params['new_max_seats']  # trigger
+                if newmax and self.hud_dict[temp_key].max != newmax:  # max has changed
+                    self.kill_hud("activate", temp_key)   # kill everything
+                    while temp_key in self.hud_dict: time.sleep(0.5)   # wait for idle_kill to complete
+                    max = newmax   # "max" localvar used in create_HUD call below
+                self.hud_dict[temp_key].hud_params['new_max_seats'] = None   # reset trigger
+            except:
+                pass
+                
 #       detect poker_game changed in latest hand (i.e. mixed game)
 #       if so, kill and create new hud with specified poker_game
 #       Note that this will reset the aggretation params for that table
-            if temp_key in self.hud_dict:
-                if self.hud_dict[temp_key].poker_game != poker_game:
-                    print "game changed!:", poker_game
-                    try:
-                        self.kill_hud("activate", temp_key)   # kill everything
-                        while temp_key in self.hud_dict: time.sleep(0.5)   # wait for idle_kill to complete
-                    except:
-                        pass
+        if temp_key in self.hud_dict:
+            if self.hud_dict[temp_key].poker_game != poker_game:
+                print "game changed!:", poker_game
+                try:
+                    self.kill_hud("activate", temp_key)   # kill everything
+                    while temp_key in self.hud_dict: time.sleep(0.5)   # wait for idle_kill to complete
+                except:
+                    pass
 
 #        Update an existing HUD
-            if temp_key in self.hud_dict:
-                # get stats using hud's specific params and get cards
-                self.db_connection.init_hud_stat_vars( self.hud_dict[temp_key].hud_params['hud_days']
-                                                     , self.hud_dict[temp_key].hud_params['h_hud_days'])
-                #print "update an existing hud ", temp_key, self.hud_dict[temp_key].hud_params
-                stat_dict = self.db_connection.get_stats_from_hand(new_hand_id, type, self.hud_dict[temp_key].hud_params,
-                                                                   self.hero_ids[site_id], num_seats)
+        if temp_key in self.hud_dict:
+            # get stats using hud's specific params and get cards
+            db.init_hud_stat_vars( self.hud_dict[temp_key].hud_params['hud_days']
+                                 , self.hud_dict[temp_key].hud_params['h_hud_days'])
+            #print "update an existing hud ", temp_key, self.hud_dict[temp_key].hud_params
+            stat_dict = db.get_stats_from_hand(new_hand_id, type, self.hud_dict[temp_key].hud_params,
+                                               self.hero_ids[site_id], num_seats, self.stat_store, deltas)
 
-                try:
-                    self.hud_dict[temp_key].stat_dict = stat_dict
-                except KeyError:    # HUD instance has been killed off, key is stale
-                    log.error(_('%s was not found') % ("hud_dict[%s]" % temp_key))
-                    log.error(_('will not send hand'))
-                    continue
-                    
-                self.hud_dict[temp_key].cards = self.get_cards(new_hand_id, poker_game)
-                #fixme - passing self.db_connection into another thread
-                # is probably pointless
-                [aw.update_data(new_hand_id, self.db_connection) for aw in self.hud_dict[temp_key].aux_windows]
-                self.update_HUD(new_hand_id, temp_key, self.config)
+            try:
+                hud = self.hud_dict[temp_key]
+            except KeyError:    # HUD instance has been killed off, key is stale
+                log.error(_('%s was not found') % ("hud_dict[%s]" % temp_key))
+                log.error(_('will not send hand'))
+                return False
+                
+            hud.cards = self.get_cards(db, new_hand_id, poker_game)
+            #fixme - passing the worker's db connection into another thread
+            # is probably pointless
+            [aw.update_data(new_hand_id, db) for aw in hud.aux_windows]
+            self.update_HUD(new_hand_id, temp_key, self.config, stat_dict)
+            return True
 
 #        Or create a new HUD
-            else:
-                # get stats using default params--also get cards
+        else:
+            # get stats using default params--also get cards
 
-                self.db_connection.init_hud_stat_vars( self.hud_params['hud_days'], self.hud_params['h_hud_days'] )
-                stat_dict = self.db_connection.get_stats_from_hand(new_hand_id, type, self.hud_params,
-                                                                   self.hero_ids[site_id], num_seats)
+            db.init_hud_stat_vars( self.hud_params['hud_days'], self.hud_params['h_hud_days'] )
+            stat_dict = db.get_stats_from_hand(new_hand_id, type, self.hud_params,
+                                               self.hero_ids[site_id], num_seats, self.stat_store, deltas)
+            
+            #Confirm our hero is seated for this hand, otherwise we must __not__ create a hud
+            # because it is impossible to work out who is sitting where, and that working-out
+            # of seat positions __only__ happens during creation.  (see Aux_Base.Aux_Seats.adj_seats())
+            #Fixes issue with 888/pacific which includes cash hands before the hero is dealt-in
+            hero_found = False
+            for key in stat_dict:
+                if stat_dict[key]['screen_name'] == self.hero[site_id]:
+                    hero_found = True
+                    break
+            if not hero_found:
+                log.info(_('hud not created yet, because hero is not seated for this hand'))
+                return False
                 
-                #Confirm our hero is seated for this hand, otherwise we must __not__ create a hud
-                # because it is impossible to work out who is sitting where, and that working-out
-                # of seat positions __only__ happens during creation.  (see Aux_Base.Aux_Seats.adj_seats())
-                #Fixes issue with 888/pacific which includes cash hands before the hero is dealt-in
-                hero_found = False
-                for key in stat_dict:
-                    if stat_dict[key]['screen_name'] == self.hero[site_id]:
-                        hero_found = True
-                        break
-                if not hero_found:
-                    log.info(_('hud not created yet, because hero is not seated for this hand'))
-                    continue
-                    
-                cards = self.get_cards(new_hand_id, poker_game)
-                table_kwargs = dict(table_name=table_name, tournament=tour_number, table_number=tab_number)
-                tablewindow = Tables.Table(self.config, site_name, **table_kwargs)
-                if tablewindow.number is None:
+            cards = self.get_cards(db, new_hand_id, poker_game)
+            table_kwargs = dict(table_name=table_name, tournament=tour_number, table_number=tab_number)
+            tablewindow = Tables.Table(self.config, site_name, **table_kwargs)
+            if tablewindow.number is None:
 #        If no client window is found on the screen, complain and continue
-                    if type == "tour":
-                        table_name = "%s %s" % (tour_number, tab_number)
-                    log.error(_("HUD create: table name %s not found, skipping.") % table_name)
-                    continue
-                elif tablewindow.number in self.blacklist:
-                    continue    #no hud please, we are blacklisted
+                if type == "tour":
+                    table_name = "%s %s" % (tour_number, tab_number)
+                log.error(_("HUD create: table name %s not found, skipping.") % table_name)
+                return False
+            elif tablewindow.number in self.blacklist:
+                return False    #no hud please, we are blacklisted
+            else:
+                tablewindow.key = temp_key
+                tablewindow.max = max
+                tablewindow.site = site_name
+                # Test that the table window still exists
+                if hasattr(tablewindow, 'number'):
+                    self.create_HUD(db, new_hand_id, tablewindow, temp_key, max, poker_game, type, stat_dict, cards)
+                    return True
                 else:
-                    tablewindow.key = temp_key
-                    tablewindow.max = max
-                    tablewindow.site = site_name
-                    # Test that the table window still exists
-                    if hasattr(tablewindow, 'number'):
-                        self.create_HUD(new_hand_id, tablewindow, temp_key, max, poker_game, type, stat_dict, cards)
-                    else:
-                        log.error(_('Table "%s" no longer exists') % table_name)
-                        continue
-
-    def get_cards(self, new_hand_id, poker_game):
-        cards = self.db_connection.get_cards(new_hand_id)
+                    log.error(_('Table "%s" no longer exists') % table_name)
+                    return False
+
+    def get_cards(self, db, new_hand_id, poker_game):
+        cards = db.get_cards(new_hand_id)
         if poker_game in ['holdem','omahahi','omahahilo']:
-            comm_cards = self.db_connection.get_common_cards(new_hand_id)
+            comm_cards = db.get_common_cards(new_hand_id)
             cards['common'] = comm_cards['common']
         return cards
 
@@ -481,18 +564,21 @@ def idle_create(hud_main, new_hand_id, table, temp_key, max, poker_game, type, s
         log.exception(_("Error creating HUD for hand %s.") % new_hand_id)
     finally:
         gtk.gdk.threads_leave()
+        hud_main.hand_done(temp_key)
     return False
 
-def idle_update(hud_main, new_hand_id, table_name, config):
+def idle_update(hud_main, new_hand_id, table_name, config, stat_dict):
     gtk.gdk.threads_enter()
     
     try:
+        hud_main.hud_dict[table_name].stat_dict = stat_dict
         hud_main.hud_dict[table_name].update(new_hand_id, config)
         [aw.update_gui(new_hand_id) for aw in hud_main.hud_dict[table_name].aux_windows]
     except:
         log.exception(_("Error updating HUD for hand %s.") % new_hand_id)
     finally:
         gtk.gdk.threads_leave()
+        hud_main.hand_done(table_name)
         return False
 
 def idle_check_tables(hud_main):
@@ -511,6 +597,8 @@ if __name__== "__main__":
 
 #    start the HUD_main object
     hm = HUD_main(db_name = options.dbname)
+    if options.profile_startup and 'StartupProfiler' in sys.modules:
+        StartupProfiler.report()
 
 #    start the event loop
     gtk.main()
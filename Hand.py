@@ -324,6 +324,9 @@ class Hand(object):
         self.hands['seats']      = len(self.dbid_pids)
         self.hands['fileId']     = fileId
         db.storeHand(self.hands, doinsert, printtest)
+        if self.tourneyTypeId in db.ttold:
+            # the cache lines go in with a tourney type changed by this import
+            db.journalHands((self.dbid_hands,), tourneyTypeId = self.tourneyTypeId)
         db.storeBoards(self.dbid_hands, self.hands['boards'], doinsert)
 
     def insertHandsPlayers(self, db, doinsert = False, printtest = False):
@@ -355,6 +358,11 @@ class Hand(object):
         if self.callHud:
             db.storeHudCache(self.dbid_gt, self.gametype, self.dbid_pids, self.startTime, self.handsplayers, doinsert)
         
+    def getHudDeltas(self, db):
+        """The HudCache lines of this hand, sent to the HUD with the hand id"""
+        if self.callHud:
+            return db.get_hud_deltas(self.dbid_gt, self.gametype, self.dbid_pids, self.startTime, self.handsplayers)
+        
     def updateSessionsCache(self, db, tz, doinsert = False):
         """ Function to update the Sessions"""
         if self.cacheSessions:
@@ -1928,6 +1936,7 @@ def hand_factory(hand_id, config, db_connection):
 
     hand_instance.select(db_connection, hand_id)
     hand_instance.handid_selected = hand_id #hand_instance does not supply this, create it here
+    hand_instance.db_connection = db_connection #used by stats needing more than the stat_dict, e.g. starthands
     
     return hand_instance
 
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+"""In-tree replacement for pypoker-eval.
+
+HandEvaluator exposes the subset of the pokereval.PokerEval interface used by
+DerivedStats and Stove (best, card2string, string2card, poker_eval, winners).
+Five card hands are valued with lookup tables built on first use over
+the Card.encodeCardList encoding (card index = encodeCardList[card] - 1), and
+whole batches of boards are evaluated at once with NumPy, so that Monte Carlo
+and exhaustive enumeration never loop over deals in Python.
+
+Hand values use the pokereval HandVal layout: type << 24 followed by up to
+five 4 bit rank codes (2 = 0 .. A = 12). High hands compare larger-is-better,
+low hands smaller-is-better; a low that does not qualify is LOW_NOTHING.
+"""
+
+import L10n
+_ = L10n.get_translation()
+
+import logging
+from itertools import combinations, combinations_with_replacement, islice
+
+import numpy
+
+import Card
+
+# logging has been set up in fpdb.py or HUD_main.py, use their settings:
+log = logging.getLogger("parser")
+
+RANKS = '23456789TJQKA'
+SUITS = 'hdcs'
+UNKNOWN = 255
+
+NOPAIR, ONEPAIR, TWOPAIR, TRIPS, STRAIGHT, FLUSH, FLHOUSE, QUADS, STFLUSH = range(9)
+HANDTYPES = ['NoPair', 'OnePair', 'TwoPair', 'Trips', 'Straight', 'Flush', 'FlHouse', 'Quads', 'StFlush']
+LOW_NOTHING = 0x0FFFFFFF
+
+PRIMES = numpy.array([2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41], dtype=numpy.int64)
+LOWRANK = numpy.array([(r + 1) % 13 for r in range(13)], dtype=numpy.int64) # ace low: A = 0 .. K = 12
+POPCOUNT = numpy.array([bin(b).count('1') for b in range(1 << 13)], dtype=numpy.int64)
+WHEEL = 0x100F
+
+# game: (omaha, hi, low) where low is None, '8' (eight or better), 'a5' or '27'
+GAMES = {   'holdem'    : (False, True,  None),
+            'holdem8'   : (False, True,  '8'),
+            'omaha'     : (True,  True,  None),
+            'omaha8'    : (True,  True,  '8'),
+            '7stud'     : (False, True,  None),
+            '7stud8'    : (False, True,  '8'),
+            '5draw'     : (False, True,  None),
+            'razz'      : (False, False, 'a5'),
+            'lowball'   : (False, False, 'a5'),
+            'lowball27' : (False, False, '27'),
+        }
+
+CHUNK = 8192            # deals evaluated per NumPy batch
+DEFAULT_ITERATIONS = 50000
+
+def _pack(handtype, ranks):
+    value = handtype << 24
+    for i, r in enumerate(ranks):
+        value |= r << (16 - 4*i)
+    return value
+
+def _groups(ranks):
+    """Ranks ordered by (count, rank) descending, and the count pattern."""
+    counts = {}
+    for r in ranks:
+        counts[r] = counts.get(r, 0) + 1
+    groups = sorted(counts.items(), key=lambda g: (g[1], g[0]), reverse=True)
+    return [g[0] for g in groups], tuple([g[1] for g in groups])
+
+def _straight_top(bits, wheel):
+    for top in range(12, 3, -1):
+        if bits == 0x1F << (top - 4):
+            return top
+    if wheel and bits == WHEEL:
+        return 3
+    return None
+
+def _handval(ranks, flush=False, straights=True, wheel=True):
+    order, shape = _groups(ranks)
+    if len(order) == 5:
+        bits = sum([1 << r for r in order])
+        top = _straight_top(bits, wheel) if straights else None
+        if top is not None:
+            return _pack(STFLUSH if flush else STRAIGHT, [top])
+        return _pack(FLUSH if flush else NOPAIR, order)
+    handtype = {(2,1,1,1): ONEPAIR, (2,2,1): TWOPAIR, (3,1,1): TRIPS, (3,2): FLHOUSE, (4,1): QUADS}[shape]
+    return _pack(handtype, order)
+
+def _build_tables():
+    """Value tables indexed by the 13 bit rank mask of five distinct ranks,
+       plus a sorted prime product table for hands holding a pair or better."""
+    size = 1 << 13
+    unique, flush = numpy.zeros(size, numpy.int64), numpy.zeros(size, numpy.int64)
+    unique27, flush27 = numpy.zeros(size, numpy.int64), numpy.zeros(size, numpy.int64)
+    low = numpy.zeros(size, numpy.int64)
+    for ranks in combinations(range(13), 5):
+        bits = sum([1 << r for r in ranks])
+        unique[bits]   = _handval(ranks)
+        flush[bits]    = _handval(ranks, flush=True)
+        unique27[bits] = _handval(ranks, wheel=False)
+        flush27[bits]  = _handval(ranks, flush=True, wheel=False)
+        low[bits]      = _handval(ranks, straights=False)
+    paired = {}
+    for ranks in combinations_with_replacement(range(13), 5):
+        order, shape = _groups(ranks)
+        if len(order) < 5 and shape[0] < 5:
+            paired[int(numpy.prod(PRIMES[list(ranks)]))] = _handval(ranks)
+    keys = sorted(paired)
+    return {'unique': unique, 'flush': flush, 'unique27': unique27, 'flush27': flush27, 'low': low,
+            'pkeys': numpy.array(keys, numpy.int64), 'pvalues': numpy.array([paired[k] for k in keys], numpy.int64)}
+
+TABLES = {}     # filled in by _tables() when the first hand is valued, not at import
+
+def _tables():
+    if not TABLES:
+        TABLES.update(_build_tables())
+    return TABLES
+
+def _paired(ranks):
+    tables = _tables()
+    keys = PRIMES[ranks].prod(axis=-1)
+    idx = numpy.searchsorted(tables['pkeys'], keys).clip(0, len(tables['pkeys']) - 1)
+    return tables['pvalues'][idx]
+
+def eval5(cards, kind='hi'):
+    """Value every five card hand in an (..., 5) array of card indexes.
+
+       kind is 'hi', or the low variant: '8', 'a5' or '27'."""
+    tables = _tables()
+    cards = numpy.asarray(cards, numpy.int64)
+    ranks = cards % 13
+    if kind in ('8', 'a5'):
+        ranks = LOWRANK[ranks]
+    bits = numpy.bitwise_or.reduce(numpy.left_shift(1, ranks), axis=-1)
+    unique = POPCOUNT[bits] == 5
+    if kind == '8':
+        return numpy.where(unique & (bits < 0x100), tables['low'][bits], LOW_NOTHING)
+    if kind == 'a5':
+        return numpy.where(unique, tables['low'][bits], _paired(ranks))
+    suits = cards // 13
+    flush = (suits == suits[..., :1]).all(axis=-1)
+    u, f = ('unique27', 'flush27') if kind == '27' else ('unique', 'flush')
+    return numpy.where(unique, numpy.where(flush, tables[f][bits], tables[u][bits]), _paired(ranks))
+
+_combos = {}
+def hand_combos(ncards, nboard=0, omaha=False):
+    """Index array of the five card hands playable from ncards pocket cards
+       followed by nboard board cards."""
+    key = (ncards, nboard, omaha)
+    if key not in _combos:
+        if omaha and nboard:
+            idx = [p + b for p in combinations(range(ncards), 2)
+                         for b in combinations(range(ncards, ncards + nboard), 3)]
+        else:
+            idx = list(combinations(range(ncards + nboard), 5))
+        _combos[key] = numpy.array(idx, numpy.int64).reshape(-1, 5)
+    return _combos[key]
+
+
+class HandEvaluator:
+    """Drop-in for pokereval.PokerEval, see the module docstring."""
+    def __init__(self, seed=None):
+        self.random = numpy.random.RandomState(seed)
+
+    def string2card(self, cards):
+        if isinstance(cards, (list, tuple)):
+            return [self.string2card(c) for c in cards]
+        if isinstance(cards, (int, long, numpy.integer)):
+            return cards
+        card = Card.encodeCardList.get(cards, 0)
+        return card - 1 if card else UNKNOWN
+
+    def card2string(self, cards):
+        if isinstance(cards, (list, tuple)):
+            return [self.card2string(c) for c in cards]
+        if cards == UNKNOWN:
+            return '__'
+        return RANKS[cards % 13] + SUITS[cards // 13]
+
+    def _rules(self, game):
+        if game not in GAMES:
+            raise RuntimeError("HandEvaluator: game %s is not supported" % game)
+        return GAMES[game]
+
+    def best(self, side, hand, board=[]):
+        """Best hi or (eight or better) low hand, as pokereval.best.
+           With a board, exactly two pocket and three board cards play."""
+        cards = self.string2card(list(hand) + list(board))
+        if UNKNOWN in cards or len(cards) < 5:
+            return False
+        combos = numpy.array(cards, numpy.int64)[hand_combos(len(hand), len(board), bool(board))]
+        if side == 'hi':
+            values = eval5(combos)
+            i = values.argmax()
+        else:
+            values = eval5(combos, '8')
+            i = values.argmin()
+        value = int(values[i])
+        if value == LOW_NOTHING:
+            return value, ['Nothing']
+        return value, [HANDTYPES[value >> 24]] + self._order(side, value, [int(c) for c in combos[i]])
+
+    def _order(self, side, value, cards):
+        """Cards of a five card hand in the order they are compared."""
+        if side != 'hi':
+            return sorted(cards, key=lambda c: LOWRANK[c % 13], reverse=True)
+        order, shape = _groups([c % 13 for c in cards])
+        if value >> 24 in (STRAIGHT, STFLUSH) and (value >> 16) & 0xF == 3:
+            order = [3, 2, 1, 0, 12]
+        return sorted(cards, key=lambda c: order.index(c % 13))
+
+    def _deals(self, deck, k, iterations):
+        """Yield arrays of k cards drawn from deck, CHUNK deals at a time:
+           every combination when iterations is 0, else random samples."""
+        if k == 0:
+            yield numpy.zeros((1, 0), numpy.int64)
+        elif not iterations or iterations < 0:
+            deals = combinations(deck, k)
+            while True:
+                chunk = numpy.fromiter((c for d in islice(deals, CHUNK) for c in d), numpy.int64)
+                if not len(chunk):
+                    break
+                yield chunk.reshape(-1, k)
+        else:
+            deck = numpy.array(deck, numpy.int64)
+            while iterations > 0:
+                n = min(CHUNK, iterations)
+                iterations -= n
+                yield deck[self.random.random_sample((n, len(deck))).argsort(axis=1)[:, :k]]
+
+    def _values(self, rules, pocket, board, rows):
+        """Hi and low value of each deal for one player."""
+        omaha, hi, low = rules
+        combos = rows[:, pocket + board][:, hand_combos(len(pocket), len(board), omaha)]
+        his = eval5(combos).max(axis=1) if hi else None
+        lows = eval5(combos, low).min(axis=1) if low else None
+        return his, lows
+
+    def _share(self, rules, his, lows):
+        """Fraction of the pot each player wins on each deal."""
+        omaha, hi, low = rules
+        share = numpy.zeros((his if hi else lows).shape)
+        winhi = winlo = None
+        haslow = numpy.zeros(share.shape[1], bool)
+        if low:
+            winlo = lows == lows.min(axis=0)
+            haslow = lows.min(axis=0) < LOW_NOTHING
+            winlo &= haslow
+            share += numpy.where(haslow, 1.0 if not hi else 0.5, 0) * winlo / numpy.maximum(winlo.sum(axis=0), 1)
+        if hi:
+            winhi = his == his.max(axis=0)
+            share += numpy.where(haslow, 0.5, 1.0) * winhi / winhi.sum(axis=0)
+        return share, winhi, winlo
+
+    def poker_eval(self, game='holdem', pockets=[], board=[], dead=[], iterations=0, fill_pockets=0):
+        """Equity of each pocket, as pokereval.poker_eval.
+
+           '__' in pockets or board are dealt from the remaining deck. With
+           iterations > 0 the deals are sampled, otherwise every board is
+           enumerated; unknown pocket cards always use sampling."""
+        rules = self._rules(game)
+        pockets = [self.string2card(list(p)) for p in pockets]
+        board = self.string2card(list(board))
+        dead = [c for c in self.string2card(list(dead)) if c != UNKNOWN]
+        template = [c for p in pockets for c in p] + board
+        known = [c for c in template if c != UNKNOWN] + dead
+        if len(set(known)) != len(known):
+            raise RuntimeError("HandEvaluator: duplicate cards %s" % self.card2string(known))
+        deck = [c for c in range(52) if c not in set(known)]
+        holes = [i for i, c in enumerate(template) if c == UNKNOWN]
+        if UNKNOWN in template[:len(template) - len(board)] and (not iterations or iterations < 0):
+            iterations = DEFAULT_ITERATIONS
+        slots, start = [], 0
+        for p in pockets:
+            slots.append(range(start, start + len(p)))
+            start += len(p)
+        boardslots = range(start, start + len(board))
+
+        omaha, hi, low = rules
+        stats = dict([(k, numpy.zeros(len(pockets))) for k in ('scoop', 'winhi', 'losehi', 'tiehi', 'winlo', 'loselo', 'tielo', 'ev')])
+        samples = 0
+        for deal in self._deals(deck, len(holes), iterations):
+            rows = numpy.repeat(numpy.array([template], numpy.int64), len(deal), axis=0)
+            rows[:, holes] = deal
+            values = [self._values(rules, s, boardslots, rows) for s in slots]
+            his = numpy.array([v[0] for v in values]) if hi else None
+            lows = numpy.array([v[1] for v in values]) if low else None
+            share, winhi, winlo = self._share(rules, his, lows)
+            samples += len(deal)
+            stats['ev'] += share.sum(axis=1)
+            stats['scoop'] += (share == 1).sum(axis=1)
+            for side, win in (('hi', winhi), ('lo', winlo)):
+                if win is not None:
+                    stats['win' + side] += (win & (win.sum(axis=0) == 1)).sum(axis=1)
+                    stats['tie' + side] += (win & (win.sum(axis=0) > 1)).sum(axis=1)
+                    stats['lose' + side] += (~win).sum(axis=1)
+
+        result = []
+        for i in range(len(pockets)):
+            e = dict([(k, int(v[i])) for k, v in stats.items()])
+            e['ev'] = int(1000 * stats['ev'][i] / samples)
+            result.append(e)
+        return {'info': (samples, int(bool(low)), int(hi)), 'eval': result}
+
+    def winners(self, game='holdem', pockets=[], board=[], dead=[]):
+        """Indexes of the pockets winning the hi and low pots of a complete
+           deal, as pokereval.winners. Pockets with unknown cards can't win."""
+        rules = self._rules(game)
+        omaha, hi, low = rules
+        pockets = [self.string2card(list(p)) for p in pockets]
+        board = self.string2card(list(board))
+        live = [i for i, p in enumerate(pockets) if UNKNOWN not in p]
+        if UNKNOWN in board or not live:
+            raise RuntimeError("HandEvaluator: winners needs a complete deal")
+        his, lows = [], []
+        for i in live:
+            rows = numpy.array([pockets[i] + board], numpy.int64)
+            h, l = self._values(rules, range(len(pockets[i])), range(len(pockets[i]), len(pockets[i]) + len(board)), rows)
+            his.append(h[0] if hi else 0)
+            lows.append(l[0] if low else LOW_NOTHING)
+        result = {}
+        if hi:
+            result['hi'] = [live[i] for i, v in enumerate(his) if v == max(his)]
+        if low and min(lows) < LOW_NOTHING:
+            result['low'] = [live[i] for i, v in enumerate(lows) if v == min(lows)]
+        return result
@@ -26,6 +26,7 @@ import os
 import os.path
 import xml.dom.minidom
 import codecs
+import itertools
 from decimal_wrapper import Decimal
 import operator
 from xml.dom.minidom import Node
@@ -47,7 +48,7 @@ import Configuration
 
 class HandHistoryConverter():
 
-    READ_CHUNK_SIZE = 10000 # bytes to read at a time from file in tail mode
+    READ_CHUNK_SIZE = 1048576 # bytes to read at a time from file in tail mode
 
     # filetype can be "text" or "xml"
     # so far always "text"
@@ -77,7 +78,7 @@ out_path  (default '-' = sys.stdout)
         log.info("HandHistory init - %s site, %s subclass, in_path '%r'; out_path '%r'"
                  % (self.sitename, self.__class__, in_path, out_path) ) # should use self.filter, not self.sitename
 
-        self.index     = index
+        self.index     = index      # byte offset in in_path to start reading from
         self.starsArchive = starsArchive
         self.ftpArchive = ftpArchive
 
@@ -87,11 +88,14 @@ out_path  (default '-' = sys.stdout)
         self.kodec = None
 
         self.processedHands = []
+        self.handBatch = 0          # see setHandBatch
+        self.handCallback = None
         self.numHands = 0
         self.numErrors = 0
         self.numPartial = 0
         self.isCarraige = False
         self.autoPop = False
+        self.timings = {'read': 0.0, 'split': 0.0, 'parse': 0.0}   # seconds spent in each step of start()
 
         # Tourney object used to store TourneyInfo when called to deal with a Summary file
         self.tourney = None
@@ -131,14 +135,24 @@ HandHistoryConverter: '%(sitename)s'
         self.numSkipped = 0
         self.numErrors = 0
         lastParsed = None
-        handsList = self.allHandsAsList()
-        log.debug( _("Hands list is:") + str(handsList))
-        log.info(_("Parsing %d hands") % len(handsList))
+        self.timings = {'read': 0.0, 'split': 0.0, 'parse': 0.0}
+        if self.canStream():
+            handsList = self.timeSplit(self.iterHands())
+        else:
+            handsList = self.allHandsAsList()
+            self.timings['split'] += time.time() - starttime - self.timings['read']
+            log.debug( _("Hands list is:") + str(handsList))
+            log.info(_("Parsing %d hands") % len(handsList))
+        handsList = iter(handsList)
+        firstHand = next(handsList, None)
         # Determine if we're dealing with a HH file or a Summary file
         # quick fix : empty files make the handsList[0] fail ==> If empty file, go on with HH parsing
-        if len(handsList) == 0 or self.isSummary(handsList[0]) == False:
+        if firstHand is None or self.isSummary(firstHand) == False:
             self.parsedObjectType = "HH"
-            for handText in handsList:
+            handText = None
+            for handText in itertools.chain([firstHand] if firstHand is not None else [], handsList):
+                self.numHands += 1
+                ptime = time.time()
                 try:
                     self.processedHands.append(self.processHand(handText))
                     lastParsed = 'stored'
@@ -153,54 +167,62 @@ HandHistoryConverter: '%(sitename)s'
                     self.numErrors += 1
                     lastParsed = 'error'
                     log.error(_("FpdbParseError for file '%s'") % self.in_path)
+                self.timings['parse'] += time.time() - ptime
+                if self.handCallback and len(self.processedHands) >= self.handBatch:
+                    self.flushHands()
             if lastParsed in ('partial', 'error') and self.autoPop:
-                self.index -= len(handsList[-1])
-                if self.isCarraige:
-                     self.index -= handsList[-1].count('\n')
-                handsList.pop()
+                self.unread(handText)
+                self.numHands -= 1
                 if lastParsed=='partial':
                     self.numPartial -= 1
                 else:
                     self.numErrors -= 1
                 log.info(_("Removing partially written hand & resetting index"))
-            self.numHands = len(handsList)
+            if self.handCallback and self.processedHands:
+                self.flushHands()
             endtime = time.time()
             log.info(_("Read %d hands (%d failed) in %.3f seconds") % (self.numHands, (self.numErrors + self.numPartial), endtime - starttime))
         else:
             self.parsedObjectType = "Summary"
-            summaryParsingStatus = self.readSummaryInfo(handsList)
+            summaryParsingStatus = self.readSummaryInfo([firstHand] + list(handsList))
             endtime = time.time()
             if summaryParsingStatus :
                 log.info(_("Summary file '%s' correctly parsed (took %.3f seconds)") % (self.in_path, endtime - starttime))
             else :
                 log.warning(_("Error converting summary file '%s' (took %.3f seconds)") % (self.in_path, endtime - starttime))
     
+    def timeSplit(self, hands):
+        """Yield hands, adding the time taken to split each one off (less reading) to timings"""
+        hands = iter(hands)
+        while True:
+            (stime, read) = (time.time(), self.timings['read'])
+            handText = next(hands, None)
+            self.timings['split'] += time.time() - stime - (self.timings['read'] - read)
+            if handText is None:
+                return
+            yield handText
+
+    def setHandBatch(self, size, callback):
+        """Have start() pass the processed hands to callback(hands), size hands at a time,
+           instead of keeping them all in processedHands. Together with iterHands this
+           bounds the memory used by a file to a batch of hands, whatever its size"""
+        self.handBatch = max(1, size)
+        self.handCallback = callback
+
+    def flushHands(self):
+        (hands, self.processedHands) = (self.processedHands, [])
+        self.handCallback(hands)
+
     def setAutoPop(self, value):
         self.autoPop = value
                 
     def allHandsAsList(self):
         """Return a list of handtexts in the file at self.in_path"""
-        #TODO : any need for this to be generator? e.g. stars support can email one huge file of all hands in a year. Better to read bit by bit than all at once.
         self.readFile()
         lenobs = len(self.obs)
         self.obs = self.obs.rstrip()
-        self.index -= (lenobs - len(self.obs))
-        self.obs = self.obs.lstrip()
-        lenobs = len(self.obs)
-        self.obs = self.obs.replace('\r\n', '\n').replace(u'\xa0', u' ')
-        if lenobs != len(self.obs):
-            self.isCarraige = True
-        # maybe archive params should be one archive param, then call method in specific converter?
-        # if self.archive:
-        #     self.obs = self.convert_archive(self.obs)
-        if self.starsArchive == True:
-            m = re.compile('^Hand #\d+', re.MULTILINE)
-            self.obs = m.sub('', self.obs)
-
-        if self.ftpArchive == True:
-            # Remove  ******************** # 1 *************************
-            m = re.compile('\*{20}\s#\s\d+\s\*{20,25}\s+', re.MULTILINE)
-            self.obs = m.sub('', self.obs)
+        self.unread(lenobs - len(self.obs))
+        self.obs = self.normaliseText(self.obs.lstrip())
     
         if self.obs is None or self.obs == "":
             log.info(_("Read no hands from file: '%s'") % self.in_path)
@@ -210,13 +232,100 @@ HandHistoryConverter: '%(sitename)s'
         # ie. </game> (split) </session>EOL
         # Remove this dangler if less than 50 characters and warn in the log
         if len(handlist[-1]) <= 50:
-            self.index -= len(handlist[-1])
-            if self.isCarraige:
-                self.index -= handlist[-1].count('\n')
+            self.unread(handlist[-1])
             handlist.pop()
             log.info(_("Removing text < 50 characters & resetting index"))
         return handlist
 
+    def normaliseText(self, text):
+        """Line endings, non-breaking spaces and archive separators as the parsers expect them"""
+        lentext = len(text)
+        text = text.replace('\r\n', '\n').replace(u'\xa0', u' ')
+        if lentext != len(text):
+            self.isCarraige = True
+        # maybe archive params should be one archive param, then call method in specific converter?
+        # if self.archive:
+        #     text = self.convert_archive(text)
+        if self.starsArchive == True:
+            m = re.compile('^Hand #\d+', re.MULTILINE)
+            text = m.sub('', text)
+
+        if self.ftpArchive == True:
+            # Remove  ******************** # 1 *************************
+            m = re.compile('\*{20}\s#\s\d+\s\*{20,25}\s+', re.MULTILINE)
+            text = m.sub('', text)
+        return text
+
+    def canStream(self):
+        """True if the hands in in_path can be read a chunk at a time by iterHands.
+           Auto-import gives back partly written hands by moving the index, which
+           needs the text read (see unread), and copyGameHeader parsers need the whole file"""
+        return (self.filetype == "text" and not self.autoPop and not self.copyGameHeader
+                and self.allHandsAsList.im_func is HandHistoryConverter.allHandsAsList.im_func)
+
+    def iterHands(self):
+        """Generator doing the same as allHandsAsList, READ_CHUNK_SIZE bytes at a time.
+           Only the hand being read is held in memory, so large archives can be imported"""
+        for kodec in self.__listof(self.codepage):
+            if self.probeKodec(kodec):
+                self.kodec = kodec
+                break
+        else:
+            log.error(_("unable to read file with any codec in list!") + " " + self.in_path)
+            return
+        (in_fh, decoder) = self.openTail(self.kodec)
+        try:
+            (raw, text, nhands) = (u'', u'', 0)
+            while True:
+                rtime = time.time()
+                chunk = in_fh.read(self.READ_CHUNK_SIZE)
+                self.index += len(chunk)
+                pending = decoder.getstate()[0]
+                try:
+                    raw += decoder.decode(chunk, not chunk)
+                except UnicodeError:
+                    (decoder, decoded) = self.switchKodec(pending + chunk, not chunk)
+                    if decoder is None:
+                        log.error(_("unable to read file with any codec in list!") + " " + self.in_path)
+                        return
+                    raw += decoded
+                self.timings['read'] += time.time() - rtime
+                if chunk:
+                    # hold back the line being read and any whitespace before it, so
+                    # that no separator or \r\n is normalised or split in two pieces
+                    i = raw.rfind(u'\n')
+                    while i >= 0 and (i + 1 == len(raw) or raw[i+1].isspace()):
+                        i = raw.rfind(u'\n', 0, i)
+                    if i < 0:
+                        continue
+                    (done, raw) = (raw[:i+1], raw[i+1:])
+                else:
+                    (done, raw) = (raw.rstrip(), u'')
+                if not text:
+                    done = done.lstrip()
+                text += self.normaliseText(done)
+                start = 0
+                for m in self.re_SplitHands.finditer(text):
+                    if m.start() == m.end():
+                        continue # re.split ignores empty matches
+                    if chunk and m.end() == len(text):
+                        break    # the separator may go on in the next chunk
+                    nhands += 1
+                    yield text[start:m.start()]
+                    start = m.end()
+                text = text[start:]
+                if not chunk:
+                    break
+        finally:
+            in_fh.close()
+        # Some HH formats leave dangling text after the split, see allHandsAsList
+        if nhands == 0 and text == "":
+            log.info(_("Read no hands from file: '%s'") % self.in_path)
+        elif len(text) <= 50:
+            log.info(_("Removing text < 50 characters & resetting index"))
+        else:
+            yield text
+
     def processHand(self, handText):
         if self.isPartial(handText):
             raise FpdbHandPartial(_("Could not identify as a %s hand") % self.sitename)
@@ -468,32 +577,143 @@ or None if we fail to get the info """
         else:
             return [x]
 
+    def setKodec(self, kodec):
+        """Codec found by an earlier read of in_path, used instead of self.codepage"""
+        self.kodec = kodec
+
     def readFile(self):
-        """Open in_path according to self.codepage. Exceptions caught further up"""
+        """Read in_path from byte offset self.index according to self.codepage.
+           Only the bytes added since the last read are decoded, self.index is moved
+           to the end of the last complete character. Exceptions caught further up"""
 
         if self.filetype == "text":
-            for kodec in self.__listof(self.codepage):
-                #print "trying", kodec
+            if self.kodec:
+                # a file still being written may end inside a multi-byte character
                 try:
-                    in_fh = codecs.open(self.in_path, 'r', kodec)
-                    self.whole_file = in_fh.read()
-                    in_fh.close()
-                    self.obs = self.whole_file[self.index:]
-                    self.index = len(self.whole_file)
-                    self.kodec = kodec
+                    self.readTail(self.kodec, False)
                     return True
                 except:
-                    pass
-            else:
-                log.error(_("unable to read file with any codec in list!") + " " + self.in_path)
-                self.obs = ""
-                return False
+                    log.warning(_("File '%s' does not decode as %s past byte %d, trying the codecs of %s")
+                                % (self.in_path, self.kodec, self.index, self.sitename))
+                    self.kodec = None
+            for kodec in self.__listof(self.codepage):
+                # an incomplete trailing character is only accepted if the codec cannot
+                # decode the whole file, utf-16 leaves any odd length file incomplete so
+                # must decode it all
+                if codecs.lookup(kodec).name == 'utf-16':
+                    finals = (True,)
+                else:
+                    finals = (True, False)
+                for final in finals:
+                    #print "trying", kodec
+                    try:
+                        self.readTail(kodec, final)
+                        self.kodec = kodec
+                        return True
+                    except:
+                        pass
+            log.error(_("unable to read file with any codec in list!") + " " + self.in_path)
+            self.obs = ""
+            return False
         elif self.filetype == "xml":
             doc = xml.dom.minidom.parse(self.filename)
             self.doc = doc
         elif self.filetype == "":
             pass
 
+    def openTail(self, kodec):
+        """Open in_path at byte offset self.index. Returns the file and a decoder for kodec"""
+        in_fh = open(self.in_path, 'rb')
+        if self.index > os.fstat(in_fh.fileno()).st_size:
+            log.info(_("File '%s' was truncated, reading it from the start") % self.in_path)
+            self.index = 0
+        decoder = codecs.getincrementaldecoder(kodec)()
+        if self.index > 0 and codecs.lookup(kodec).name == 'utf-16':
+            decoder.decode(in_fh.read(2)) # let the decoder pick up the byte order mark
+        in_fh.seek(self.index)
+        return (in_fh, decoder)
+
+    def probeKodec(self, kodec):
+        """True if the first READ_CHUNK_SIZE bytes of in_path from self.index decode with kodec.
+           The rest of the file is checked as iterHands reads it, see switchKodec"""
+        rtime = time.time()
+        try:
+            (in_fh, decoder) = self.openTail(kodec)
+        except (IOError, LookupError):
+            return False
+        try:
+            try:
+                chunk = in_fh.read(self.READ_CHUNK_SIZE)
+                decoder.decode(chunk, len(chunk) < self.READ_CHUNK_SIZE)
+                return True
+            except (UnicodeError, LookupError):
+                return False
+        finally:
+            in_fh.close()
+            self.timings['read'] += time.time() - rtime
+
+    def switchKodec(self, data, final):
+        """(decoder, text) of the next codec of self.codepage that decodes data, the bytes
+           the codec in use failed on part way through the file, or (None, u'') if none does.
+           The hands already read stay as the earlier codec decoded them"""
+        kodecs = list(self.__listof(self.codepage))
+        if self.kodec in kodecs:
+            kodecs = kodecs[kodecs.index(self.kodec) + 1:]
+        for kodec in kodecs:
+            try:
+                decoder = codecs.getincrementaldecoder(kodec)()
+                text = decoder.decode(data, final)
+            except (UnicodeError, LookupError):
+                continue
+            log.warning(_("File '%s' does not decode as %s past byte %d, reading the rest as %s")
+                        % (self.in_path, self.kodec, self.index - len(data), kodec))
+            self.kodec = kodec
+            return (decoder, text)
+        return (None, u'')
+
+    def readTail(self, kodec, final):
+        """Decode in_path from byte offset self.index to the end of the file"""
+        rtime = time.time()
+        (in_fh, decoder) = self.openTail(kodec)
+        try:
+            start, data, nbytes = self.index, [], 0
+            while True:
+                chunk = in_fh.read(self.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                nbytes += len(chunk)
+                data.append(decoder.decode(chunk))
+            data.append(decoder.decode('', final))
+            if self.copyGameHeader and start > 0:
+                in_fh.seek(0)
+                self.whole_file = in_fh.read().decode(kodec, 'replace')
+        finally:
+            in_fh.close()
+            self.timings['read'] += time.time() - rtime
+        self.obs = u''.join(data)
+        if not self.copyGameHeader or start == 0:
+            self.whole_file = self.obs
+        pending = decoder.getstate()[0]     # bytes of an incomplete trailing character
+        self.index = start + nbytes - len(pending)
+        self.rawObs, self.rawEnd = self.obs, len(self.obs)
+
+    def unread(self, text):
+        """Move self.index back over the last characters read, so that they are
+           read again next time. text is either the (normalised) text to give back
+           or a number of characters"""
+        if isinstance(text, basestring):
+            n = len(text)
+            if self.isCarraige:
+                n += text.count('\n')
+        else:
+            n = text
+        if n <= 0 or not getattr(self, 'rawObs', None):
+            return
+        n = min(n, self.rawEnd)
+        tail = self.rawObs[self.rawEnd - n:self.rawEnd]
+        self.rawEnd -= n
+        self.index -= len(tail.encode(self.kodec)) - len(u''.encode(self.kodec))
+
     def guessMaxSeats(self, hand):
         """Return a guess at maxseats when not specified in HH."""
         # if some other code prior to this has already set it, return it
@@ -532,9 +752,12 @@ or None if we fail to get the info """
     def getProcessedFile(self):
         return self.out_path
 
-    def getLastCharacterRead(self):
+    def getLastByteRead(self):
         return self.index
 
+    def getKodec(self):
+        return self.kodec
+
     def isSummary(self, topline):
         return " Tournament Summary " in topline
 
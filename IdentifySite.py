@@ -24,6 +24,8 @@ import os
 from time import time
 from optparse import OptionParser
 import codecs
+import hashlib
+import cPickle
 import Database
 import Configuration
 import logging
@@ -41,6 +43,10 @@ re_Head['Fulltilt'] = re.compile(r'^((BEGIN)?\n)?FullTiltPoker.+\n\nSeat', re.MU
 re_XLS['PokerStars'] = re.compile(r'Tournaments\splayed\sby\s\'.+?\'')
 re_XLS['Fulltilt'] = re.compile(r'Player\sTournament\sReport\sfor\s.+?\s\(.*\)')
 
+HEAD_SIZE = 0x8000  # bytes read from the start of a file to identify it, idSite looks at 10000 chars at most
+TAIL_SIZE = 0x2000  # bytes read from its end, so archive dividers are found after the head too
+HASH_SIZE = 0x400   # bytes hashed into the fingerprint of a file, see IdentifySite.fingerprint
+
 class FPDBFile:
     path = ""
     ftype = None # Valid: hh, summary, both
@@ -118,8 +124,81 @@ class IdentifySite:
         self.codepage = ("utf8", "utf-16", "cp1252", "ISO-8859-1")
         self.sitelist = {}
         self.filelist = {}
+        self.hits = {}       # siteId --> files identified, sites are tried most common first
+        self.path = None     # of the saved fingerprints, see load()
+        self.cache = {}      # path --> (fingerprint, site id and file details or None if not identified)
+        self.dirty = False
         self.generateSiteList(hhcs)
 
+    def load(self, path):
+        """Keep the sites of files identified in path, so that unchanged files aren't read again"""
+        if path == self.path:
+            return
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                saved = cPickle.load(f)
+        except (IOError, EOFError, TypeError, AttributeError, cPickle.UnpicklingError):
+            return
+        # the sites in use decide what a file is identified as, a file no site knew may be known now
+        if saved.get('sites') == sorted(self.sitelist):
+            saved['files'].update(self.cache)
+            self.cache = saved['files']
+            for id, n in saved['hits'].iteritems():
+                self.hits[id] = self.hits.get(id, 0) + n
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        try:
+            with open(self.path + '.tmp', 'wb') as f:
+                cPickle.dump({'sites': sorted(self.sitelist), 'hits': self.hits, 'files': self.cache},
+                             f, cPickle.HIGHEST_PROTOCOL)
+            self.dirty = False
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(self.path + '.tmp', self.path)
+        except (IOError, OSError), e:
+            log.error(_("Could not save the site cache %s: %s") % (self.path, e))
+
+    def fingerprint(self, path):
+        """(size, mtime, hash of the first bytes) of path, None if it can't be read"""
+        try:
+            st = os.stat(path)
+            with open(path, 'rb') as f:
+                head = f.read(HASH_SIZE)
+        except (IOError, OSError):
+            return None
+        return (st.st_size, st.st_mtime, hashlib.md5(head).hexdigest())
+
+    def cached(self, path, fingerprint):
+        """The FPDBFile saved for path if it hasn't changed, False if it wasn't identified, None if unknown"""
+        (saved, details) = self.cache.get(path, (None, None))
+        if fingerprint is None or saved != fingerprint:
+            return None
+        if details is None:
+            return False
+        (id, ftype, kodec, hero, archive, archiveHead, archiveDivider) = details
+        if id not in self.sitelist:
+            return None
+        f = FPDBFile(path)
+        f.site, f.ftype, f.kodec, f.hero = self.sitelist[id], ftype, kodec, hero
+        f.archive, f.archiveHead, f.archiveDivider = archive, archiveHead, archiveDivider
+        return f
+
+    def remember(self, path, fingerprint, f):
+        if fingerprint is None:
+            return
+        if f == False:
+            details = None
+        else:
+            ids = [id for id, site in self.sitelist.iteritems() if site is f.site]
+            if not ids:     # PokerTracker files get a Site of their own, they are identified again
+                return
+            details = (ids[0], f.ftype, f.kodec, f.hero, f.archive, f.archiveHead, f.archiveDivider)
+        self.cache[path] = (fingerprint, details)
+        self.dirty = True
+
     def scan(self, path):
         if os.path.isdir(path):
             self.walkDirectory(path, self.sitelist)
@@ -174,15 +253,21 @@ class IdentifySite:
 
     def processFile(self, path):
         if path not in self.filelist:
-            whole_file, kodec = self.read_file(path)
-            if whole_file:
+            fingerprint = self.fingerprint(path) if self.path else None
+            fobj = self.cached(path, fingerprint)
+            if fobj is None:
+                whole_file, kodec = self.read_file(path)
+                if not whole_file:
+                    return
                 fobj = self.idSite(path, whole_file, kodec)
-                if fobj == False: # Site id failed
-                    log.debug(_("DEBUG:") + " " + _("siteId Failed for: %s") % path)
-                else:
-                    self.filelist[path] = fobj
+                self.remember(path, fingerprint, fobj)
+            if fobj == False: # Site id failed
+                log.debug(_("DEBUG:") + " " + _("siteId Failed for: %s") % path)
+            else:
+                self.filelist[path] = fobj
 
     def read_file(self, in_path):
+        """The start of in_path, followed by its end if it is a long file, decoded with the first codepage that fits"""
         if in_path.endswith('.xls') or in_path.endswith('.xlsx') and xlrd:
             try:
                 wb = xlrd.open_workbook(in_path)
@@ -191,21 +276,41 @@ class IdentifySite:
                 return header, 'utf-8'
             except:
                 return None, None
+        try:
+            size = os.path.getsize(in_path)
+            with open(in_path, 'rb') as infile:
+                head, tail = infile.read(HEAD_SIZE), ''
+                if size > HEAD_SIZE:
+                    start = max(HEAD_SIZE, size - TAIL_SIZE)
+                    infile.seek(start + start % 2)  # utf-16 characters start at even offsets
+                    tail = infile.read()
+        except (IOError, OSError):
+            return None, None
         for kodec in self.codepage:
             try:
-                infile = codecs.open(in_path, 'r', kodec)
-                whole_file = infile.read()
-                infile.close()
-                return whole_file, kodec
-            except:
+                # not final when there's more to the file, a character cut in two at the end is fine
+                whole_file = codecs.getincrementaldecoder(kodec)().decode(head, not tail)
+            except UnicodeError:
                 continue
+            if tail:
+                if codecs.lookup(kodec).name == 'utf-16':
+                    kodec_tail = 'utf-16-be' if head.startswith(codecs.BOM_UTF16_BE) else 'utf-16-le'
+                else:
+                    kodec_tail = kodec
+                whole_file += '\n' + tail.decode(kodec_tail, 'replace')
+            return whole_file, kodec
         return None, None
+
+    def bySiteHits(self):
+        """sitelist items, the sites most files were identified as first"""
+        return sorted(self.sitelist.iteritems(), key = lambda (id, site): -self.hits.get(id, 0))
     
     def idSite(self, path, whole_file, kodec):
         """Identifies the site the hh file originated from"""
         f = FPDBFile(path)
         f.kodec = kodec
-        for id, site in self.sitelist.iteritems():
+        sites = self.bySiteHits()
+        for id, site in sites:
             filter_name = site.filter_name
             m = site.re_Identify.search(whole_file[:5000])
             if m and filter_name in ('Fulltilt', 'PokerStars'):
@@ -219,6 +324,7 @@ class IdentifySite:
             if m:
                 f.site = site
                 f.ftype = "hh"
+                self.hits[id] = self.hits.get(id, 0) + 1
                 if f.site.re_HeroCards:
                     h = f.site.re_HeroCards.search(whole_file[:5000])
                     if h and 'PNAME' in h.groupdict():
@@ -227,7 +333,7 @@ class IdentifySite:
                     f.hero = 'Hero'
                 return f
 
-        for id, site in self.sitelist.iteritems():
+        for id, site in sites:
             if site.summary:
                 if path.endswith('.xls') or path.endswith('.xlsx'):
                     filter_name = site.filter_name
@@ -236,12 +342,14 @@ class IdentifySite:
                         if m2:
                             f.site = site
                             f.ftype = "summary"
+                            self.hits[id] = self.hits.get(id, 0) + 1
                             return f
                 else:
                     m3 = site.re_SumIdentify.search(whole_file[:10000])
                     if m3:
                         f.site = site
                         f.ftype = "summary"
+                        self.hits[id] = self.hits.get(id, 0) + 1
                         return f
                 
         m1 = self.re_Identify_PT.search(whole_file[:5000])
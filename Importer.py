@@ -26,6 +26,9 @@ import datetime
 import Queue
 import shutil
 import re
+import json
+import threading
+import multiprocessing
 
 import logging, traceback
 
@@ -34,7 +37,9 @@ import gtk
 #    fpdb/FreePokerTools modules
 import Database
 import Configuration
+import DerivedStats
 import IdentifySite
+import DirectoryWatcher
 from Exceptions import FpdbParseError, FpdbHandDuplicate, FpdbHandPartial
 
 try:
@@ -47,6 +52,130 @@ if __name__ == "__main__":
 # logging has been set up in fpdb.py or HUD_main.py, use their settings:
 log = logging.getLogger("importer")
 
+# State of a parser process used by Importer.importFilesParallel. Each process
+# reads its own copy of the config and keeps its own database connection, so
+# the player and gametype caches of that connection live as long as the process.
+_parser = {}
+
+def _init_parser(config_file, dbname, dir_database, lock, testData):
+    """Pool initializer: set up config and database for this parser process"""
+    config = Configuration.Config(file = config_file, dbname = dbname)
+    config.dir_database = dir_database     # where the importer's sqlite database is
+    _parser['config']   = config
+    _parser['database'] = Database.Database(config)
+    _parser['lock']     = lock
+    _parser['testData'] = testData
+    # equities found by this process are returned with each file, the importer merges and saves them
+    if config.get_import_parameters().get('equityCache') and Configuration.CONFIG_PATH:
+        DerivedStats.equity_cache.load(os.path.join(Configuration.CONFIG_PATH, u"equities.bin"))
+    DerivedStats.equity_cache.collect()
+
+def _parse_hh_file(job):
+    """Parse one hh file in a parser process.
+
+       Runs the site converter, resolves the player, gametype and tourney ids
+       and assembles the derived stats of every hand. Ids are resolved while
+       holding the import lock and committed before it is released, so new
+       rows are visible to all other parsers and writers.
+       Returns a picklable dict, hands are stripped of their config."""
+    (path, hhc_fname, filter_name, sitename, archive) = job
+    result = {'path': path, 'hands': [], 'partial': 0, 'skipped': 0, 'errors': 0, 'numHands': 0,
+              'summaryInFile': False, 'ttold': set(), 'ttnew': set(), 'journal': {}, 'equities': {},
+              'error': None, 'timings': {}}
+    db = _parser['database']
+    try:
+        mod = __import__(hhc_fname)
+        obj = getattr(mod, filter_name, None)
+        if not callable(obj):
+            return result
+        hhc = obj(_parser['config'], in_path = path, index = 0, autostart=False
+                  ,starsArchive = archive
+                  ,ftpArchive   = archive
+                  ,sitename     = sitename)
+        hhc.setAutoPop(False)
+        hhc.start()
+        result['timings']  = dict(hhc.timings)
+        result['partial']  = hhc.numPartial
+        result['skipped']  = getattr(hhc, 'numSkipped', 0)
+        result['errors']   = hhc.numErrors
+        result['numHands'] = hhc.numHands
+        result['summaryInFile'] = hhc.summaryInFile
+        handlist = hhc.getProcessedHands()
+        if handlist:
+            db.resetClean()
+            _parser['lock'].acquire()
+            try:
+                stime = time()
+                db.resetTourneyCache()
+                db.prepSqlPlayerIDs(handlist)
+                for hand in handlist:
+                    hand.prepInsert(db, printtest = _parser['testData'])
+                db.flushTourneyCache()
+                db.commit()
+                result['timings']['prepInsert'] = time() - stime
+            finally:
+                _parser['lock'].release()
+            result['ttold'], result['ttnew'], result['journal'] = db.ttold, db.ttnew, db.cachejournal
+            stime = time()
+            for hand in handlist:
+                hand.assembleHand()
+                hand.config = None
+            result['timings']['assembleHand'] = time() - stime
+            result['hands'] = handlist
+    except:
+        db.rollback()
+        result['error'] = traceback.format_exc()
+    result['equities'] = DerivedStats.equity_cache.found()
+    return result
+
+class ImportTimer:
+    """Seconds spent in each stage of the import and hands counted, per file and per site.
+       Writer threads add to it too (see importFilesParallel), so updates hold a lock."""
+
+    STAGES = ('read', 'split', 'parse', 'prepInsert', 'assembleHand', 'updateSessionsCache', 'insertHands',
+              'updateCardsCache', 'updatePositionsCache', 'updateHudCache', 'insertHandsPlayers',
+              'insertHandsActions', 'insertHandsStove', 'commit')
+    COUNTS = ('hands', 'stored', 'duplicates', 'partial', 'skipped', 'errors')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}         # path: {'site': site name, stage or count: total}
+
+    def add(self, fpdbfile, totals):
+        """Add totals, a dict of stage seconds and/or counts, to those of fpdbfile"""
+        with self.lock:
+            entry = self.files.get(fpdbfile.path)
+            if entry is None:
+                entry = self.files[fpdbfile.path] = dict.fromkeys(self.STAGES + self.COUNTS, 0)
+                entry['site'] = fpdbfile.site.name
+            for key, value in totals.iteritems():
+                entry[key] += value
+
+    def report(self):
+        """{'files': {path: totals}, 'sites': {site name: totals}, 'total': totals}, the totals
+           being dicts of the seconds spent in each of STAGES and of the COUNTS"""
+        with self.lock:
+            files = dict((path, dict(entry)) for path, entry in self.files.iteritems())
+        (sites, total) = ({}, dict.fromkeys(self.STAGES + self.COUNTS, 0))
+        for entry in files.itervalues():
+            site = sites.setdefault(entry['site'], dict.fromkeys(self.STAGES + self.COUNTS, 0))
+            for key in self.STAGES + self.COUNTS:
+                site[key] += entry[key]
+                total[key] += entry[key]
+        return {'files': files, 'sites': sites, 'total': total}
+
+    def __str__(self):
+        report = self.report()
+        columns = [(name, report['sites'][name]) for name in sorted(report['sites'])] + [(_("Total"), report['total'])]
+        lines = ["%-22s" % "" + "".join("%14s" % name[:13] for name, totals in columns)]
+        for key in self.COUNTS:
+            lines.append("%-22s" % key + "".join("%14d" % totals[key] for name, totals in columns))
+        for key in self.STAGES:
+            lines.append("%-22s" % key + "".join("%14.3f" % totals[key] for name, totals in columns))
+        lines.append("%-22s" % _("ms per hand") + "".join("%14.2f" % (1000.0 * sum(totals[key] for key in self.STAGES)
+                                                                     / max(1, totals['hands'])) for name, totals in columns))
+        return "\n".join(lines)
+
 class Importer:
     def __init__(self, caller, settings, config, sql = None, parent = None):
         """Constructor"""
@@ -56,19 +185,21 @@ class Importer:
         self.sql        = sql
         self.parent     = parent
 
-        self.idsite = IdentifySite.IdentifySite(config)
+        self.idsite     = None       # made when the first file is added, it imports every site's converter
 
         self.filelist   = {}
         self.dirlist    = {}
         self.siteIds    = {}
         self.removeFromFileList = {} # to remove deleted files
         self.monitor    = False
+        self.watcher    = None       # reports the changed files of the monitored directories, see runUpdated
         self.updatedsize = {}
         self.updatedtime = {}
         self.lines      = None
         self.faobs      = None       # File as one big string
         self.mode       = None
-        self.pos_in_file = {}        # dict to remember how far we have read in the file
+        self.pos_in_file = {}        # dict to remember how far we have read in the file: (byte offset, codec, inode)
+        self.timer      = ImportTimer()  # stage timings of the files imported, see runImport
         #Set defaults
         self.callHud    = self.config.get_import_parameters().get("callFpdbHud")
 
@@ -84,14 +215,32 @@ class Importer:
         self.settings.setdefault("ftpArchive", False)
         self.settings.setdefault("testData", False)
         self.settings.setdefault("cacheHHC", False)
+        self.settings.setdefault("summaryBatch", 500)          # tourney summaries stored per transaction
+        self.settings.setdefault("handBatch", 1000)            # hands of a file parsed and stored at a time
 
         self.writeq = None
+        self.writelock = threading.Lock()
         self.database = Database.Database(self.config, sql = self.sql)
         self.writerdbs = []
         self.settings.setdefault("threads", 1) # value set by GuiBulkImport
         for i in xrange(self.settings['threads']):
             self.writerdbs.append( Database.Database(self.config, sql = self.sql) )
 
+        # Bloom filter of the hands already imported, saved in the config dir
+        self.handfilter = None
+        imp = self.config.get_import_parameters()
+        if imp.get('dupeFilter') and Configuration.CONFIG_PATH:
+            name = re.sub(r'\W', '_', "%s-%s-%s" % (self.database.db_server, self.database.host, self.database.database))
+            self.handfilter = Database.HandFilter(os.path.join(Configuration.CONFIG_PATH, u"handfilter-%s.bin" % name),
+                                                  imp['publicDB'])
+            self.database.handfilter = self.handfilter
+            for db in self.writerdbs:
+                db.handfilter = self.handfilter
+
+        # all-in equities by canonical deal, saved in the config dir
+        if imp.get('equityCache') and Configuration.CONFIG_PATH:
+            DerivedStats.equity_cache.load(os.path.join(Configuration.CONFIG_PATH, u"equities.bin"))
+
         clock() # init clock in windows
 
     #Set functions
@@ -151,6 +300,8 @@ class Importer:
 
     def logImport(self, type, file, stored, dups, partial, skipped, errs, ttime, id):
         hands = stored + dups + partial + skipped + errs
+        self.timer.add(self.filelist[file], {'hands': hands, 'stored': stored, 'duplicates': dups,
+                                             'partial': partial, 'skipped': skipped, 'errors': errs})
         now = datetime.datetime.utcnow()
         ttime100 = ttime * 100
         self.database.updateFile([type, now, now, hands, stored, dups, partial, skipped, errs, ttime100, True, id])
@@ -176,6 +327,11 @@ class Importer:
         if self.filelist.get(filename)!=None or not os.path.exists(filename):
             return False
 
+        if self.idsite is None:
+            self.idsite = IdentifySite.IdentifySite(self.config)
+            # sites of the files seen before, saved in the config dir
+            if self.config.get_import_parameters().get('siteCache') and Configuration.CONFIG_PATH:
+                self.idsite.load(os.path.join(Configuration.CONFIG_PATH, u"sites.bin"))
         self.idsite.processFile(filename)
         if self.idsite.get_fobj(filename):
             fpdbfile = self.idsite.filelist[filename]
@@ -228,6 +384,9 @@ class Importer:
             if monitor == True:
                 self.monitor = True
                 self.dirlist[site] = [dir] + [filter]
+                if self.watcher is None:
+                    self.watcher = DirectoryWatcher.watcher()
+                self.watcher.add(dir)
 
             #print "addImportDirectory: checking files in", dir
             for subdir in os.walk(dir):
@@ -241,18 +400,24 @@ class Importer:
             log.warning(_("Attempted to add non-directory '%s' as an import directory") % str(dir))
 
     def runImport(self):
-        """"Run full import on self.filelist. This is called from GuiBulkImport.py"""
+        """"Run full import on self.filelist. This is called from GuiBulkImport.py
+            Time spent in each stage is left in self.timer, see ImportTimer.report"""
 
         # Initial setup
         start = datetime.datetime.now()
         starttime = time()
+        self.timer = ImportTimer()
         log.info(_("Started at %s -- %d files to import. indexes: %s") % (start, len(self.filelist), self.settings['dropIndexes']))
         if self.settings['dropIndexes'] == 'auto':
             self.settings['dropIndexes'] = self.calculate_auto2(self.database, 12.0, 500.0)
         if 'dropHudCache' in self.settings and self.settings['dropHudCache'] == 'auto':
             self.settings['dropHudCache'] = self.calculate_auto2(self.database, 25.0, 500.0)    # returns "drop"/"don't drop"
+        if self.handfilter: self.handfilter.sync(self.database)
 
         (totstored, totdups, totpartial, totskipped, toterrors) = self.importFiles(None)
+        if self.handfilter: self.handfilter.save(self.database)
+        DerivedStats.equity_cache.save()
+        if self.idsite: self.idsite.save()
 
         # Tidying up after import
         #if 'dropHudCache' in self.settings and self.settings['dropHudCache'] == 'drop':
@@ -263,6 +428,7 @@ class Importer:
         self.runPostImport()
         self.database.analyzeDB()
         endtime = time()
+        log.info(_("Import timings (seconds):") + "\n%s" % self.timer)
         return (totstored, totdups, totpartial, totskipped, toterrors, endtime-starttime)
     # end def runImport
     
@@ -285,9 +451,12 @@ class Importer:
         moveimportedfiles = False #TODO need to wire this into GUI and make it prettier
         movefailedfiles = False #TODO and this too
         
+        if self.canImportParallel():
+            return self.importFilesParallel()
+
         #prepare progress popup window
         ProgressDialog = ProgressBar(len(self.filelist), self.parent)
-        
+
         for f in self.filelist:
             filecount = filecount + 1
             ProgressDialog.progress_update(f, str(self.database.getHandCount()))
@@ -316,6 +485,163 @@ class Importer:
         return (totstored, totdups, totpartial, totskipped, toterrors)
     # end def importFiles
 
+    def canImportParallel(self):
+        """True if the files are to be imported by importFilesParallel: threads > 1, a bulk
+           import of more than one hh file, and not into an sqlite :memory: database, as the
+           parser processes and writers would each connect to a new, empty one"""
+        if self.settings['threads'] <= 1 or self.mode == 'auto':
+            return False
+        if self.database.backend == self.database.SQLITE and self.database.database == ':memory:':
+            return False
+        return len([f for f in self.filelist.itervalues() if f.ftype in ("hh", "both")]) > 1
+
+    def importFilesParallel(self):
+        """Parse hh files in a pool of processes and store them from writer threads.
+
+           Each parser process runs the converter, prepInsert and assembleHand
+           for a whole file (see _parse_hh_file). Parsed files are passed to the
+           writer threads, each storing through one of self.writerdbs. At most
+           two parsed files per process are held in memory, parsing waits while
+           the writers catch up. Summary files are imported afterwards."""
+
+        counts = [0, 0, 0, 0, 0]  # stored, duplicates, partial, skipped, errors
+        processes = self.settings['threads']
+        writers = self.writerdbs[:processes]
+        if self.database.backend == self.database.SQLITE:
+            writers = writers[:1]  # sqlite can't take concurrent writes
+
+        ProgressDialog = ProgressBar(len(self.filelist), self.parent)
+
+        self.writelock = multiprocessing.Lock()
+        slots = threading.BoundedSemaphore(2 * processes)
+        writeq, doneq = Queue.Queue(), Queue.Queue()
+        # fork the parsers first, a lock held by a writer thread (e.g. logging's) would stay locked in them
+        pool = multiprocessing.Pool(processes, _init_parser,
+                                    (self.config.file, self.config.db_selected, self.config.dir_database,
+                                     self.writelock, self.settings['testData']))
+        threads = []
+        for db in writers:
+            t = threading.Thread(target=self._write_parsed_files, args=(db, writeq, doneq, slots))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        inflight, outstanding, others = {}, 0, []
+        for f, fpdbfile in self.filelist.iteritems():
+            if fpdbfile.ftype not in ("hh", "both"):
+                others.append(f)
+                continue
+            while not slots.acquire(False):
+                outstanding -= self._poll_parsed_files(inflight, writeq, doneq, slots, counts, ProgressDialog)
+                sleep(0.05)
+            job = (f, fpdbfile.site.hhc_fname, fpdbfile.site.filter_name, fpdbfile.site.name, fpdbfile.archive)
+            inflight[f] = pool.apply_async(_parse_hh_file, (job,))
+            outstanding += 1
+        pool.close()
+        while outstanding > 0:
+            outstanding -= self._poll_parsed_files(inflight, writeq, doneq, slots, counts, ProgressDialog)
+            sleep(0.05)
+        pool.join()
+        for t in threads:
+            writeq.put(None)
+        for t in threads:
+            t.join()
+        self.writelock = threading.Lock()
+
+        # week/month changes made by the writers' session updates and the hands they journaled are cleaned up in runPostImport
+        for db in writers:
+            self.database.wmold |= db.wmold
+            self.database.wmnew |= db.wmnew
+            self.database.mergeJournal(db.cachejournal)
+            db.resetClean()
+
+        for f in self.filelist:
+            fpdbfile = self.filelist[f]
+            if fpdbfile.ftype == "both":
+                self._import_summary_file(fpdbfile)
+            elif f in others:
+                ProgressDialog.progress_update(f, str(self.database.getHandCount()))
+                (stored, duplicates, partial, skipped, errors, ttime) = self._import_despatch(fpdbfile)
+                for i, n in enumerate((stored, duplicates, partial, skipped, errors)):
+                    counts[i] += n
+                self.logImport('bulk', f, stored, duplicates, partial, skipped, errors, ttime, fpdbfile.fileId)
+
+        del ProgressDialog
+
+        return tuple(counts)
+    # end def importFilesParallel
+
+    def _poll_parsed_files(self, inflight, writeq, doneq, slots, counts, ProgressDialog):
+        """Hand finished parser jobs to the writers and log the files the writers
+           have stored. Returns the number of files completed."""
+        completed = 0
+        for f, res in inflight.items():
+            if res.ready():
+                del inflight[f]
+                try:
+                    writeq.put(res.get())
+                except Exception, e:
+                    # the parser process itself failed, e.g. the result could not be pickled
+                    log.error(_("Importer._import_hh_file: '%r' Fatal error: '%r'") % (f, str(e)))
+                    counts[4] += 1
+                    slots.release()
+                    completed += 1
+        while True:
+            try:
+                done = doneq.get_nowait()
+            except Queue.Empty:
+                break
+            f = done['path']
+            fpdbfile = self.filelist[f]
+            for i, key in enumerate(('stored', 'duplicates', 'partial', 'skipped', 'errors')):
+                counts[i] += done[key]
+            self.database.ttold |= done['ttold']
+            self.database.ttnew |= done['ttnew']
+            if done['stored'] > 0 and done['tour'] and done['summaryInFile']:
+                fpdbfile.ftype = "both"
+            ProgressDialog.progress_update(f, str(self.database.getHandCount()))
+            self.logImport('bulk', f, done['stored'], done['duplicates'], done['partial'], done['skipped'], done['errors'], done['ttime'], fpdbfile.fileId)
+            completed += 1
+        return completed
+
+    def _write_parsed_files(self, db, writeq, doneq, slots):
+        """Writer thread: store the files parsed by _parse_hh_file until None is received"""
+        if db.backend == db.SQLITE:
+            db.do_connect(self.config)  # sqlite connections can't change threads
+        while True:
+            result = writeq.get()
+            if result is None:
+                break
+            stime = time()
+            fpdbfile = self.filelist[result['path']]
+            DerivedStats.equity_cache.merge(result['equities'])
+            (duplicates, ihands) = (0, [])
+            (partial, skipped, errors) = (result['partial'], result['skipped'], result['errors'])
+            if result['error']:
+                log.error(_("Importer._import_hh_file: '%r' Fatal error: '%r'") % (result['path'], result['error']))
+                (stored, errors) = (0, errors + 1)
+            else:
+                try:
+                    self.timer.add(fpdbfile, result['timings'])
+                    if result['hands']:
+                        for hand in result['hands']:
+                            hand.config = self.config
+                        db.ttold |= result['ttold']
+                        db.ttnew |= result['ttnew']
+                        db.mergeJournal(result['journal'])
+                        db.resetBulkCache()
+                        (duplicates, ihands) = self._store_hh_hands(db, result['hands'], fpdbfile)
+                    stored = result['numHands'] - errors - partial - skipped - duplicates
+                except:
+                    log.error(_("Importer._import_hh_file: '%r' Fatal error: '%r'") % (result['path'], traceback.format_exc()))
+                    db.rollback()
+                    (stored, errors) = (0, errors + 1)
+            doneq.put({'path': result['path'], 'stored': stored, 'duplicates': duplicates,
+                       'partial': partial, 'skipped': skipped, 'errors': errors, 'ttime': time() - stime,
+                       'tour': bool(ihands) and ihands[0].gametype['type']=='tour',
+                       'summaryInFile': result['summaryInFile'],
+                       'ttold': result['ttold'], 'ttnew': result['ttnew']})
+            slots.release()
+
     def _import_despatch(self, fpdbfile):
         stored, duplicates, partial, skipped, errors, ttime = 0,0,0,0,0,0
         if fpdbfile.ftype in ("hh", "both"):
@@ -367,10 +693,25 @@ class Importer:
     #Run import on updated files, then store latest update time. Called from GuiAutoImport.py
     def runUpdated(self):
         """Check for new files in monitored directories"""
-        for (site,type) in self.dirlist:
-            self.addImportDirectory(self.dirlist[(site,type)][0], False, (site,type), self.dirlist[(site,type)][1])
+        if self.handfilter: self.handfilter.sync(self.database) # saved by the next bulk import
+        if self.watcher is None:
+            for (site,type) in self.dirlist:
+                self.addImportDirectory(self.dirlist[(site,type)][0], False, (site,type), self.dirlist[(site,type)][1])
+            updated = self.filelist.keys()
+        else:
+            # files added since the last run, then the ones the watcher saw change
+            updated = set([f for f in self.filelist if f not in self.updatedsize])
+            for f in self.watcher.changes():
+                if f not in self.filelist and os.path.isfile(f):
+                    self.addImportFile(f, "auto")
+                if f in self.filelist:
+                    if f not in self.updatedsize: # new file, import it all now
+                        self.updatedsize[f] = 0
+                        self.updatedtime[f] = 0
+                    updated.add(f)
+        if self.idsite: self.idsite.save()
 
-        for f in self.filelist:
+        for f in updated:
             if os.path.exists(f):
                 stat_info = os.stat(f)
                 if f in self.updatedsize: # we should be able to assume that if we're in size, we're in time as well
@@ -422,17 +763,24 @@ class Importer:
         obj = getattr(mod, filter_name, None)
         if callable(obj):
             
-            if fpdbfile.path in self.pos_in_file:  idx = self.pos_in_file[fpdbfile.path]
-            else: self.pos_in_file[fpdbfile.path], idx = 0, 0
+            (idx, kodec, inode) = self.pos_in_file.get(fpdbfile.path, (0, None, None))
+            if inode is not None and self._inode(fpdbfile.path) != inode:
+                log.info(_("File '%s' was replaced, reading it from the start") % fpdbfile.path)
+                (idx, kodec) = (0, None)
                 
             hhc = obj( self.config, in_path = fpdbfile.path, index = idx, autostart=False
                       ,starsArchive = fpdbfile.archive
                       ,ftpArchive   = fpdbfile.archive
                       ,sitename     = fpdbfile.site.name)
             hhc.setAutoPop(self.mode=='auto')
+            if idx > 0: hhc.setKodec(kodec)
+            # the hands are stored while the file is read, handBatch at a time, so that
+            # a large archive is imported without holding all of its hands
+            batches = {'count': 0, 'stored': 0, 'duplicates': 0, 'tour': False}
+            hhc.setHandBatch(self.settings['handBatch'], lambda hands: self._store_hh_batch(fpdbfile, hands, batches))
             hhc.start()
+            self.timer.add(fpdbfile, hhc.timings)
             
-            self.pos_in_file[file] = hhc.getLastCharacterRead()
             #Tally the results
             partial  = getattr(hhc, 'numPartial')
             skipped  = getattr(hhc, 'numSkipped')
@@ -443,95 +791,9 @@ class Importer:
             stored -= skipped
             
             if stored > 0:
-                if self.caller: self.progressNotify()
-                handlist = hhc.getProcessedHands()
-                self.database.resetBulkCache(True)
-                self.pos_in_file[fpdbfile.path] = hhc.getLastCharacterRead()
-                (phands, ahands, ihands, to_hud) = ([], [], [], [])
-                self.database.resetBulkCache()
-                
-                ####Lock Placeholder####
-                for hand in handlist:
-                    hand.prepInsert(self.database, printtest = self.settings['testData'])
-                    ahands.append(hand)
-                self.database.commit()
-                ####Lock Placeholder####
-                
-                for hand in ahands:
-                    hand.assembleHand()
-                    phands.append(hand)
-                
-                ####Lock Placeholder####
-                backtrack = False
-                id = self.database.nextHandId()
-                sctimer, ihtimer, cctimer, pctimer, hctimer = 0,0,0,0,0
-                for i in range(len(phands)):
-                    doinsert = len(phands)==i+1
-                    hand = phands[i]
-                    try:
-                        id = hand.getHandId(self.database, id)
-                        stime = time()
-                        hand.updateSessionsCache(self.database, None, doinsert)
-                        sctimer += time() - stime
-                        stime = time()
-                        hand.insertHands(self.database, fpdbfile.fileId, doinsert, self.settings['testData'])
-                        ihtimer = time() - stime
-                        stime = time()
-                        hand.updateCardsCache(self.database, None, doinsert)
-                        cctimer = time() - stime
-                        stime = time()
-                        hand.updatePositionsCache(self.database, None, doinsert) 
-                        pctimer = time() - stime
-                        stime = time()
-                        hand.updateHudCache(self.database, doinsert)
-                        hctimer = time() - stime
-                        ihands.append(hand)
-                        to_hud.append(hand.dbid_hands)
-                    except FpdbHandDuplicate:
-                        duplicates += 1
-                        if (doinsert and ihands): backtrack = True
-                    except:
-                        error_trace = ''
-                        formatted_lines = traceback.format_exc().splitlines()
-                        for line in formatted_lines:
-                            error_trace += line
-                        tmp = hand.handText[0:200]
-                        log.error(_("Importer._import_hh_file: '%r' Fatal error: '%r'") % (file, error_trace))
-                        log.error(_("'%r'") % tmp)
-                        if (doinsert and ihands): backtrack = True
-                    if backtrack: #If last hand in the file is a duplicate this will backtrack and insert the new hand records
-                        hand = ihands[-1]
-                        hp, hero = hand.handsplayers, hand.hero
-                        hand.hero, self.database.hbulk, hand.handsplayers  = 0, self.database.hbulk[:-1], [] #making sure we don't insert data from this hand
-                        
-                        hand.updateSessionsCache(self.database, None, doinsert)
-                        hand.insertHands(self.database, fpdbfile.fileId, doinsert, self.settings['testData'])
-                        hand.updateCardsCache(self.database, None, doinsert)
-                        hand.updatePositionsCache(self.database, None, doinsert)
-                        hand.updateHudCache(self.database, doinsert)
-                        hand.handsplayers, hand.hero = hp, hero
-                #log.debug("DEBUG: hand.updateSessionsCache: %s" % (t5tot))
-                #log.debug("DEBUG: hand.insertHands: %s" % (t6tot))
-                #log.debug("DEBUG: hand.updateHudCache: %s" % (t7tot))
-                self.database.commit()
-                ####Lock Placeholder####
-                
-                for i in range(len(ihands)):
-                    doinsert = len(ihands)==i+1
-                    hand = ihands[i]
-                    hand.insertHandsPlayers(self.database, doinsert, self.settings['testData'])
-                    hand.insertHandsActions(self.database, doinsert, self.settings['testData'])
-                    hand.insertHandsStove(self.database, doinsert)
-                self.database.commit()
+                self.pos_in_file[fpdbfile.path] = (hhc.getLastByteRead(), hhc.getKodec(), self._inode(fpdbfile.path))
+                duplicates = batches['duplicates']
 
-                #pipe the Hands.id out to the HUD
-                if self.callHud:
-                    for hid in to_hud:
-                        try:
-                            print _("fpdb_import: sending hand to hud"), hid, "pipe =", self.caller.pipe_to_hud
-                            self.caller.pipe_to_hud.stdin.write("%s" % (hid) + os.linesep)
-                        except IOError, e:
-                            log.error(_("Failed to send hand to HUD: %s") % e)
                 # Really ugly hack to allow testing Hands within the HHC from someone
                 # with only an Importer objec
                 if self.settings['cacheHHC']:
@@ -541,13 +803,152 @@ class Importer:
         
         stored -= duplicates
         
-        if stored>0 and ihands[0].gametype['type']=='tour':
+        if stored>0 and batches['tour']:
             if hhc.summaryInFile:
                 fpdbfile.ftype = "both"
 
         ttime = time() - ttime
         return (stored, duplicates, partial, skipped, errors, ttime)
     
+    def _store_hh_batch(self, fpdbfile, handlist, batches):
+        """Store a batch of the hands parsed from fpdbfile, called back by the converter.
+           batches totals the batches of the file: their count, the hands stored and the
+           duplicates found, and whether the first hand stored was a tourney hand"""
+        if self.caller: self.progressNotify()
+        self.database.resetBulkCache(batches['count'] == 0)
+        batches['count'] += 1
+        (phands, ahands) = ([], [])
+        
+        ####Lock Placeholder####
+        stime = time()
+        self.database.resetTourneyCache()
+        self.database.prepSqlPlayerIDs(handlist)
+        for hand in handlist:
+            hand.prepInsert(self.database, printtest = self.settings['testData'])
+            ahands.append(hand)
+        self.database.flushTourneyCache()
+        self.database.commit()
+        ptime = time()
+        ####Lock Placeholder####
+        
+        for hand in ahands:
+            hand.assembleHand()
+            phands.append(hand)
+        self.timer.add(fpdbfile, {'prepInsert': ptime - stime, 'assembleHand': time() - ptime})
+        
+        (duplicates, ihands) = self._store_hh_hands(self.database, phands, fpdbfile)
+        batches['duplicates'] += duplicates
+        if ihands and not batches['stored']:
+            batches['tour'] = ihands[0].gametype['type'] == 'tour'
+        batches['stored'] += len(ihands)
+    
+    def _inode(self, path):
+        """Identity of the file at path, to tell a rotated file from one that grew"""
+        try:
+            return os.stat(path).st_ino or None
+        except OSError:
+            return None
+
+    def _store_hh_hands(self, db, phands, fpdbfile):
+        """Store assembled hands through db. Returns (duplicates, stored hands).
+           Hand ids, sessions and caches are written holding self.writelock so that
+           several writers can share the id sequence (see importFilesParallel)."""
+        (duplicates, ihands, to_hud) = (0, [], [])
+        self.writelock.acquire()
+        locked = True
+        try:
+            backtrack = False
+            if phands:
+                db.checkDuplicates([(h.siteId, h.hands['siteHandNo'], h.hands['heroSeat']) for h in phands],
+                                   phands[0].publicDB)
+            id = db.nextHandId()
+            timings = dict.fromkeys(ImportTimer.STAGES, 0.0)
+            for i in range(len(phands)):
+                doinsert = len(phands)==i+1
+                hand = phands[i]
+                try:
+                    id = hand.getHandId(db, id)
+                    stime = time()
+                    hand.updateSessionsCache(db, None, doinsert)
+                    timings['updateSessionsCache'] += time() - stime
+                    stime = time()
+                    hand.insertHands(db, fpdbfile.fileId, doinsert, self.settings['testData'])
+                    timings['insertHands'] += time() - stime
+                    stime = time()
+                    hand.updateCardsCache(db, None, doinsert)
+                    timings['updateCardsCache'] += time() - stime
+                    stime = time()
+                    hand.updatePositionsCache(db, None, doinsert) 
+                    timings['updatePositionsCache'] += time() - stime
+                    stime = time()
+                    hand.updateHudCache(db, doinsert)
+                    timings['updateHudCache'] += time() - stime
+                    ihands.append(hand)
+                    if self.callHud:
+                        to_hud.append((hand.dbid_hands, hand.getHudDeltas(db)))
+                except FpdbHandDuplicate:
+                    duplicates += 1
+                    if (doinsert and ihands): backtrack = True
+                except:
+                    error_trace = ''
+                    formatted_lines = traceback.format_exc().splitlines()
+                    for line in formatted_lines:
+                        error_trace += line
+                    tmp = hand.handText[0:200]
+                    log.error(_("Importer._import_hh_file: '%r' Fatal error: '%r'") % (fpdbfile.path, error_trace))
+                    log.error(_("'%r'") % tmp)
+                    if (doinsert and ihands): backtrack = True
+                if backtrack: #If last hand in the file is a duplicate this will backtrack and insert the new hand records
+                    hand = ihands[-1]
+                    hp, hero = hand.handsplayers, hand.hero
+                    hand.hero, db.hbulk, hand.handsplayers  = 0, db.hbulk[:-1], [] #making sure we don't insert data from this hand
+                
+                    hand.updateSessionsCache(db, None, doinsert)
+                    hand.insertHands(db, fpdbfile.fileId, doinsert, self.settings['testData'])
+                    hand.updateCardsCache(db, None, doinsert)
+                    hand.updatePositionsCache(db, None, doinsert)
+                    hand.updateHudCache(db, doinsert)
+                    hand.handsplayers, hand.hero = hp, hero
+            stime = time()
+            db.commit()
+            timings['commit'] += time() - stime
+            if db.backend != db.SQLITE:
+                self.writelock.release()
+                locked = False
+        
+            for i in range(len(ihands)):
+                doinsert = len(ihands)==i+1
+                hand = ihands[i]
+                stime = time()
+                hand.insertHandsPlayers(db, doinsert, self.settings['testData'])
+                timings['insertHandsPlayers'] += time() - stime
+                stime = time()
+                hand.insertHandsActions(db, doinsert, self.settings['testData'])
+                timings['insertHandsActions'] += time() - stime
+                stime = time()
+                hand.insertHandsStove(db, doinsert)
+                timings['insertHandsStove'] += time() - stime
+            stime = time()
+            db.commit()
+            timings['commit'] += time() - stime
+        finally:
+            if locked:
+                self.writelock.release()
+        self.timer.add(fpdbfile, timings)
+
+        #pipe the Hands.id out to the HUD, followed by the hand's HudCache lines
+        if self.callHud:
+            for hid, deltas in to_hud:
+                try:
+                    print _("fpdb_import: sending hand to hud"), hid, "pipe =", self.caller.pipe_to_hud
+                    if deltas:
+                        self.caller.pipe_to_hud.stdin.write("%s %s" % (hid, json.dumps(deltas)) + os.linesep)
+                    else:
+                        self.caller.pipe_to_hud.stdin.write("%s" % (hid) + os.linesep)
+                except IOError, e:
+                    log.error(_("Failed to send hand to HUD: %s") % e)
+        return (duplicates, ihands)
+
     def autoSummaryGrab(self, force = False):
         for f, fpdbfile in self.filelist.items():
             stat_info = os.stat(f)
@@ -556,7 +957,10 @@ class Importer:
                 fpdbfile.ftype = "hh"
 
     def _import_summary_file(self, fpdbfile):
-        (stored, duplicates, partial, skipped, errors, ttime) = (0, 0, 0, 0, 0, time())
+        """Parse all the summaries of fpdbfile, then store them summaryBatch at a time: the
+           rows of a batch are looked up together and committed in one transaction.
+           Summaries that added to tourneys already in the db are counted as stored."""
+        (stored, duplicates, updated, partial, skipped, errors, ttime) = (0, 0, 0, 0, 0, 0, time())
         mod = __import__(fpdbfile.site.summary)
         obj = getattr(mod, fpdbfile.site.summary, None)
         if callable(obj):
@@ -565,24 +969,38 @@ class Importer:
             if summaryTexts is None:
                 log.error("Found: '%s' with 0 characters... skipping" % fpdbfile.path)
                 return (0, 0, 0, 0, 1, time()) # File had 0 characters
-            ####Lock Placeholder####
-            for j, summaryText in enumerate(summaryTexts, start=1):
-                doinsert = len(summaryTexts)==j
+            summaries = []
+            for summaryText in summaryTexts:
                 try:
-                    conv = obj(db=self.database, config=self.config, siteName=fpdbfile.site.name, summaryText=summaryText, in_path = fpdbfile.path, header=summaryTexts[0])
-                    self.database.resetBulkCache(False)
-                    conv.insertOrUpdate(printtest = self.settings['testData'])
+                    summaries.append(obj(db=self.database, config=self.config, siteName=fpdbfile.site.name, summaryText=summaryText, in_path = fpdbfile.path, header=summaryTexts[0]))
                 except FpdbHandPartial, e:
                     partial += 1
                 except FpdbParseError, e:
                     log.error(_("Summary import parse error in file: %s") % fpdbfile.path)
                     errors += 1
-                if j != 1:
-                    print _("Finished importing %s/%s tournament summaries") %(j, len(summaryTexts))
-                imported = j
             ####Lock Placeholder####
+            batch = max(1, self.settings['summaryBatch'])
+            for i in xrange(0, len(summaries), batch):
+                self.database.resetBulkCache(False)
+                self.database.resetTourneyCache()
+                self.database.prepTourneySummaries(summaries[i:i+batch])
+                for summary in summaries[i:i+batch]:
+                    try:
+                        (s, d, u, e, t) = summary.insertOrUpdate(printtest = self.settings['testData'], commit = False)
+                    except FpdbParseError, e:
+                        log.error(_("Summary import parse error in file: %s") % fpdbfile.path)
+                        errors += 1
+                        continue
+                    stored, duplicates, updated = stored + s, duplicates + d, updated + u
+                self.database.commit()
+                if len(summaryTexts) > 1:
+                    print _("Finished importing %s/%s tournament summaries") % (min(i + batch, len(summaries)) + partial + errors, len(summaryTexts))
+            self.database.resetTourneyCache()
+            ####Lock Placeholder####
+            if updated:
+                log.info(_("%s tournament summaries added to tourneys already in the database") % updated)
         ttime = time() - ttime
-        return (imported - errors - partial, duplicates, partial, skipped, errors, ttime)
+        return (stored + updated, duplicates, partial, skipped, errors, ttime)
 
     def progressNotify(self):
         "A callback to the interface while events are pending"
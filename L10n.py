@@ -68,7 +68,7 @@ def init_translation():
     # translations cannot be changed on-the-fly by this function
     #
     import Configuration
-    conf=Configuration.Config()
+    conf=Configuration.get_shared_config()
     
     if conf.general['ui_language'] in ("system", ""):
         import locale
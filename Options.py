@@ -66,6 +66,14 @@ def fpdb_options():
                     help=_("File to be split is a PokerStars or Full Tilt Poker archive file"))
     parser.add_option("-t", "--testdata", action="store_true", dest="testData", default=False,
                     help=_("Developer option to print regression test data"))
+    parser.add_option("-j", "--threads", dest="threads", default=1, type="int",
+                    help=_("Number of processes used for bulk import. Default is 1"))
+    parser.add_option("--timings", action="store_true", dest="timings", default=False,
+                    help=_("Print the time spent in each import stage, per site"))
+    parser.add_option("--profile", dest="profile", metavar="FILE", default=None,
+                    help=_("Write cProfile statistics of the import to FILE (parser processes are not profiled)"))
+    parser.add_option("--benchmark", dest="benchmark", metavar="FILE", default=None,
+                    help=_("Write the parse throughput and import stage timings of a regression test run to FILE, as JSON"))
     parser.add_option("-n", "--numhands", dest="hands", default="100", type="int",
                     help=_("How many hands do you want saved to each file. Default is 100"))
     parser.add_option("--xloc", dest="xloc", default=None, type="int",
@@ -78,6 +86,8 @@ def fpdb_options():
                       help=_("Start Minimized"))
     parser.add_option("--hidden", action="store_true", dest="hidden",
                       help=_("Start Hidden"))
+    parser.add_option("--profile-startup", action="store_true", dest="profile_startup", default=False,
+                      help=_("Print how long importing each module took when starting up"))
 
 
     (options, argv) = parser.parse_args()
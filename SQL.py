@@ -5653,6 +5653,16 @@ class Sql:
         self.query['addPlayerHeroesIndex'] = """CREATE INDEX player_heroes ON Players (hero)"""
         
         self.query['get_last_hand'] = "select max(id) from Hands"
+
+        self.query['get_hud_gametypes'] = """
+                SELECT gt1.id from Gametypes gt1, Gametypes gt2
+                WHERE  gt1.siteid = gt2.siteid
+                AND    gt1.type = gt2.type
+                AND    gt1.category = gt2.category
+                AND    gt1.limittype = gt2.limittype
+                AND    gt1.bigblind <= gt2.bigblind * %s
+                AND    gt1.bigblind >= gt2.bigblind / %s
+                AND    gt2.id = %s"""
         
         self.query['get_last_date'] = "SELECT MAX(startTime) FROM Hands"
         
@@ -5673,6 +5683,26 @@ class Sql:
                 and   (p.siteId = %s or %s = -1)
             """
 
+        self.query['get_starthands_file'] = """
+                SELECT h.fileId, g.type, g.limitType
+                    FROM Hands h, Gametypes g
+                    WHERE g.id = h.gametypeId
+                    AND   h.id = %s"""
+
+        self.query['get_starthands'] = """
+                SELECT hp.handId, hp.startCards, hp.street0Aggr, hp.street0CalledRaiseDone, hp.position
+                    FROM Hands h, HandsPlayers hp, Gametypes g
+                    WHERE hp.handId = h.id
+                    AND   g.id = h.gametypeId
+                    AND   h.fileId = %s
+                    AND   g.type = %s
+                    AND   g.limitType = %s
+                    AND   g.category = 'holdem'
+                    AND   hp.playerId = %s
+                    AND   hp.street0VPI
+                    AND   hp.startCards > 0 AND hp.startCards <> 170
+                    AND   h.id > %s"""
+
         self.query['get_gameinfo_from_hid'] = """
                 SELECT
                         s.name,
@@ -9271,30 +9301,60 @@ class Sql:
         self.query['clearCardsCache'] = """DELETE FROM CardsCache"""
         self.query['clearPositionsCache'] = """DELETE FROM PositionsCache"""
         
-        self.query['clearHudCacheTourneyType'] = """DELETE FROM HudCache WHERE tourneyTypeId = %s"""
-        self.query['clearCardsCacheTourneyType'] = """DELETE FROM CardsCache WHERE tourneyTypeId = %s"""
-        self.query['clearPositionsCacheTourneyType'] = """DELETE FROM PositionsCache WHERE tourneyTypeId = %s"""  
+        self.query['clearHudCacheEmpty'] = """DELETE FROM HudCache WHERE n <= 0"""
+        self.query['clearCardsCacheEmpty'] = """DELETE FROM CardsCache WHERE n <= 0"""
+        self.query['clearPositionsCacheEmpty'] = """DELETE FROM PositionsCache WHERE n <= 0"""
         
-        self.query['fetchNewHudCacheTourneyTypeIds'] = """SELECT TT.id
-                                                    FROM TourneyTypes TT
-                                                    LEFT OUTER JOIN HudCache HC ON (TT.id = HC.tourneyTypeId)
-                                                    WHERE HC.tourneyTypeId is NULL
-                """
-                
-        self.query['fetchNewCardsCacheTourneyTypeIds'] = """SELECT TT.id
-                                                    FROM TourneyTypes TT
-                                                    LEFT OUTER JOIN CardsCache CC ON (TT.id = CC.tourneyTypeId)
-                                                    WHERE CC.tourneyTypeId is NULL
-                """
-                
-        self.query['fetchNewPositionsCacheTourneyTypeIds'] = """SELECT TT.id
-                                                    FROM TourneyTypes TT
-                                                    LEFT OUTER JOIN PositionsCache PC ON (TT.id = PC.tourneyTypeId)
-                                                    WHERE PC.tourneyTypeId is NULL
-                """
+        # CacheJournal: the hands whose cache lines were stored with another tourneyTypeId,
+        # weekId or monthId than they have now (NULL where unchanged), see Database.repairCaches
+        self.query['selectHandsByTourneyNo'] = """SELECT h.id FROM Hands h
+                                            INNER JOIN Tourneys t ON (t.id = h.tourneyId)
+                                            INNER JOIN TourneyTypes tt ON (tt.id = t.tourneyTypeId)
+                                            WHERE tt.siteId = %s AND t.siteTourneyNo = %s"""
+        
+        self.query['selectHandsBySessionIds'] = """SELECT id, sessionId FROM Hands WHERE sessionId IN (<sessionIds>)"""
+        
+        self.query['create_cache_journal'] = """CREATE TEMPORARY TABLE CacheJournal
+                                            (handId BIGINT, tourneyTypeId INT, weekId INT, monthId INT)"""
+        
+        self.query['insert_cache_journal'] = """INSERT INTO CacheJournal (handId, tourneyTypeId, weekId, monthId)
+                                            VALUES (%s, %s, %s, %s)"""
+        
+        if db_server == 'mysql':
+            self.query['drop_cache_journal'] = """DROP TEMPORARY TABLE IF EXISTS CacheJournal"""
+        else:
+            self.query['drop_cache_journal'] = """DROP TABLE IF EXISTS CacheJournal"""
+        
+        # <tablename>Rebuild: a cache table rebuilt a gametype at a time, copied over the cache
+        # when complete. <tablename>RebuildState: where the rebuild started, see Database.rebuild_cache
+        self.query['create_cache_rebuild'] = """CREATE TABLE <tablename>Rebuild AS
+                                            SELECT <columns> FROM <tablename> WHERE 1 = 0"""
+        
+        self.query['create_cache_rebuild_state'] = """CREATE TABLE <tablename>RebuildState
+                                            (lastHandId BIGINT, heroStart VARCHAR(32), villainStart VARCHAR(32))"""
+        
+        self.query['insert_cache_rebuild_state'] = """INSERT INTO <tablename>RebuildState (lastHandId, heroStart, villainStart)
+                                            VALUES (%s, %s, %s)"""
+        
+        self.query['select_cache_rebuild_state'] = """SELECT lastHandId, heroStart, villainStart FROM <tablename>RebuildState"""
         
-        self.query['clearCardsCacheWeeksMonths'] = """DELETE FROM CardsCache WHERE weekId = %s AND monthId = %s"""
-        self.query['clearPositionsCacheWeeksMonths'] = """DELETE FROM PositionsCache WHERE weekId = %s AND monthId = %s"""  
+        self.query['select_cache_rebuild_done'] = """SELECT DISTINCT gametypeId FROM <tablename>Rebuild"""
+        
+        self.query['copy_cache_rebuild'] = """INSERT INTO <tablename> (<columns>)
+                                            SELECT <columns> FROM <tablename>Rebuild"""
+        
+        self.query['drop_cache_rebuild'] = """DROP TABLE <tablename>Rebuild"""
+        self.query['drop_cache_rebuild_state'] = """DROP TABLE <tablename>RebuildState"""
+        
+        # keeps the cache from being written until the rebuild is copied over it and committed
+        if db_server == 'mysql':
+            self.query['lock_cache_rebuild'] = """SET TRANSACTION ISOLATION LEVEL SERIALIZABLE"""
+        elif db_server == 'postgresql':
+            self.query['lock_cache_rebuild'] = """LOCK TABLE <tablename> IN EXCLUSIVE MODE"""
+        elif db_server == 'sqlite':
+            self.query['lock_cache_rebuild'] = """BEGIN IMMEDIATE"""
+        
+        self.query['getGametypeTypes'] = """SELECT id, type FROM Gametypes ORDER BY id"""
         
         self.query['selectSessionWithWeekId'] = """SELECT id FROM Sessions WHERE weekId = %s"""
         self.query['selectSessionWithMonthId'] = """SELECT id FROM Sessions WHERE monthId = %s"""
@@ -9302,20 +9362,6 @@ class Sql:
         self.query['deleteWeekId'] = """DELETE FROM Weeks WHERE id = %s"""
         self.query['deleteMonthId'] = """DELETE FROM Months WHERE id = %s"""
         
-        self.query['fetchNewCardsCacheWeeksMonths'] = """SELECT SCG.weekId, SCG.monthId
-                                            FROM (SELECT DISTINCT weekId, monthId FROM Sessions) SCG
-                                            LEFT OUTER JOIN CardsCache CC ON (SCG.weekId = CC.weekId AND SCG.monthId = CC.monthId)
-                                            WHERE CC.weekId is NULL OR CC.monthId is NULL
-        """
-        
-        self.query['fetchNewPositionsCacheWeeksMonths'] = """SELECT SCG.weekId, SCG.monthId
-                                            FROM (SELECT DISTINCT weekId, monthId FROM Sessions) SCG
-                                            LEFT OUTER JOIN PositionsCache PC ON (SCG.weekId = PC.weekId AND SCG.monthId = PC.monthId)
-                                            WHERE PC.weekId is NULL OR PC.monthId is NULL
-        """
-        
-            
-
         if db_server == 'mysql':
             self.query['rebuildCache'] = """insert into <insert>
                 ,n
@@ -11196,10 +11242,10 @@ class Sql:
                 street0Aggr,
                 street0CalledRaiseChance,
                 street0CalledRaiseDone,
-                street0_3BChance,
-                street0_3BDone,
                 street0_2BChance,
                 street0_2BDone,
+                street0_3BChance,
+                street0_3BDone,
                 street0_4BChance,
                 street0_4BDone,
                 street0_C4BChance,
@@ -11448,10 +11494,7 @@ class Sql:
                     %s, %s, %s, %s, %s,
                     %s, %s, %s, %s, %s,
                     %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s)"""
+                    %s)"""
 
         self.query['update_cardscache'] = """
             UPDATE CardsCache SET
@@ -11967,10 +12010,7 @@ class Sql:
                     %s, %s, %s, %s, %s,
                     %s, %s, %s, %s, %s,
                     %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s)"""
+                    %s, %s, %s)"""
 
         self.query['update_positionscache'] = """
             UPDATE PositionsCache SET
@@ -12217,6 +12257,38 @@ class Sql:
                     AND   maxPosition=%s
                     AND   position=%s"""
             
+        ####################################
+        # Queries to bulk update hudcache/cardscache/positionscache from a temporary table
+        # No ON CONFLICT/ON DUPLICATE KEY: tourneyTypeId is NULL for ring games and
+        # NULLs never collide in the unique indexes, so existing rows are updated by joining on the keys
+        ####################################
+        
+        if db_server in ('mysql', 'postgresql'):
+            self.query['create_cache_bulk'] = """CREATE TEMPORARY TABLE <bulktable> AS
+                    SELECT <columns> FROM <tablename> WHERE 1=0"""
+            
+            self.query['insert_cache_bulk'] = """INSERT INTO <tablename> (<columns>)
+                    SELECT <columns> FROM <bulktable> b
+                    WHERE NOT EXISTS (SELECT 1 FROM <tablename> c WHERE <join_clause>)"""
+            
+            self.query['cache_bulk_equal'] = "c.<column>=b.<column>"
+            
+        if db_server == 'mysql':
+            self.query['update_cache_bulk'] = """UPDATE <tablename> c
+                    INNER JOIN <bulktable> b ON (<join_clause>)
+                    SET <set_clause>"""
+            self.query['cache_bulk_set'] = "c.<column>=c.<column>+b.<column>"
+            self.query['cache_bulk_nullsafe'] = "c.<column><=>b.<column>"
+            self.query['drop_cache_bulk'] = "DROP TEMPORARY TABLE IF EXISTS <bulktable>"
+        elif db_server == 'postgresql':
+            self.query['update_cache_bulk'] = """UPDATE <tablename> AS c
+                    SET <set_clause>
+                    FROM <bulktable> b
+                    WHERE <join_clause>"""
+            self.query['cache_bulk_set'] = "<column>=c.<column>+b.<column>"
+            self.query['cache_bulk_nullsafe'] = "(c.<column>=b.<column> OR (c.<column> IS NULL AND b.<column> IS NULL))"
+            self.query['drop_cache_bulk'] = "DROP TABLE IF EXISTS <bulktable>"
+            
         ####################################
         # Queries to rebuild/modify sessionscache
         ####################################
@@ -13665,6 +13737,16 @@ class Sql:
                                          WHERE siteHandNo=%s AND G.siteId=%s<heroSeat>
         """
         
+        self.query['getHandKeysBySite'] = """SELECT H.siteHandNo, H.heroSeat FROM Hands H
+                                             INNER JOIN Gametypes G ON (H.gametypeId = G.id)
+                                             WHERE G.siteId=%s AND H.siteHandNo IN (<handNos>)
+        """
+        
+        self.query['getHandKeys'] = """SELECT H.siteHandNo, G.siteId, H.heroSeat FROM Hands H
+                                       INNER JOIN Gametypes G ON (H.gametypeId = G.id)
+                                       WHERE H.id > %s
+        """
+        
         self.query['getTourneyTypeIdByTourneyNo'] = """SELECT tt.id,
                                                               tt.siteId,
                                                               tt.currency,
@@ -13709,6 +13791,11 @@ class Sql:
                                                     INNER JOIN Tourneys t ON (t.tourneyTypeId = tt.id) 
                                                     WHERE t.siteTourneyNo=%s AND tt.siteId=%s
         """
+
+        # the same rows for many tourneys of a site, with the siteTourneyNo in front
+        self.query['getTourneyTypesByTourneyNos'] = self.query['getTourneyTypeIdByTourneyNo'].replace(
+                    'SELECT tt.id,', 'SELECT t.siteTourneyNo, tt.id,').replace(
+                    'WHERE t.siteTourneyNo=%s AND tt.siteId=%s', 'WHERE tt.siteId=%s AND t.siteTourneyNo IN (<tourNos>)')
         
         self.query['getTourneyTypeId'] = """SELECT  id
                                             FROM TourneyTypes
@@ -13797,6 +13884,12 @@ class Sql:
                                         WHERE tt.siteId=%s AND t.siteTourneyNo=%s
         """
 
+        self.query['getTourneysByTourneyNos'] = """SELECT t.*
+                                        FROM Tourneys t
+                                        INNER JOIN TourneyTypes tt ON (t.tourneyTypeId = tt.id)
+                                        WHERE tt.siteId=%s AND t.siteTourneyNo IN (<tourNos>)
+        """
+
         self.query['getTourneyInfo'] = """SELECT tt.*, t.*
                                         FROM Tourneys t
                                         INNER JOIN TourneyTypes tt ON (t.tourneyTypeId = tt.id)
@@ -13845,11 +13938,13 @@ class Sql:
         self.query['updateTourneyStart'] = """UPDATE Tourneys
                                              SET startTime = %s
                                         WHERE id=%s
+                                        AND (startTime IS NULL OR startTime > %s)
         """
         
         self.query['updateTourneyEnd'] = """UPDATE Tourneys
                                              SET endTime = %s
                                         WHERE id=%s
+                                        AND (endTime IS NULL OR endTime < %s)
         """
         
         self.query['getTourneysPlayersByIds'] = """SELECT *
@@ -13857,6 +13952,16 @@ class Sql:
                                                 WHERE tourneyId=%s AND playerId=%s AND entryId=%s
         """
         
+        self.query['getTourneysPlayersByTourneyIds'] = """SELECT *
+                                                       FROM TourneysPlayers
+                                                       WHERE tourneyId IN (<tourneyIds>)
+        """
+
+        self.query['getTourneysPlayersIdsByTourney'] = """SELECT id, playerId, entryId
+                                                       FROM TourneysPlayers
+                                                       WHERE tourneyId=%s
+        """
+
         self.query['getTourneysPlayersByTourney'] = """SELECT playerId, entryId
                                                        FROM TourneysPlayers
                                                        WHERE tourneyId=%s
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+"""StartupProfiler.py
+
+Times the modules imported while fpdb or the HUD start (--profile-startup).
+
+install() has to run before the imports that should be measured, so the
+mains check sys.argv for the option before anything else is imported and
+call report() once their window is up. Nothing else of fpdb is imported
+here, L10n and Configuration included, so they show up in the report too.
+"""
+
+import sys
+import time
+import __builtin__
+
+_import = None      # the __import__ replaced by install()
+_started = None
+_stack = []         # [time spent in nested imports] of each import in progress
+_times = {}         # module name --> (total, self) seconds of its first import
+
+def _timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    if name in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+    nested = [0.0]
+    _stack.append(nested)
+    start = time.time()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - start
+        _stack.pop()
+        if _stack:
+            _stack[-1][0] += elapsed
+        if name not in _times:
+            _times[name] = (elapsed, elapsed - nested[0])
+
+def install():
+    """Start timing imports."""
+    global _import, _started
+    if _import is None:
+        _import = __builtin__.__import__
+        _started = time.time()
+        __builtin__.__import__ = _timed_import
+
+def uninstall():
+    global _import
+    if _import is not None:
+        __builtin__.__import__ = _import
+        _import = None
+
+def installed():
+    return _import is not None
+
+def report(out = None, limit = 40):
+    """Stop timing and print the slowest imports, by the time spent in the module itself."""
+    if _started is None:
+        return
+    uninstall()
+    if out is None:
+        out = sys.stderr
+    imported = sum(s for (t, s) in _times.itervalues())
+    out.write("Startup took %.3fs, %.3fs of it importing %d modules\n"
+              % (time.time() - _started, imported, len(_times)))
+    out.write("%9s %9s  %s\n" % ("self", "total", "module"))
+    ranked = sorted(_times.iteritems(), key = lambda (n, (t, s)): s, reverse = True)
+    for name, (total, own) in ranked[:limit]:
+        out.write("%9.3f %9.3f  %s\n" % (own, total, name))
+    out.flush()
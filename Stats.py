@@ -96,6 +96,35 @@ def do_tip(widget, tip):
     widget.setToolTip(_tip)
 
 
+_compiled_stats = {}
+
+def compile_stat(stat):
+    """Resolve a stat name as used in the config, e.g. vpip or vpip_1, to its
+       (function, decimal places) once. The function is None for unknown stats
+       and places is None if the stat has no _N suffix."""
+    try:
+        return _compiled_stats[stat]
+    except KeyError:
+        pass
+    statname, places = stat, None
+    if re_Places.search(stat):   # override if necessary
+        statname, places = stat[0:-2], int(stat[-1:])
+    _compiled_stats[stat] = (STATFUNCS.get(statname), places)
+    return _compiled_stats[stat]
+
+def _do_stat(stat_dict, player, function, places):
+    result = function(stat_dict, player)
+
+    # If decimal places have been defined, override result[1]
+    # NOTE: decimal place override ALWAYS assumes the raw result is a
+    # fraction (x/100); manual decimal places really only make sense for
+    # percentage values. Also, profit/100 hands (bb/BB) already default
+    # to three decimal places anyhow, so they are unlikely override
+    # candidates.
+    if places is not None:
+        result = __stat_override(places, result)
+    return result
+
 def do_stat(stat_dict, player = 24, stat = 'vpip', hand_instance = None):
 
     #hand instance is not needed for many stat functions
@@ -103,28 +132,26 @@ def do_stat(stat_dict, player = 24, stat = 'vpip', hand_instance = None):
     #to avoid having to conditionally pass the extra value
     global _global_hand_instance
     _global_hand_instance = hand_instance
-    
-    statname = stat
-    match = re_Places.search(stat)
-    if match:   # override if necessary
-        statname = stat[0:-2]
 
-    if statname not in STATLIST:
+    (function, places) = compile_stat(stat)
+    if function is None:
         return None
+    return _do_stat(stat_dict, player, function, places)
 
-    result = eval("%(stat)s(stat_dict, %(player)d)" %
-        {'stat': statname, 'player': player})
+def compute_stats(stat_dict, players, stat_names, hand_instance = None):
+    """Compute a set of stats for several players in one go, e.g. for all
+       seats of a hud. Returns {player: {stat: result}}, unknown stats are
+       left out."""
+    global _global_hand_instance
+    _global_hand_instance = hand_instance
 
-    # If decimal places have been defined, override result[1]
-    # NOTE: decimal place override ALWAYS assumes the raw result is a
-    # fraction (x/100); manual decimal places really only make sense for
-    # percentage values. Also, profit/100 hands (bb/BB) already default
-    # to three decimal places anyhow, so they are unlikely override
-    # candidates.
-    if match:
-        places = int(stat[-1:])
-        result = __stat_override(places, result)
-    return result
+    compiled = [(stat,) + compile_stat(stat) for stat in set(stat_names)]
+    compiled = [c for c in compiled if c[1] is not None]
+    results = {}
+    for player in players:
+        results[player] = dict([(stat, _do_stat(stat_dict, player, function, places))
+                                for (stat, function, places) in compiled])
+    return results
 
 #    OK, for reference the tuple returned by the stat is:
 #    0 - The stat, raw, no formating, eg 0.33333333
@@ -1381,6 +1408,18 @@ def blank(stat_dict, player):
     stat = " "
     return ("", "", "", "", "", "<blank>")
                 
+def _starthands_string(hands, show_position = True):
+    """/-separated start hands, best first, with a line break after every 8 (the first after 3)"""
+    text, count = "", 5
+    for (startcards, position) in sorted(hands, reverse=True):
+        text += "/" + Card.decodeStartHandValue("holdem", startcards)
+        if show_position:
+            text += "." + position
+        count += 1
+        if count % 8 == 0:
+            text += "\n"
+    return text
+
 def starthands(stat_dict, player):
 
     hand_instance = _global_hand_instance
@@ -1412,71 +1451,18 @@ def starthands(stat_dict, player):
     PFaggr="Raised:"
     PFcar="Called raise:"
     PFdefendBB="Defend BB:"
-    count_pfl = count_pfa = count_pfc = count_pfd = 5
-    
-    c = Configuration.Config()
-    db_connection = Database.Database(c)
-    sc = db_connection.get_cursor()
-
-    query = ("SELECT distinct startCards, street0Aggr, street0CalledRaiseDone, " +
-    			"case when HandsPlayers.position = 'B' then 'b' " +
-                            "when HandsPlayers.position = 'S' then 'b' " +
-                            "when HandsPlayers.position = '0' then 'l' " +
-                            "when HandsPlayers.position = '1' then 'l' " +
-                            "when HandsPlayers.position = '2' then 'm' " +
-                            "when HandsPlayers.position = '3' then 'm' " +
-                            "when HandsPlayers.position = '4' then 'm' " +
-                            "when HandsPlayers.position = '5' then 'e' " +
-                            "when HandsPlayers.position = '6' then 'e' " +
-                            "when HandsPlayers.position = '7' then 'e' " +
-                            "when HandsPlayers.position = '8' then 'e' " +
-                            "when HandsPlayers.position = '9' then 'e' " +
-                            "else 'X' end " +
-                        "FROM Hands, HandsPlayers, Gametypes " +
-                        "WHERE HandsPlayers.handId = Hands.id " +
-                        " AND Gametypes.id = Hands.gametypeid "+
-                        " AND Gametypes.type = " +
-                        "   (SELECT Gametypes.type FROM Gametypes, Hands   " +
-                        "  WHERE Hands.gametypeid = Gametypes.id and Hands.id = %d) " +
-                        " AND Gametypes.Limittype =  " +
-                        "   (SELECT Gametypes.limitType FROM Gametypes, Hands  " +
-                        " WHERE Hands.gametypeid = Gametypes.id and Hands.id = %d) " +
-                        "AND Gametypes.category = 'holdem' " +
-                        "AND fileId = (SELECT fileId FROM Hands " +
-                        " WHERE Hands.id = %d) " +
-                        "AND HandsPlayers.playerId = %d " +
-                        "AND street0VPI " +
-                        "AND startCards > 0 AND startCards <> 170 " +
-                        "ORDER BY startCards DESC " +
-                        ";")   % (int(handid), int(handid), int(handid), int(player))
-
-    #print query
-    sc.execute(query)
-    for (qstartcards, qstreet0Aggr, qstreet0CalledRaiseDone, qposition) in sc.fetchall():
-        humancards = Card.decodeStartHandValue("holdem", qstartcards)
-        #print humancards, qstreet0Aggr, qstreet0CalledRaiseDone, qposition
-        if qposition == "b" and qstreet0CalledRaiseDone:
-            PFdefendBB=PFdefendBB+"/"+humancards
-            count_pfd += 1
-            if (count_pfd / 8.0 == int(count_pfd / 8.0)):
-                PFdefendBB=PFdefendBB+"\n"
-        elif qstreet0Aggr == True:
-            PFaggr=PFaggr+"/"+humancards+"."+qposition
-            count_pfa += 1
-            if (count_pfa / 8.0 == int(count_pfa / 8.0)):
-                PFaggr=PFaggr+"\n"
-        elif qstreet0CalledRaiseDone:
-            PFcar=PFcar+"/"+humancards+"."+qposition
-            count_pfc += 1
-            if (count_pfc / 8.0 == int(count_pfc / 8.0)):
-                PFcar=PFcar+"\n"
-        else:
-            PFlimp=PFlimp+"/"+humancards+"."+qposition
-            count_pfl += 1
-            if (count_pfl / 8.0 == int(count_pfl / 8.0)):
-                PFlimp=PFlimp+"\n"
-    sc.close()
-    
+
+    # the hud's own connection, starthands are cached on it per file and player
+    db_connection = getattr(hand_instance, 'db_connection', None)
+    if db_connection is None:
+        db_connection = Database.Database(Configuration.get_shared_config())
+    buckets = db_connection.get_starthands(handid, int(player))
+
+    PFdefendBB += _starthands_string(buckets.get('defendBB', ()), False)
+    PFaggr += _starthands_string(buckets.get('raised', ()))
+    PFcar += _starthands_string(buckets.get('calledRaise', ()))
+    PFlimp += _starthands_string(buckets.get('limped', ()))
+
     returnstring = PFlimp + "\n" + PFaggr + "\n" + PFcar + "\n" + PFdefendBB  #+ "\n" + str(handid)
 
     return ((returnstring),
@@ -1507,12 +1493,13 @@ misslist = [ "Configuration", "Database", "Charset", "codecs", "encoder"
                  , 'GPollableInputStream', 'GPollableOutputStream'
                  , "re", "re_Places", 'Hand'
                ]
-STATLIST = [ x for x in STATLIST if x not in ("do_stat", "do_tip","get_valid_stats")]
+STATLIST = [ x for x in STATLIST if x not in ("do_stat", "do_tip","get_valid_stats", "compile_stat", "compute_stats")]
 STATLIST = [ x for x in STATLIST if not x.startswith('_')]
 STATLIST = [ x for x in STATLIST if x not in dir(sys) ]
 STATLIST = [ x for x in STATLIST if x not in dir(codecs) ]
 STATLIST = [ x for x in STATLIST if x not in misslist ]
 #print "STATLIST is", STATLIST
+STATFUNCS = dict([(x, globals()[x]) for x in STATLIST])
 
 if __name__== "__main__":
         
@@ -14,9 +14,16 @@
 import L10n
 _ = L10n.get_translation()
 
-import sys, random
+import sys
 import re
-import pokereval
+import math
+import threading
+from collections import OrderedDict
+from itertools import permutations
+try:
+    from pokereval import PokerEval
+except ImportError:
+    from HandEvaluator import HandEvaluator as PokerEval
 
 SUITS = ['h', 'd', 's', 'c']
 
@@ -27,7 +34,15 @@ ANY = 0
 SUITED = 1
 OFFSUIT = 2
 
-ev = pokereval.PokerEval()
+SUIT_PERMUTATIONS = list(permutations(SUITS))
+
+MC_BATCH = 5000             # Monte Carlo iterations between precision checks
+MC_MAX_ITERATIONS = 125000
+PRECISION = 0.005           # stop sampling once equity is known to +/- 0.5% ...
+CONFIDENCE_Z = 1.96         # ... at 95% confidence
+EQUITY_CACHE_SIZE = 10000
+
+ev = PokerEval()
 
 
 class Stove:
@@ -64,12 +79,12 @@ class Stove:
         self.hand = pocket_cards
 
     def set_villain_range_string(self, string):
-        # Villain's range
+        # Villain's range, each entry optionally weighted: AKs, JJ+:50%, 76s+:0.25
         h_range = Range()
         hands_in_range = string.strip().split(',')
         for h in hands_in_range:
-            _h = h.strip()
-            h_range.expand(expand_hands(_h, self.hand, self.board))
+            _h, weight = parse_weight(h.strip())
+            h_range.expand(expand_hands(_h, self.hand, self.board), weight)
 
         self.h_range = h_range
 
@@ -82,6 +97,21 @@ class Cards:
     def get(self):
         return [self.c1, self.c2]
 
+    def key(self):
+        return tuple(sorted([self.c1, self.c2]))
+
+    def __eq__(self, other):
+        return isinstance(other, Cards) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.key() < other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
 class Board:
     def __init__(self, b1=None, b2=None, b3=None, b4=None, b5=None):
         self.b1 = b1
@@ -113,17 +143,46 @@ class Board:
 
 class Range:
     def __init__(self):
-        self.__hands = set()
+        self.__hands = {}
 
-    def add(self, hand):
-        self.__hands.add(hand)
+    def add(self, hand, weight=1.0):
+        self.__hands[hand] = weight
 
-    def expand(self, hands):
-        self.__hands.update(set(hands))
+    def expand(self, hands, weight=1.0):
+        for hand in hands:
+            self.add(hand, weight)
 
     def get(self):
         return sorted(self.__hands)
 
+    def weight(self, hand):
+        return self.__hands.get(hand, 0.0)
+
+
+class LRUCache:
+    """Keep the most recently used results, dropping the oldest past size.
+       Shared by GuiStove worker threads."""
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+equity_cache = LRUCache(EQUITY_CACHE_SIZE)
 
 
 class EV:
@@ -133,25 +192,57 @@ class EV:
         self.n_ties = tie
         self.n_losses = lose
 
+    def add(self, other):
+        self.n_hands += other.n_hands
+        self.n_wins += other.n_wins
+        self.n_ties += other.n_ties
+        self.n_losses += other.n_losses
+
+    def equity(self):
+        return (self.n_wins + self.n_ties / 2.) / self.n_hands
+
+    def error(self):
+        """Half width of the confidence interval of equity() for sampled plays."""
+        mean = self.equity()
+        variance = (self.n_wins + self.n_ties / 4.) / self.n_hands - mean * mean
+        return CONFIDENCE_Z * math.sqrt(max(variance, 0) / self.n_hands)
+
 
 class SumEV:
+    """Range equity: every hand's win/tie/loss rates weighted by its share of the range.
+       If all weights are 0 (e.g. 'KK:0'), every hand counts the same."""
     def __init__(self):
         self.n_hands = 0
         self.n_wins = 0
         self.n_ties = 0
         self.n_losses = 0
+        self.weight = 0
+        self.unweighted = [0, 0., 0., 0.]    # hands added, sums of their win/tie/loss rates
         self.output = ""
 
-    def add(self, ev):
+    def add(self, ev, weight=1, hands=1):
+        """Add the equity ev of hands range hands, weighing weight together"""
         self.n_hands += ev.n_hands
-        self.n_wins += ev.n_wins
-        self.n_ties += ev.n_ties
-        self.n_losses += ev.n_losses
+        self.n_wins += weight * float(ev.n_wins) / ev.n_hands
+        self.n_ties += weight * float(ev.n_ties) / ev.n_hands
+        self.n_losses += weight * float(ev.n_losses) / ev.n_hands
+        self.weight += weight
+        self.unweighted[0] += hands
+        self.unweighted[1] += hands * float(ev.n_wins) / ev.n_hands
+        self.unweighted[2] += hands * float(ev.n_ties) / ev.n_hands
+        self.unweighted[3] += hands * float(ev.n_losses) / ev.n_hands
+
+    def rates(self):
+        """(win, tie, loss) rates of the range, 0 to 1"""
+        if self.weight > 0:
+            return (self.n_wins / self.weight, self.n_ties / self.weight, self.n_losses / self.weight)
+        (count, wins, ties, losses) = self.unweighted
+        if count == 0:
+            return (0., 0., 0.)
+        return (wins / count, ties / count, losses / count)
 
     def show(self, hand, h_range):
-        win_pct = 100 * (float(self.n_wins) / float(self.n_hands))
-        lose_pct = 100 * (float(self.n_losses) / float(self.n_hands))
-        tie_pct = 100 * (float(self.n_ties) / float(self.n_hands))
+        (win_pct, tie_pct, lose_pct) = [100 * r for r in self.rates()]
         equity = win_pct + tie_pct / 2.
         self.output = """
 Enumerated %d possible plays.
@@ -164,6 +255,17 @@ Equity       Win         Lose         Tie
         print self.output
 
 
+def parse_weight(abbrev):
+    """Split a range entry such as 'AKo:50%' or 'JJ+:0.5' into the hands and their weight."""
+    if ':' not in abbrev:
+        return abbrev, 1.0
+    abbrev, weight = abbrev.rsplit(':', 1)
+    weight = weight.strip()
+    if weight.endswith('%'):
+        return abbrev.strip(), float(weight[:-1]) / 100
+    return abbrev.strip(), float(weight)
+
+
 # Expands hand abbreviations such as JJ and AK to full hand ranges.
 # Takes into account cards already known to be in player's hand and/or
 # board. 
@@ -260,7 +362,21 @@ def parse_args(args, container):
     return True
 
 
-def odds_for_hand(hand1, hand2, board, iterations):
+def odds_for_hand(hand1, hand2, board, iterations, precision=None):
+    """Odds of hand1 against hand2. With precision, Monte Carlo runs in
+       batches of MC_BATCH and stops as soon as the equity is known to
+       within +/- precision, or after iterations."""
+    if iterations <= 0 or not precision:
+        return _odds_for_hand(hand1, hand2, board, iterations)
+    _ev = EV(0, 0, 0, 0)
+    while _ev.n_hands < iterations:
+        _ev.add(_odds_for_hand(hand1, hand2, board, min(MC_BATCH, iterations - _ev.n_hands)))
+        if _ev.error() <= precision:
+            break
+    return _ev
+
+
+def _odds_for_hand(hand1, hand2, board, iterations):
     res = ev.poker_eval(game='holdem',
         pockets = [
             hand1,
@@ -282,7 +398,25 @@ def odds_for_hand(hand1, hand2, board, iterations):
     return _ev
 
 
-def odds_for_range(holder):
+def canonical(hand, villain, board):
+    """Suit-isomorphic representative of a matchup: the smallest relabelling
+       of the suits, so that e.g. AhKh v QsQc and AdKd v QhQs share a key."""
+    best = None
+    for perm in SUIT_PERMUTATIONS:
+        suit = dict(zip(SUITS, perm))
+        key = tuple([tuple(sorted([c[0] + suit[c[1]] for c in cards if c != '__']))
+                     for cards in (board, hand, villain)])
+        if best is None or key < best:
+            best = key
+    return best
+
+
+def odds_for_range(holder, progress=None, precision=PRECISION):
+    """Equity of holder.hand against the weighted holder.h_range.
+
+       Range hands that are the same matchup up to suits are evaluated once,
+       and results are kept in equity_cache across calls. progress, if given,
+       is called with (done, total) after each distinct matchup."""
     sev = SumEV()
     monte_carlo = False
 
@@ -305,17 +439,29 @@ def odds_for_range(holder):
 
     if monte_carlo:
         print _('No board given. Using Monte-Carlo simulation...')
-        iters = random.randint(25000, 125000)
+        iters = MC_MAX_ITERATIONS
     else:
         iters = -1
+
+    hero = [holder.hand.c1, holder.hand.c2]
+    matchups = OrderedDict()
     for h in holder.h_range.get():
-        e = odds_for_hand(
-            [holder.hand.c1, holder.hand.c2],
-            [h.c1, h.c2],
-            b,
-            iterations=iters
-            )
-        sev.add(e)
+        key = canonical(hero, [h.c1, h.c2], b)
+        if key in matchups:
+            matchups[key][1] += holder.h_range.weight(h)
+            matchups[key][2] += 1
+        else:
+            matchups[key] = [h, holder.h_range.weight(h), 1]
+
+    for done, (key, (h, weight, hands)) in enumerate(matchups.items()):
+        cache_key = (key, precision if monte_carlo else None)
+        e = equity_cache.get(cache_key)
+        if e is None:
+            e = odds_for_hand(hero, [h.c1, h.c2], b, iterations=iters, precision=precision)
+            equity_cache.put(cache_key, e)
+        sev.add(e, weight, hands)
+        if progress:
+            progress(done + 1, len(matchups))
 
     sev.show(holder.hand, holder.h_range.get())
     return sev
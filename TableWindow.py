@@ -35,11 +35,9 @@ import logging
 from time import sleep
 
 #    FreePokerTools modules
-import Configuration
 from HandHistoryConverter import getTableTitleRe
 from HandHistoryConverter import getTableNoRe
 
-c = Configuration.Config()
 log = logging.getLogger("hud")
 
 #    Global used for figuring out the current game being played from the title.
@@ -45,7 +45,7 @@ else: # This is bad--figure out the values for the various windows flavors
 
 if __name__ == "__main__":
     Configuration.set_logfile("fpdb-log.txt")
-config = Configuration.Config()
+    config = Configuration.Config()
 #   Main function used for testing
 if __name__=="__main__":
 #    c = Configuration.Config()
@@ -30,6 +30,13 @@ import Options
 import datetime
 import pytz
 import pprint
+import json
+import multiprocessing
+import tempfile
+import StringIO
+from collections import OrderedDict
+import shutil
+from time import time
 pp = pprint.PrettyPrinter(indent=4)
 
 DEBUG = False
@@ -77,7 +84,7 @@ class FpdbError:
     def __init__(self, sitename):
         self.site = sitename
         self.errorcount = 0
-        self.histogram = {}
+        self.histogram = OrderedDict()  # filename: errors, in the order the files were tested
         self.statcount = {}
         self.parse_errors = []
 
@@ -101,6 +108,15 @@ class FpdbError:
 
         self.errorcount += 1
 
+    def merge(self, other):
+        """Add the errors another FpdbError of the same site found, e.g. in a shard's process"""
+        for filename, count in other.histogram.iteritems():
+            self.histogram[filename] = self.histogram.get(filename, 0) + count
+        for stat, count in other.statcount.iteritems():
+            self.statcount[stat] = self.statcount.get(stat, 0) + count
+        self.parse_errors.extend(other.parse_errors)
+        self.errorcount += other.errorcount
+
     def print_histogram(self):
         print "%s:" % self.site
         for f in self.histogram:
@@ -125,6 +141,56 @@ class FpdbError:
         idx = path.find('regression')
         return path[idx:]
 
+class Benchmark:
+    """Files, bytes, hands and seconds spent in each import stage, per site, of the files
+       tested. The seconds are those runImport took, summed over the files, so the
+       throughput doesn't depend on how many processes share the run"""
+
+    KEYS = ('files', 'bytes', 'seconds') + Importer.ImportTimer.STAGES + Importer.ImportTimer.COUNTS
+
+    def __init__(self):
+        self.sites = {}     # site: {key: total}
+
+    def add(self, site, totals):
+        entry = self.sites.setdefault(site, dict.fromkeys(self.KEYS, 0))
+        for key in self.KEYS:
+            entry[key] += totals.get(key, 0)
+
+    def add_file(self, site, filename, seconds, timer):
+        """Add a file imported in seconds, timer the ImportTimer of its runImport"""
+        totals = timer.report()['total']
+        totals.update({'files': 1, 'bytes': os.path.getsize(filename), 'seconds': seconds})
+        self.add(site, totals)
+
+    def merge(self, other):
+        for site, totals in other.sites.iteritems():
+            self.add(site, totals)
+
+    def rates(self, totals):
+        seconds = max(totals['seconds'], 0.000001)
+        totals['handsPerSecond'] = totals['hands'] / seconds
+        totals['mbPerSecond'] = totals['bytes'] / 1048576.0 / seconds
+        return totals
+
+    def report(self, processes, seconds):
+        """{'processes': n, 'seconds': wall clock time of the run, 'sites': {site: totals},
+           'total': totals}, totals having the KEYS plus handsPerSecond and mbPerSecond"""
+        total = dict.fromkeys(self.KEYS, 0)
+        for entry in self.sites.itervalues():
+            for key in self.KEYS:
+                total[key] += entry[key]
+        sites = dict((site, self.rates(dict(entry))) for site, entry in self.sites.iteritems())
+        return {'processes': processes, 'seconds': seconds, 'sites': sites, 'total': self.rates(total)}
+
+    def print_throughput(self):
+        report = self.report(None, None)
+        print "%-18s %6s %8s %10s %8s" % ("Site", "Files", "Hands", "Hands/sec", "MB/sec")
+        for site, totals in sorted(report['sites'].items()) + [("Total", report['total'])]:
+            print "%-18s %6d %8d %10.1f %8.3f" % (site, totals['files'], totals['hands'],
+                                                totals['handsPerSecond'], totals['mbPerSecond'])
+
+benchmark = Benchmark()
+
 def compare_gametypes_file(filename, importer, errors):
     hashfilename = filename + '.gt'
 
@@ -266,6 +332,7 @@ def compare(leaf, importer, errors, site):
             return False
                 
         (stored, dups, partial, skipped, errs, ttime) = importer.runImport()
+        benchmark.add_file(site, filename, ttime, importer.timer)
         
         if errs > 0 or partial > 0:
             errors.error_report(filename, (stored, dups, partial, errs), "Parse", False, False, False)
@@ -288,7 +355,7 @@ def walk_testfiles(dir, function, importer, errors, site):
         for file in [file for file in os.listdir(dir) if not file in [".",".."]]:
             nfile = os.path.join(dir,file)
             if os.path.isdir(nfile):
-                walk_testfiles(nfile, compare, importer, errors, site)
+                walk_testfiles(nfile, function, importer, errors, site)
             else:
                 function(nfile, importer, errors, site)
     except OSError as (errno, strerror):
@@ -298,6 +365,50 @@ def walk_testfiles(dir, function, importer, errors, site):
         else:
             raise OSError(errno, strerror)
 
+def make_importer(config):
+    settings = {}
+    settings.update(config.get_db_parameters())
+    settings.update(config.get_import_parameters())
+    settings.update(config.get_default_paths())
+    importer = Importer.Importer(False, settings, config, None)
+    importer.setDropIndexes("don't drop")
+    importer.setThreads(-1)
+    importer.setCallHud(False)
+    importer.setFakeCacheHHC(True)
+    return importer
+
+# -j N shares the sites between N processes. A site's files are tested in one process, in the
+# order of a serial run, so duplicate hands across its files and the summaries of its tourneys
+# see the same database as they would then
+_shard = {}    # the importer of a shard's process, see init_shard
+
+def init_shard(dir):
+    """Pool initializer: an importer with a sqlite database of its own, in a directory below
+       dir. Not :memory:, the importer reconnects between files"""
+    config = Configuration.Config(file = "HUD_config.test.xml")
+    config.dir_database = os.path.join(dir, str(os.getpid()))
+    Database.Database(config).recreate_tables()
+    _shard['importer'] = make_importer(config)
+
+def test_shard(job):
+    """Test the files of a site in a shard's process. Returns the errors, the benchmark and
+       what was printed, for the main process to print in the order of a serial run"""
+    (errorsite, site, files) = job
+    global benchmark
+    benchmark = Benchmark()
+    errors = FpdbError(errorsite)
+    (stdout, sys.stdout) = (sys.stdout, StringIO.StringIO())
+    try:
+        for filename in files:
+            compare(filename, _shard['importer'], errors, site)
+        printed = sys.stdout.getvalue()
+    except:
+        stdout.write(sys.stdout.getvalue())
+        raise
+    finally:
+        sys.stdout = stdout
+    return (errors, benchmark, printed)
+
 def usage():
     print "USAGE:"
     print "Run all tests:"
@@ -306,6 +417,8 @@ def usage():
     print "\t./TestHandsPlayers -s <Sitename>"
     print "Run tests for a sinlge file in a site:"
     print "\t./TestHandsPlayers -s <Sitename> -f <filename>"
+    print "Share the sites between 4 processes, and write a benchmark report:"
+    print "\t./TestHandsPlayers -j 4 --benchmark <filename>"
     sys.exit(0)
 
 def main(argv=None):
@@ -333,18 +446,21 @@ def main(argv=None):
             print "Only regression testing '%s' files" % (options.sitename)
         test_all_sites = False
 
-    config = Configuration.Config(file = "HUD_config.test.xml")
-    db = Database.Database(config)
-    settings = {}
-    settings.update(config.get_db_parameters())
-    settings.update(config.get_import_parameters())
-    settings.update(config.get_default_paths())
-    db.recreate_tables()
-    importer = Importer.Importer(False, settings, config, None)
-    importer.setDropIndexes("don't drop")
-    importer.setThreads(-1)
-    importer.setCallHud(False)
-    importer.setFakeCacheHHC(True)
+    starttime = time()
+    if options.threads > 1:
+        # the walk only lists the files of each site, a pool of processes then tests them
+        importer, queued = None, []
+        def test(leaf, importer, errors, site):
+            if leaf.endswith('.txt') or leaf.endswith('.xml'):
+                if not queued or queued[-1][0] != errors.site:
+                    queued.append((errors.site, site, []))
+                queued[-1][2].append(leaf)
+    else:
+        config = Configuration.Config(file = "HUD_config.test.xml")
+        db = Database.Database(config)
+        db.recreate_tables()
+        importer = make_importer(config)
+        test = compare
 
     AbsoluteErrors    = FpdbError('Absolute Poker')
     BetfairErrors     = FpdbError('Betfair')
@@ -406,115 +522,127 @@ def main(argv=None):
         sites[options.sitename] = True
 
     if sites['PacificPoker'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/PacificPoker/", compare, importer, PacificPokerErrors, "PacificPoker")
-        walk_testfiles("regression-test-files/tour/PacificPoker/", compare, importer, PacificPokerErrors, "PacificPoker")
-        walk_testfiles("regression-test-files/summaries/PacificPoker/", compare, importer, PacificPokerErrors, "PacificPoker")
+        walk_testfiles("regression-test-files/cash/PacificPoker/", test, importer, PacificPokerErrors, "PacificPoker")
+        walk_testfiles("regression-test-files/tour/PacificPoker/", test, importer, PacificPokerErrors, "PacificPoker")
+        walk_testfiles("regression-test-files/summaries/PacificPoker/", test, importer, PacificPokerErrors, "PacificPoker")
     elif sites['PacificPoker'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, PacificPokerErrors, "PacificPoker")
+        walk_testfiles(options.filename, test, importer, PacificPokerErrors, "PacificPoker")
 
     if sites['PokerStars'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Stars/", compare, importer, PokerStarsErrors, "PokerStars")
-        walk_testfiles("regression-test-files/tour/Stars/", compare, importer, PokerStarsErrors, "PokerStars")
-        walk_testfiles("regression-test-files/summaries/Stars/", compare, importer, PokerStarsErrors, "PokerStars")
+        walk_testfiles("regression-test-files/cash/Stars/", test, importer, PokerStarsErrors, "PokerStars")
+        walk_testfiles("regression-test-files/tour/Stars/", test, importer, PokerStarsErrors, "PokerStars")
+        walk_testfiles("regression-test-files/summaries/Stars/", test, importer, PokerStarsErrors, "PokerStars")
     elif sites['PokerStars'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, PokerStarsErrors, "PokerStars")
+        walk_testfiles(options.filename, test, importer, PokerStarsErrors, "PokerStars")
 
     if sites['Full Tilt Poker'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/FTP/", compare, importer, FTPErrors, "Full Tilt Poker")
-        walk_testfiles("regression-test-files/tour/FTP/", compare, importer, FTPErrors, "Full Tilt Poker")
-        walk_testfiles("regression-test-files/summaries/FTP/", compare, importer, FTPErrors, "Full Tilt Poker")
+        walk_testfiles("regression-test-files/cash/FTP/", test, importer, FTPErrors, "Full Tilt Poker")
+        walk_testfiles("regression-test-files/tour/FTP/", test, importer, FTPErrors, "Full Tilt Poker")
+        walk_testfiles("regression-test-files/summaries/FTP/", test, importer, FTPErrors, "Full Tilt Poker")
     elif sites['Full Tilt Poker'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, FTPErrors, "Full Tilt Poker")
+        walk_testfiles(options.filename, test, importer, FTPErrors, "Full Tilt Poker")
     if sites['PartyPoker'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/PartyPoker/", compare, importer, PartyPokerErrors, "PartyPoker")
-        walk_testfiles("regression-test-files/tour/PartyPoker/", compare, importer, PartyPokerErrors, "PartyPoker")
+        walk_testfiles("regression-test-files/cash/PartyPoker/", test, importer, PartyPokerErrors, "PartyPoker")
+        walk_testfiles("regression-test-files/tour/PartyPoker/", test, importer, PartyPokerErrors, "PartyPoker")
     elif sites['PartyPoker'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, PartyPokerErrors, "PartyPoker")
+        walk_testfiles(options.filename, test, importer, PartyPokerErrors, "PartyPoker")
     if sites['Betfair'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Betfair/", compare, importer, BetfairErrors, "Betfair")
+        walk_testfiles("regression-test-files/cash/Betfair/", test, importer, BetfairErrors, "Betfair")
     elif sites['Betfair'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, BetfairErrors, "Betfair")
+        walk_testfiles(options.filename, test, importer, BetfairErrors, "Betfair")
     if sites['OnGame'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/OnGame/", compare, importer, OnGameErrors, "OnGame")
-        walk_testfiles("regression-test-files/tour/OnGame/", compare, importer, OnGameErrors, "OnGame")
+        walk_testfiles("regression-test-files/cash/OnGame/", test, importer, OnGameErrors, "OnGame")
+        walk_testfiles("regression-test-files/tour/OnGame/", test, importer, OnGameErrors, "OnGame")
     elif sites['OnGame'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, OnGameErrors, "OnGame")
+        walk_testfiles(options.filename, test, importer, OnGameErrors, "OnGame")
     if sites['Absolute'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Absolute/", compare, importer, AbsoluteErrors, "Absolute")
-        walk_testfiles("regression-test-files/tour/Absolute/", compare, importer, AbsoluteErrors, "Absolute")
+        walk_testfiles("regression-test-files/cash/Absolute/", test, importer, AbsoluteErrors, "Absolute")
+        walk_testfiles("regression-test-files/tour/Absolute/", test, importer, AbsoluteErrors, "Absolute")
     elif sites['Absolute'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, AbsoluteErrors, "Absolute")
+        walk_testfiles(options.filename, test, importer, AbsoluteErrors, "Absolute")
     if sites['Everleaf'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Everleaf/", compare, importer, EverleafErrors, "Everleaf")
-        walk_testfiles("regression-test-files/tour/Everleaf/", compare, importer, EverleafErrors, "Everleaf")
+        walk_testfiles("regression-test-files/cash/Everleaf/", test, importer, EverleafErrors, "Everleaf")
+        walk_testfiles("regression-test-files/tour/Everleaf/", test, importer, EverleafErrors, "Everleaf")
     elif sites['Everleaf'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, EverleafErrors, "Everleaf")
+        walk_testfiles(options.filename, test, importer, EverleafErrors, "Everleaf")
     if sites['Everest'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Everest/", compare, importer, EverestErrors, "Everest")
-        walk_testfiles("regression-test-files/tour/Everest/", compare, importer, EverestErrors, "Everest")
+        walk_testfiles("regression-test-files/cash/Everest/", test, importer, EverestErrors, "Everest")
+        walk_testfiles("regression-test-files/tour/Everest/", test, importer, EverestErrors, "Everest")
     elif sites['Everest'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, EverestErrors, "Everest")
+        walk_testfiles(options.filename, test, importer, EverestErrors, "Everest")
     if sites['Merge'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Merge/", compare, importer, MergeErrors, "Merge")
-        walk_testfiles("regression-test-files/tour/Merge/", compare, importer, MergeErrors, "Merge")
+        walk_testfiles("regression-test-files/cash/Merge/", test, importer, MergeErrors, "Merge")
+        walk_testfiles("regression-test-files/tour/Merge/", test, importer, MergeErrors, "Merge")
     elif sites['Merge'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, MergeErrors, "Merge")
+        walk_testfiles(options.filename, test, importer, MergeErrors, "Merge")
     if sites['Pkr'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/PKR/", compare, importer, PKRErrors, "PKR")
-        walk_testfiles("regression-test-files/tour/PKR/", compare, importer, PKRErrors, "PKR")
+        walk_testfiles("regression-test-files/cash/PKR/", test, importer, PKRErrors, "PKR")
+        walk_testfiles("regression-test-files/tour/PKR/", test, importer, PKRErrors, "PKR")
     elif sites['Pkr'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, PKRErrors, "PKR")
+        walk_testfiles(options.filename, test, importer, PKRErrors, "PKR")
     if sites['iPoker'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/iPoker/", compare, importer, iPokerErrors, "iPoker")
-        walk_testfiles("regression-test-files/tour/iPoker/", compare, importer, iPokerErrors, "iPoker")
+        walk_testfiles("regression-test-files/cash/iPoker/", test, importer, iPokerErrors, "iPoker")
+        walk_testfiles("regression-test-files/tour/iPoker/", test, importer, iPokerErrors, "iPoker")
     elif sites['iPoker'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, iPokerErrors, "iPoker")
+        walk_testfiles(options.filename, test, importer, iPokerErrors, "iPoker")
     if sites['Boss'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Boss/", compare, importer, BossErrors, "Boss")
-        walk_testfiles("regression-test-files/tour/Boss/", compare, importer, BossErrors, "Boss")
+        walk_testfiles("regression-test-files/cash/Boss/", test, importer, BossErrors, "Boss")
+        walk_testfiles("regression-test-files/tour/Boss/", test, importer, BossErrors, "Boss")
     elif sites['Boss'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, BossErrors, "Boss")
+        walk_testfiles(options.filename, test, importer, BossErrors, "Boss")
     if sites['Entraction'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Entraction/", compare, importer, EntractionErrors, "Entraction")
-        walk_testfiles("regression-test-files/tour/Entraction/", compare, importer, EntractionErrors, "Entraction")
+        walk_testfiles("regression-test-files/cash/Entraction/", test, importer, EntractionErrors, "Entraction")
+        walk_testfiles("regression-test-files/tour/Entraction/", test, importer, EntractionErrors, "Entraction")
     elif sites['Entraction'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, EntractionErrors, "Entraction")
+        walk_testfiles(options.filename, test, importer, EntractionErrors, "Entraction")
     if sites['BetOnline'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/BetOnline/", compare, importer, BetOnlineErrors, "BetOnline")
-        walk_testfiles("regression-test-files/tour/BetOnline/", compare, importer, BetOnlineErrors, "BetOnline")
+        walk_testfiles("regression-test-files/cash/BetOnline/", test, importer, BetOnlineErrors, "BetOnline")
+        walk_testfiles("regression-test-files/tour/BetOnline/", test, importer, BetOnlineErrors, "BetOnline")
     elif sites['BetOnline'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, BetOnlineErrors, "BetOnline")
+        walk_testfiles(options.filename, test, importer, BetOnlineErrors, "BetOnline")
     if sites['Microgaming'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Microgaming/", compare, importer, MicrogamingErrors, "Microgaming")
-        walk_testfiles("regression-test-files/tour/Microgaming/", compare, importer, MicrogamingErrors, "Microgaming")
+        walk_testfiles("regression-test-files/cash/Microgaming/", test, importer, MicrogamingErrors, "Microgaming")
+        walk_testfiles("regression-test-files/tour/Microgaming/", test, importer, MicrogamingErrors, "Microgaming")
     elif sites['Microgaming'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, MicrogamingErrors, "Microgaming")
+        walk_testfiles(options.filename, test, importer, MicrogamingErrors, "Microgaming")
     if sites['Cake'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Cake/", compare, importer, CakeErrors, "Cake")
-        walk_testfiles("regression-test-files/tour/Cake/", compare, importer, CakeErrors, "Cake")
+        walk_testfiles("regression-test-files/cash/Cake/", test, importer, CakeErrors, "Cake")
+        walk_testfiles("regression-test-files/tour/Cake/", test, importer, CakeErrors, "Cake")
     elif sites['Cake'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, CakeErrors, "Cake")
+        walk_testfiles(options.filename, test, importer, CakeErrors, "Cake")
     if sites['PokerTracker'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/PokerTracker/", compare, importer, PTErrors, "PokerTracker")
-        walk_testfiles("regression-test-files/tour/PokerTracker/", compare, importer, PTErrors, "PokerTracker")
+        walk_testfiles("regression-test-files/cash/PokerTracker/", test, importer, PTErrors, "PokerTracker")
+        walk_testfiles("regression-test-files/tour/PokerTracker/", test, importer, PTErrors, "PokerTracker")
     elif sites['PokerTracker'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, PTErrors, "PokerTracker")
+        walk_testfiles(options.filename, test, importer, PTErrors, "PokerTracker")
     if sites['Winamax'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Winamax/", compare, importer, WinamaxErrors, "Winamax")
-        walk_testfiles("regression-test-files/tour/Winamax/", compare, importer, WinamaxErrors, "Winamax")
+        walk_testfiles("regression-test-files/cash/Winamax/", test, importer, WinamaxErrors, "Winamax")
+        walk_testfiles("regression-test-files/tour/Winamax/", test, importer, WinamaxErrors, "Winamax")
     elif sites['Winamax'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, WinamaxErrors, "Winamax")
+        walk_testfiles(options.filename, test, importer, WinamaxErrors, "Winamax")
     if sites['Bovada'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Bovada/", compare, importer, BovadaErrors, "Bovada")
-        walk_testfiles("regression-test-files/tour/Bovada/", compare, importer, BovadaErrors, "Bovada")
+        walk_testfiles("regression-test-files/cash/Bovada/", test, importer, BovadaErrors, "Bovada")
+        walk_testfiles("regression-test-files/tour/Bovada/", test, importer, BovadaErrors, "Bovada")
     elif sites['Bovada'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, BovadaErrors, "Bovada")
+        walk_testfiles(options.filename, test, importer, BovadaErrors, "Bovada")
     if sites['Enet'] == True and not single_file_test:
-        walk_testfiles("regression-test-files/cash/Enet/", compare, importer, EnetErrors, "Enet")
+        walk_testfiles("regression-test-files/cash/Enet/", test, importer, EnetErrors, "Enet")
     elif sites['Enet'] == True and single_file_test:
-        walk_testfiles(options.filename, compare, importer, EnetErrors, "Enet")
-
+        walk_testfiles(options.filename, test, importer, EnetErrors, "Enet")
 
+    if options.threads > 1:
+        bysite = dict((errors.site, errors) for errors in ErrorsList)
+        dir = tempfile.mkdtemp(prefix = "fpdb-test-")
+        try:
+            pool = multiprocessing.Pool(options.threads, init_shard, (dir,))
+            for (errors, sitebenchmark, printed) in pool.imap(test_shard, queued):
+                sys.stdout.write(printed)
+                bysite[errors.site].merge(errors)
+                benchmark.merge(sitebenchmark)
+            pool.close()
+            pool.join()
+        finally:
+            shutil.rmtree(dir, ignore_errors = True)
 
     totalerrors = 0
 
@@ -553,6 +681,12 @@ def main(argv=None):
     for i, site in enumerate(ErrorsList):
         ErrorsList[i].print_parse_list()
 
+    print "-------- Throughput --------"
+    benchmark.print_throughput()
+    if options.benchmark:
+        with open(options.benchmark, 'w') as f:
+            json.dump(benchmark.report(max(options.threads, 1), time() - starttime), f, indent=2, sort_keys=True)
+
 if __name__ == '__main__':
     sys.exit(main())
 
@@ -231,7 +231,7 @@ class TourneySummary(object):
         money = money.strip(u'€&euro;\u20ac$ ')
         return HandHistoryConverter.clearMoneyString(money)
     
-    def insertOrUpdate(self, printtest=False):
+    def insertOrUpdate(self, printtest=False, commit=True):
         # First : check all needed info is filled in the object, especially for the initial select
 
         # Notes on DB Insert
@@ -254,22 +254,28 @@ class TourneySummary(object):
         self.dbid_pids = self.playerIds #TODO:rename this field in Hand so this silly renaming can be removed
         
         #print "TS.self before starting insert",self
-        self.tourneyTypeId = self.db.createOrUpdateTourneyType(self)
-        self.tourneyId = self.db.createOrUpdateTourney(self)
-        self.db.createOrUpdateTourneysPlayers(self)
-        self.db.commit()
+        # rows read ahead by Database.prepTourneySummaries, if any
+        tour = self.db.getTourneyCache(self.siteId, self.tourNo)
+        self.tourneyTypeId = self.db.createOrUpdateTourneyType(self, tour)
+        (self.tourneyId, change) = self.db.createOrUpdateTourney(self, tour)
+        (tpInserted, tpUpdated) = self.db.createOrUpdateTourneysPlayers(self, tour)
+        if commit:
+            self.db.commit()
         
         logging.debug(_("Tourney Insert/Update done"))
         
-        # TO DO : Return what has been done (tourney created, updated, nothing)
-        # ?? stored = 1 if tourney is fully created / duplicates = 1, if everything was already here and correct / partial=1 if some things were already here (between tourney, tourneysPlayers and handsPlayers)
-        # if so, prototypes may need changes to know what has been done or make some kind of dict in Tourney object that could be updated during the insert process to store that information
-        stored = 0
-        duplicates = 0
-        partial = 0
+        # stored = 1 if the tourney was created, updated = 1 if it was already there but the
+        # summary added to it, duplicates = 1 if everything was already there and correct
+        stored, duplicates, updated = 0, 0, 0
+        if change == 'insert':
+            stored = 1
+        elif change or tpInserted or tpUpdated:
+            updated = 1
+        else:
+            duplicates = 1
         errors = 0
         ttime = 0
-        return (stored, duplicates, partial, errors, ttime)
+        return (stored, duplicates, updated, errors, ttime)
 
 
     def addPlayer(self, rank, name, winnings, winningsCurrency, rebuyCount, addOnCount, koCount, entryId=None):
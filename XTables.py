@@ -36,7 +36,6 @@ import wnck
 
 #    FPDB modules
 from TableWindow import Table_Window
-import Configuration
 
 # Wnck caches the results of queries. A window once retrieved remains in
 # the list of Wnck internal objects even after the window no longer
@@ -58,7 +57,6 @@ root = wnck.screen_get_default()
 root.connect('window-closed', remove_wnck_win)
 
 
-c = Configuration.Config()
 log = logging.getLogger("hud")
 
 class Table(Table_Window):
@@ -14,11 +14,16 @@
 #You should have received a copy of the GNU Affero General Public License
 #along with this program. If not, see <http://www.gnu.org/licenses/>.
 #In the "official" distribution you can find the license in agpl-3.0.txt.
+import sys
+if [arg for arg in sys.argv if len(arg) > len('--profile') and '--profile-startup'.startswith(arg)]:
+    # before anything else is imported, so every module gets timed. optparse takes --profile-s too
+    import StartupProfiler
+    StartupProfiler.install()
+
 import L10n
 _ = L10n.init_translation()
 
 import os
-import sys
 import re
 import Queue
 
@@ -46,34 +51,12 @@ import pango
 import interlocks
 
 # these imports not required in this module, imported here to report version in About dialog
-import matplotlib
-matplotlib_version = matplotlib.__version__
-import numpy
-numpy_version = numpy.__version__
 import sqlite3
 sqlite3_version = sqlite3.version
 sqlite_version = sqlite3.sqlite_version
 
-import DetectInstalledSites
-import GuiPrefs
-import GuiLogView
-import GuiDatabase
-import GuiBulkImport
-import GuiTourneyImport
-import GuiImapFetcher
-import GuiRingPlayerStats
-import GuiTourneyPlayerStats
-import GuiTourneyViewer
-import GuiPositionalStats
-import GuiAutoImport
-import GuiGraphViewer
-import GuiTourneyGraphViewer
-import GuiSessionViewer
-import GuiHandViewer
-try:
-    import GuiStove
-except:
-    print _("GuiStove not found. If you want to use it please install pypoker-eval.")
+# the Gui* modules (and matplotlib/numpy with them) are imported when their tab
+# or dialog is first opened, so that they don't slow down starting fpdb
 import SQL
 import Database
 import Configuration
@@ -236,6 +219,16 @@ class fpdb:
             os_text="Unknown"
         
         import locale
+        try:
+            import matplotlib
+            matplotlib_version = matplotlib.__version__
+        except ImportError:
+            matplotlib_version = _("not installed")
+        try:
+            import numpy
+            numpy_version = numpy.__version__
+        except ImportError:
+            numpy_version = _("not installed")
         nums = [(_('Operating System'), os_text),
                 ('Python',           sys.version[0:3]),
                 ('GTK+',             '.'.join([str(x) for x in gtk.gtk_version])),
@@ -286,6 +279,7 @@ class fpdb:
         #force reload of prefs from xml file - needed because HUD could
         #have changed file contents
         self.load_profile()
+        import GuiPrefs
         prefs = GuiPrefs.GuiPrefs(self.config, self.window, dia.vbox, dia)
         response = dia.run()
         if response == gtk.RESPONSE_ACCEPT:
@@ -306,6 +300,7 @@ class fpdb:
                                   gtk.STOCK_SAVE, gtk.RESPONSE_ACCEPT))
                 dia.set_default_size(700, 320)
 
+                import GuiDatabase
                 prefs = GuiDatabase.GuiDatabase(self.config, self.window, dia)
                 response = dia.run()
                 if response == gtk.RESPONSE_ACCEPT:
@@ -520,7 +515,7 @@ class fpdb:
                 self.db.recreate_tables()
                 # find any guibulkimport/guiautoimport windows and clear cache:
                 for t in self.threads:
-                    if isinstance(t, GuiBulkImport.GuiBulkImport) or isinstance(t, GuiAutoImport.GuiAutoImport):
+                    if t.__class__.__name__ in ('GuiBulkImport', 'GuiAutoImport'):
                         t.importer.database.resetCache()
                 self.release_global_lock()
             elif response == gtk.RESPONSE_NO:
@@ -572,10 +567,19 @@ class fpdb:
                 lbl = gtk.Label(_(" Rebuilding HUD Cache ... "))
                 self.dia_confirm.vbox.add(lbl)
                 lbl.show()
+                pbar = gtk.ProgressBar()
+                self.dia_confirm.vbox.add(pbar)
+                pbar.show()
                 while gtk.events_pending():
                     gtk.main_iteration_do(False)
 
-                self.db.rebuild_cache(self.h_start_date.get_text(), self.start_date.get_text())
+                def progress(done, total):
+                    pbar.set_fraction(float(done) / max(total, 1))
+                    pbar.set_text(_("%d of %d game types") % (done, total))
+                    while gtk.events_pending():
+                        gtk.main_iteration_do(False)
+
+                self.db.rebuild_cache(self.h_start_date.get_text(), self.start_date.get_text(), progress=progress)
             elif response == gtk.RESPONSE_NO:
                 print _('User cancelled rebuilding hud cache')
 
@@ -643,6 +647,7 @@ class fpdb:
 
         if viewer is None:
             #print "creating new log viewer"
+            import GuiLogView
             new_thread = GuiLogView.GuiLogView(self.config, self.window, self.closeq)
             self.threads.append(new_thread)
         else:
@@ -690,6 +695,7 @@ class fpdb:
         screen_names=[]
         history_paths=[]
         summary_paths=[]
+        import DetectInstalledSites
         detector = DetectInstalledSites.DetectInstalledSites()
               
         y_pos=1
@@ -962,7 +968,7 @@ class fpdb:
 
     def load_profile(self, create_db=False):
         """Loads profile from the provided path name."""
-        self.config = Configuration.Config(file=options.config, dbname=options.dbname)
+        self.config = Configuration.get_shared_config(file=options.config, dbname=options.dbname)
         if self.config.file_error:
             self.warning_box(_("There is an error in your config file %s") % self.config.file
                               + ":\n" + str(self.config.file_error),
@@ -1129,6 +1135,7 @@ class fpdb:
 
     def tab_auto_import(self, widget, data=None):
         """opens the auto import tab"""
+        import GuiAutoImport
         new_aimp_thread = GuiAutoImport.GuiAutoImport(self.settings, self.config, self.sql, self.window)
         self.threads.append(new_aimp_thread)
         aimp_tab = new_aimp_thread.get_vbox()
@@ -1139,6 +1146,7 @@ class fpdb:
 
     def tab_bulk_import(self, widget, data=None):
         """opens a tab for bulk importing"""
+        import GuiBulkImport
         new_import_thread = GuiBulkImport.GuiBulkImport(self.settings, self.config, self.sql, self.window)
         self.threads.append(new_import_thread)
         bulk_tab=new_import_thread.get_vbox()
@@ -1146,12 +1154,14 @@ class fpdb:
 
     def tab_tourney_import(self, widget, data=None):
         """opens a tab for bulk importing tournament summaries"""
+        import GuiTourneyImport
         new_import_thread = GuiTourneyImport.GuiTourneyImport(self.settings, self.config, self.sql, self.window)
         self.threads.append(new_import_thread)
         bulk_tab=new_import_thread.get_vbox()
         self.add_and_display_tab(bulk_tab, _("Tournament Results Import"))
 
     def tab_imap_import(self, widget, data=None):
+        import GuiImapFetcher
         new_thread = GuiImapFetcher.GuiImapFetcher(self.config, self.db, self.sql, self.window)
         self.threads.append(new_thread)
         tab=new_thread.get_vbox()
@@ -1159,36 +1169,42 @@ class fpdb:
     #end def tab_import_imap_summaries
 
     def tab_ring_player_stats(self, widget, data=None):
+        import GuiRingPlayerStats
         new_ps_thread = GuiRingPlayerStats.GuiRingPlayerStats(self.config, self.sql, self.window)
         self.threads.append(new_ps_thread)
         ps_tab=new_ps_thread.get_vbox()
         self.add_and_display_tab(ps_tab, _("Ring Player Stats"))
 
     def tab_tourney_player_stats(self, widget, data=None):
+        import GuiTourneyPlayerStats
         new_ps_thread = GuiTourneyPlayerStats.GuiTourneyPlayerStats(self.config, self.db, self.sql, self.window)
         self.threads.append(new_ps_thread)
         ps_tab=new_ps_thread.get_vbox()
         self.add_and_display_tab(ps_tab, _("Tourney Stats"))
 
     def tab_tourney_viewer_stats(self, widget, data=None):
+        import GuiTourneyViewer
         new_thread = GuiTourneyViewer.GuiTourneyViewer(self.config, self.db, self.sql, self.window)
         self.threads.append(new_thread)
         tab=new_thread.get_vbox()
         self.add_and_display_tab(tab, _("Tourney Viewer"))
 
     def tab_positional_stats(self, widget, data=None):
+        import GuiPositionalStats
         new_ps_thread = GuiPositionalStats.GuiPositionalStats(self.config, self.sql)
         self.threads.append(new_ps_thread)
         ps_tab=new_ps_thread.get_vbox()
         self.add_and_display_tab(ps_tab, _("Positional Stats"))
 
     def tab_session_stats(self, widget, data=None):
+        import GuiSessionViewer
         new_ps_thread = GuiSessionViewer.GuiSessionViewer(self.config, self.sql, self.window, self)
         self.threads.append(new_ps_thread)
         ps_tab=new_ps_thread.get_vbox()
         self.add_and_display_tab(ps_tab, _("Session Stats"))
 
     def tab_hand_viewer(self, widget, data=None):
+        import GuiHandViewer
         new_ps_thread = GuiHandViewer.GuiHandViewer(self.config, self.sql, self.window)
         self.threads.append(new_ps_thread)
         ps_tab=new_ps_thread.get_vbox()
@@ -1217,6 +1233,7 @@ You can find the full license texts in agpl-3.0.txt, gpl-2.0.txt, gpl-3.0.txt an
 
     def tabGraphViewer(self, widget, data=None):
         """opens a graph viewer tab"""
+        import GuiGraphViewer
         new_gv_thread = GuiGraphViewer.GuiGraphViewer(self.sql, self.config, self.window)
         self.threads.append(new_gv_thread)
         gv_tab = new_gv_thread.get_vbox()
@@ -1224,6 +1241,7 @@ You can find the full license texts in agpl-3.0.txt, gpl-2.0.txt, gpl-3.0.txt an
 
     def tabTourneyGraphViewer(self, widget, data=None):
         """opens a graph viewer tab"""
+        import GuiTourneyGraphViewer
         new_gv_thread = GuiTourneyGraphViewer.GuiTourneyGraphViewer(self.sql, self.config, self.window)
         self.threads.append(new_gv_thread)
         gv_tab = new_gv_thread.get_vbox()
@@ -1231,6 +1249,11 @@ You can find the full license texts in agpl-3.0.txt, gpl-2.0.txt, gpl-3.0.txt an
 
     def tabStove(self, widget, data=None):
         """opens a tab for poker stove"""
+        try:
+            import GuiStove
+        except:
+            print _("GuiStove not found. If you want to use it please install pypoker-eval.")
+            return
         thread = GuiStove.GuiStove(self.config, self.window)
         self.threads.append(thread)
         tab = thread.get_vbox()
@@ -1455,6 +1478,8 @@ You can find the full license texts in agpl-3.0.txt, gpl-2.0.txt, gpl-3.0.txt an
                 dia.destroy()
 
     def main(self):
+        if options.profile_startup and 'StartupProfiler' in sys.modules:
+            StartupProfiler.report()
         gtk.main()
         return 0
 
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import Queue
+import sqlite3
+
+import AsyncQuery
+import Database
+
+class MemoryDB:
+    """Stands in for the Database the worker thread would connect"""
+    backend = Database.Database.SQLITE
+    def __init__(self, rows):
+        self.connection = sqlite3.connect(':memory:', check_same_thread = False)
+        self.connection.execute("CREATE TABLE Hands (id INTEGER PRIMARY KEY, siteHandNo BIGINT)")
+        self.connection.executemany("INSERT INTO Hands VALUES (?, ?)", [(i, 1000 + i) for i in xrange(1, rows + 1)])
+        self.connection.commit()
+    def get_cursor(self):
+        return self.connection.cursor()
+    def rollback(self):
+        self.connection.rollback()
+
+# what the worker hands to the gtk thread, run by the test as the gtk main loop would
+idle = Queue.Queue()
+
+def runner(rows, page_size = 500):
+    AsyncQuery.gobject.idle_add = lambda *args: idle.put(args)
+    r = AsyncQuery.QueryRunner(None, None, page_size)
+    r.db = MemoryDB(rows)
+    return r
+
+def collect(r, query, args = None):
+    """Run query and what it hands to the gtk thread, until it is done or fails"""
+    result = {'pages': [], 'done': False, 'error': None}
+    def page(colnames, rows):
+        result['colnames'] = colnames
+        result['pages'].append(rows)
+    def done():
+        result['done'] = True
+    def error(e):
+        result['error'] = e
+    r.run(query, args, page, done, error)
+    while not result['done'] and result['error'] is None:
+        args = idle.get(timeout = 10)
+        args[0](*args[1:])
+    return result
+
+def testPages():
+    r = runner(1200)
+    result = collect(r, "SELECT id, siteHandNo FROM Hands ORDER BY id")
+    assert result['colnames'] == ['id', 'siteHandNo']
+    assert [len(p) for p in result['pages']] == [500, 500, 200]
+    assert [row[0] for p in result['pages'] for row in p] == range(1, 1201)
+    result = collect(r, "SELECT siteHandNo FROM Hands WHERE id > ?", (1150,))
+    assert result['pages'] == [[(1000 + i,) for i in xrange(1151, 1201)]]
+    r.close()
+
+def testError():
+    r = runner(10)
+    result = collect(r, "SELECT nosuchcolumn FROM Hands")
+    assert isinstance(result['error'], sqlite3.OperationalError)
+    assert not result['done'] and result['pages'] == []
+    # the worker carries on with the next query
+    result = collect(r, "SELECT COUNT(*) FROM Hands")
+    assert result['pages'] == [[(10,)]] and result['done']
+    r.close()
+
+def testCancel():
+    r = runner(3000, 100)
+    delivered = []
+    r.run("SELECT id FROM Hands", page = lambda c, rows: delivered.append(rows), done = lambda: delivered.append('done'))
+    r.run("SELECT id FROM Hands", page = lambda c, rows: delivered.append(rows), done = lambda: delivered.append('done'))
+    r.cancel()
+    # whatever the worker handed on before the cancel is dropped
+    result = collect(r, "SELECT COUNT(*) FROM Hands")
+    assert result['pages'] == [[(3000,)]]
+    while not idle.empty():
+        args = idle.get()
+        args[0](*args[1:])
+    assert delivered == []
+    r.close()
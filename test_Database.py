@@ -18,6 +18,7 @@
 import sqlite3
 import Database
 import math
+from datetime import datetime, timedelta
 
 # Should probably use our wrapper classes - creating sqlite db in memory
 sqlite3.register_converter("bool", lambda x: bool(int(x)))
@@ -81,3 +82,147 @@ def testSQLiteModFunction():
         idx = idx+1
 
     cur.execute("DROP TABLE test")
+
+def testHudStatStore():
+    import SQL
+    store = Database.HudStatStore(SQL.Sql(db_server = 'sqlite'))
+    (idx, name) = store.columns[0]
+    row = dict((n, 0) for i, n in store.columns)
+    row.update({'player_id': 5, 'bigblind': 0})
+    store.set_gametypes(1, 1, set([1]))
+    key = (1, 0, 10, 'd240101', 1)
+    delta = [3] + [1] * len(Database.CACHE_KEYS)
+    deltas = {'gametypeId': 1, 'seats': 6, 'styleKey': 'd240102', 'bigblind': 2, 'players': {5: delta}}
+
+    assert store.get_stats(99, deltas, key, key) is None
+    store.load(10, 99, key, key, {5: row})
+    store.add_hand(11, deltas)
+    store.add_hand(11, deltas)      # already added
+    store.add_hand(9, deltas)       # older than the stats loaded
+    stats = store.get_stats(99, deltas, key, key)
+    assert stats[5][name] == 1 and stats[5]['bigblind'] == 2 and stats[5]['seat'] == 3
+
+    # lines from before the window are not added
+    old = dict(deltas, styleKey = 'd231231')
+    store.add_hand(12, old)
+    assert store.get_stats(99, deltas, key, key)[5][name] == 1
+
+    # the window moves on a day: the entry is dropped and queried again
+    moved = (1, 0, 10, 'd240102', 1)
+    assert store.get_stats(99, deltas, moved, moved) is None
+    assert not store.entries and store.players[5] == set()
+
+class HudQueryStore(Database.Database):
+    """get_stats_from_hand on a canned stats row, a hand is stored while it is queried
+       if stored is given"""
+    def __init__(self, last_hand, stored = None):
+        self.hands = [last_hand]
+        self.stored = stored
+        self.connection = self
+        self.sql = self
+        self.query = {'get_stats_from_hand_aggregated': None}
+
+    def get_last_hand(self):
+        return self.hands[-1]
+
+    def get_hud_gametypes(self, gametypeId, agg_bb_mult):
+        return set([gametypeId])
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, subs):
+        if self.stored is not None:
+            self.hands.append(self.stored)
+        self.description = [('player_id',), ('n',), ('bigblind',)]
+
+    def fetchall(self):
+        return [(5, 1, 2)]
+
+def testHudStatStoreLoad():
+    import SQL
+    params = {'stat_range': 'A', 'agg_bb_mult': 1, 'seats_style': 'A', 'seats_cust_nums_low': 1,
+              'seats_cust_nums_high': 10, 'h_stat_range': 'A', 'h_agg_bb_mult': 1, 'h_seats_style': 'A',
+              'h_seats_cust_nums_low': 1, 'h_seats_cust_nums_high': 10}
+    delta = [3] + [1] * len(Database.CACHE_KEYS)
+    deltas = {'gametypeId': 1, 'seats': 6, 'styleKey': 'd240102', 'bigblind': 2, 'players': {5: delta}}
+    key = (1, 0, 10, '0000000', 1)
+
+    store = Database.HudStatStore(SQL.Sql(db_server = 'sqlite'))
+    stats = HudQueryStore(10).get_stats_from_hand(11, 'ring', params, 99, 6, store, deltas)
+    assert stats[5]['n'] == 1
+    assert store.get_stats(99, deltas, key, key)[5]['n'] == 1
+
+    # hand 11 is stored and received while the stats are queried: they include it already
+    store = Database.HudStatStore(SQL.Sql(db_server = 'sqlite'))
+    db = HudQueryStore(10, stored = 11)
+    store.add_hand(11, deltas)
+    stats = db.get_stats_from_hand(11, 'ring', params, 99, 6, store, deltas)
+    assert stats[5]['n'] == 1
+    held = store.get_stats(99, deltas, key, key)
+    assert held is None or held[5]['n'] == 1
+
+class SessionStore(Database.Database):
+    """Just what storeSessions needs to collect the sessions of a bulk import"""
+    def __init__(self, timeout = 30):
+        self.sessionTimeout = timeout
+        self.s = {'bk': Database.SessionIntervals()}
+
+def storeHand(db, hid, minutes, tid = None):
+    start = datetime(2011, 3, 1, 12, 0) + timedelta(minutes=minutes)
+    db.storeSessions(hid, {'hero': 1}, start, tid, [1], 'UTC')
+
+def sessionIds(db):
+    return sorted(sorted(s['ids']) for s in db.s['bk'].sessions)
+
+def testSessionIntervals():
+    db = SessionStore()
+    # two sessions, more than 30 minutes apart
+    for hid, minutes in ((1, 0), (2, 20), (3, 100), (4, 110)):
+        storeHand(db, hid, minutes)
+    assert sessionIds(db) == [[1, 2], [3, 4]]
+    # a hand within 30 minutes of neither starts a third one in between
+    storeHand(db, 5, 60)
+    assert sessionIds(db) == [[1, 2], [3, 4], [5]]
+    # a hand in reach of two sessions merges them
+    storeHand(db, 6, 45)
+    assert sessionIds(db) == [[1, 2, 5, 6], [3, 4]]
+    storeHand(db, 7, 80)
+    assert sessionIds(db) == [[1, 2, 3, 4, 5, 6, 7]]
+    bk = db.s['bk']
+    assert len(bk) == 1 and bk.starts == [bk.sessions[0]['sessionStart']]
+    assert bk.sessions[0]['sessionEnd'] - bk.sessions[0]['sessionStart'] == timedelta(minutes=110)
+
+def testSessionIntervalsTourney():
+    db = SessionStore()
+    storeHand(db, 1, 0, tid = 10)
+    storeHand(db, 2, 200)
+    storeHand(db, 3, 400)
+    assert sessionIds(db) == [[1], [2], [3]]
+    # the tourney's session is stretched to its later hand and swallows the session it covers
+    storeHand(db, 4, 300, tid = 10)
+    assert sessionIds(db) == [[1, 2, 4], [3]]
+    session = db.s['bk'].tourneys[10]
+    assert sorted(session['ids']) == [1, 2, 4] and session['tourneys'] == set([10])
+    assert db.s['bk'].find(datetime(2011, 3, 1, 17, 0), datetime(2011, 3, 1, 17, 0)) == [session]
+
+def testSessionIntervalsRandom():
+    """Any order of hands gives the sessions of the sorted hands split at gaps over the timeout."""
+    import random
+    rng = random.Random(3)
+    for run in range(20):
+        minutes = [rng.randint(0, 2000) for i in range(60)]
+        db = SessionStore()
+        for hid, m in enumerate(minutes):
+            storeHand(db, hid, m)
+        expected, last = [], None
+        for hid, m in sorted(enumerate(minutes), key=lambda h: (h[1], h[0])):
+            if last is None or m - last > 30:
+                expected.append([])
+            expected[-1].append(hid)
+            last = m
+        assert sessionIds(db) == sorted(sorted(e) for e in expected)
+        bk = db.s['bk']
+        assert bk.starts == sorted(bk.starts)
+        ends = [s['sessionEnd'] for s in bk.sessions]
+        assert ends == sorted(ends)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import os
+import shutil
+import tempfile
+from time import time
+
+import pytest
+
+import DirectoryWatcher
+
+# the changes are made with explicit mtimes, a second apart, so that
+# filesystems with coarse timestamps still show every change to the poller
+clock = [time() - 100]
+
+def tick(*paths):
+    clock[0] += 1
+    for path in paths:
+        os.utime(path, (clock[0], clock[0]))
+
+def write(path, text, mode = 'a'):
+    with open(path, mode) as f:
+        f.write(text)
+    tick(path, os.path.dirname(path))
+
+def checkWatcher(watcher):
+    tmp = tempfile.mkdtemp()
+    try:
+        old = os.path.join(tmp, 'old.txt')
+        seen = os.path.join(tmp, 'seen.txt')
+        write(old, 'hand 0\n')
+        os.utime(old, (time() - 2 * DirectoryWatcher.RECENT, time() - 2 * DirectoryWatcher.RECENT))
+        write(seen, 'hand 1\n')
+        watcher.add(tmp)
+        assert watcher.changes() == set()
+
+        # create
+        new = os.path.join(tmp, 'new.txt')
+        write(new, 'hand 2\n')
+        assert watcher.changes() == set([new])
+        assert watcher.changes() == set()
+
+        # modify, a file seen when the watch started and one created since
+        write(seen, 'hand 3\n')
+        write(new, 'hand 4\n')
+        assert watcher.changes() == set([seen, new])
+
+        # a file last changed long before the watch is not reported for a change in its directory
+        write(os.path.join(tmp, 'other.txt'), 'hand 5\n')
+        assert old not in watcher.changes()
+
+        # delete
+        os.remove(new)
+        tick(tmp)
+        assert new in watcher.changes()
+        assert watcher.changes() == set()
+
+        # a new subdirectory is watched, with what was written to it so far
+        sub = os.path.join(tmp, 'sub')
+        os.mkdir(sub)
+        tick(tmp)
+        inner = os.path.join(sub, 'inner.txt')
+        write(inner, 'hand 6\n')
+        assert inner in watcher.changes()
+        write(inner, 'hand 7\n')
+        assert watcher.changes() == set([inner])
+    finally:
+        watcher.close()
+        shutil.rmtree(tmp)
+
+def testPollingWatcher():
+    checkWatcher(DirectoryWatcher.PollingWatcher())
+
+def testInotifyWatcher():
+    try:
+        watcher = DirectoryWatcher.InotifyWatcher()
+    except (OSError, AttributeError, TypeError), e:
+        pytest.skip("inotify not available (%s)" % e)
+    checkWatcher(watcher)
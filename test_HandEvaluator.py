@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import random
+from itertools import combinations
+
+import HandEvaluator
+
+evaluator = HandEvaluator.HandEvaluator(seed=1)
+deck = [r + s for r in HandEvaluator.RANKS for s in HandEvaluator.SUITS]
+
+def rank(hand):
+    """Slow textbook ranking of five cards, for checking the tables."""
+    ranks = sorted([HandEvaluator.RANKS.index(c[0]) for c in hand], reverse=True)
+    flush = len(set([c[1] for c in hand])) == 1
+    groups = sorted([(ranks.count(r), r) for r in set(ranks)], reverse=True)
+    order = [r for (n, r) in groups]
+    shape = [n for (n, r) in groups]
+    straight = None
+    if len(order) == 5:
+        if ranks[0] - ranks[4] == 4:
+            straight = ranks[0]
+        elif ranks == [12, 3, 2, 1, 0]:
+            straight = 3
+    if straight is not None:
+        return (8 if flush else 4, [straight])
+    if flush:
+        return (5, order)
+    return ({(4,1): 7, (3,2): 6, (3,1,1): 3, (2,2,1): 2, (2,1,1,1): 1, (1,1,1,1,1): 0}[tuple(shape)], order)
+
+def cmp_sign(x):
+    return (x > 0) - (x < 0)
+
+def testEval5Ordering():
+    rng = random.Random(7)
+    hands = [rng.sample(deck, 5) for i in range(2000)]
+    # a few of each rare hand type
+    hands += [['As','Ks','Qs','Js','Ts'], ['5h','4h','3h','2h','Ah'], ['5d','4c','3h','2h','Ah'],
+              ['6d','5c','4h','3h','2h'], ['9c','9d','9h','9s','2c'], ['9c','9d','9h','2s','2c'],
+              ['Tc','Td','Th','9s','9c'], ['Ac','Kc','9c','5c','3c']]
+    values = HandEvaluator.eval5([evaluator.string2card(h) for h in hands])
+    for i in range(len(hands) - 1):
+        for j in (i + 1, len(hands) - 1 - i):
+            expected = cmp_sign(cmp(rank(hands[i]), rank(hands[j])))
+            assert cmp_sign(int(values[i]) - int(values[j])) == expected, (hands[i], hands[j])
+            assert values[i] >> 24 == rank(hands[i])[0]
+
+def testBestHoldem():
+    assert evaluator.best('hi', ['As', 'Ah']) is False
+    value, cards = evaluator.best('hi', ['As', 'Ah', '2c', '7d', '9h', 'Ad', '9c'])
+    assert cards[0] == 'FlHouse'
+    assert evaluator.card2string(cards[1:]) == ['As', 'Ah', 'Ad', '9h', '9c']
+
+def testAAvsKKExhaustive():
+    """AA against KK on 2c7d9h, over every turn and river."""
+    pockets, board = [['As', 'Ah'], ['Kc', 'Kd']], ['2c', '7d', '9h']
+    rest = [c for c in deck if c not in pockets[0] + pockets[1] + board]
+    wins = [0, 0]
+    ties = 0
+    for runout in combinations(rest, 2):
+        best = [max([rank(h) for h in combinations(p + board + list(runout), 5)]) for p in pockets]
+        if best[0] == best[1]:
+            ties += 1
+        else:
+            wins[best[1] > best[0]] += 1
+    assert wins[0] + wins[1] + ties == 990
+    assert wins[1] == 83
+
+    result = evaluator.poker_eval(game='holdem', pockets=pockets, board=board + ['__', '__'], iterations=0)
+    assert result['info'][0] == 990
+    aa, kk = result['eval']
+    assert (aa['winhi'], kk['winhi'], aa['tiehi']) == (wins[0], wins[1], ties)
+    assert aa['ev'] == int(1000 * (wins[0] + ties / 2.0) / 990)
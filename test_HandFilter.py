@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import Database
+import SQL
+
+class HandsDB(Database.Database):
+    """Just the Hands and Gametypes the duplicate checks read, in an sqlite memory db.
+       Counts the queries run, so a test can tell which hands were looked up."""
+    def __init__(self, hands = [], publicDB = False):
+        self.backend = self.SQLITE
+        self.sql = SQL.Sql(db_server = 'sqlite')
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute("CREATE TABLE Gametypes (id INTEGER PRIMARY KEY, siteId INTEGER)")
+        self.connection.execute("CREATE TABLE Hands (id INTEGER PRIMARY KEY, gametypeId INTEGER, siteHandNo BIGINT, heroSeat INTEGER)")
+        self.connection.executemany("INSERT INTO Gametypes VALUES (?, ?)", [(1, 2), (2, 32)])
+        self.add_hands(hands)
+        self.siteHandNos = set()
+        self.dupeHands = {}
+        self.handfilter = None
+        self.queries = []
+
+    def add_hands(self, hands):
+        """hands: (siteId, siteHandNo, heroSeat), siteId 2 or 32"""
+        self.connection.executemany("INSERT INTO Hands (gametypeId, siteHandNo, heroSeat) VALUES (?, ?, ?)",
+                                    [({2: 1, 32: 2}[s], n, seat) for (s, n, seat) in hands])
+
+    def get_cursor(self, connect = False):
+        db = self
+        class Cursor:
+            def __init__(self):
+                self.c = db.connection.cursor()
+            def execute(self, q, args = ()):
+                db.queries.append(args)
+                return self.c.execute(q, args)
+            def __getattr__(self, name):
+                return getattr(self.c, name)
+        return Cursor()
+
+    def commit(self):
+        self.connection.commit()
+
+def newFilter(publicDB = False, path = None):
+    return Database.HandFilter(path or os.path.join(tempfile.gettempdir(), 'no-such-handfilter.bin'), publicDB)
+
+def testHitsAndMisses():
+    f = newFilter()
+    keys = [f.key(1000000 + i, 2, 3) for i in xrange(20000)]
+    for key in keys:
+        f.add(key)
+    assert f.count == 20000
+    for key in keys:
+        assert key in f
+    misses = [f.key(5000000 + i, 2, 3) for i in xrange(20000)]
+    false_hits = len([key for key in misses if key in f])
+    assert false_hits < len(misses) * f.error_rate * 2
+
+def testKeys():
+    private, public = newFilter(False), newFilter(True)
+    assert private.key('123', 2, 4) == private.key(123L, 2, 7) == (123L, 2)
+    assert public.key('123', 2, 4) == (123L, 2, 4)
+    public.add(public.key(123, 2, 4))
+    assert public.key(123, 2, 4) in public
+    assert public.key(123, 2, 5) not in public
+    assert public.key(123, 32, 4) not in public
+
+def testSaveAndLoad():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'handfilter.bin')
+        db = HandsDB([(2, 100 + i, 1) for i in xrange(50)])
+        f = Database.HandFilter(path, False)
+        f.save(db)
+        assert f.lastId == 50 and f.count == 50 and not f.dirty
+
+        loaded = Database.HandFilter(path, False)
+        assert loaded.lastId == 50 and loaded.bits == f.bits
+        assert loaded.key(120, 2, 1) in loaded
+
+        # a filter of the other publicDB setting is not used
+        other = Database.HandFilter(path, True)
+        assert other.lastId == 0 and other.count == 0
+
+        # hands stored since are added, a db with fewer hands rebuilds the filter
+        db.add_hands([(32, 100, 1)])
+        loaded.sync(db)
+        assert loaded.lastId == 51 and loaded.key(100, 32, 1) in loaded
+        loaded.sync(HandsDB([(2, 7, 1)]))
+        assert loaded.lastId == 1 and loaded.count == 1
+        assert loaded.key(7, 2, 1) in loaded and loaded.key(120, 2, 1) not in loaded
+    finally:
+        shutil.rmtree(tmp)
+
+def testCheckDuplicates():
+    db = HandsDB([(2, 100, 1), (2, 101, 1), (32, 100, 1)])
+    db.handfilter = newFilter()
+    db.handfilter.sync(db)
+    db.queries = []
+    hands = [(2, '100', 1), (2, '101', 1), (32, '100', 1), (2, '102', 1), (32, '101', 1)]
+    db.checkDuplicates(hands, False)
+    # hands the filter has never seen are not looked up
+    looked_up = sorted([n for args in db.queries for n in args[1:]])
+    assert looked_up == [100, 100, 101], looked_up
+    assert [db.isDuplicate(s, n, seat, False) for (s, n, seat) in hands] == [True, True, True, False, False]
+    assert db.dupeHands == {}
+    # hands stored by the import are known to be duplicates, and added to the filter
+    assert db.isDuplicate(2, '102', 1, False)
+    assert db.handfilter.key('102', 2, 1) in db.handfilter
+
+def testCheckDuplicatesPublicDB():
+    """With publicDB a hand is a duplicate only when seen from the same heroSeat"""
+    db = HandsDB([(2, 100, 1)])
+    db.handfilter = newFilter(True)
+    db.handfilter.sync(db)
+    hands = [(2, '100', 1), (2, '100', 2)]
+    db.checkDuplicates(hands, True)
+    assert [db.isDuplicate(s, n, seat, True) for (s, n, seat) in hands] == [True, False]
+    # a filter built for the other setting is ignored, every hand is looked up
+    db = HandsDB([(2, 100, 1)])
+    db.handfilter = newFilter(False)
+    db.checkDuplicates(hands, True)
+    assert len(db.queries) == 1
+    assert [db.isDuplicate(s, n, seat, True) for (s, n, seat) in hands] == [True, False]
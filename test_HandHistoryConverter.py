@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import os
+import shutil
+import tempfile
+
+import Configuration
+import PokerStarsToFpdb
+
+config = Configuration.Config(file = "HUD_config.test.xml")
+config.set_site_ids([("PokerStars", 32)])
+
+HANDS = "regression-test-files/cash/Stars/Flop/NLHE-2max-USD-0.25-0.50-201005.Hitnrun.txt"
+
+def converter(path, index = 0, kodec = None, auto = True):
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, index = index, autostart = False)
+    hhc.setAutoPop(auto)
+    if kodec: hhc.setKodec(kodec)
+    return hhc
+
+def write(path, data, mode = 'ab'):
+    with open(path, mode) as f:
+        f.write(data)
+
+def tempfile_with(data):
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'hands.txt')
+    write(path, data, 'wb')
+    return (tmp, path)
+
+def testTailPartialHand():
+    """A hand half written at one poll is read in full at the next"""
+    data = open(HANDS, 'rb').read()
+    whole = converter(HANDS)
+    whole.start()
+    handids = [h.handid for h in whole.processedHands]
+    assert len(handids) == 6
+
+    fourth = data.index('PokerStars Game #', data.index('PokerStars Game #' + str(handids[2])) + 1)
+    (tmp, path) = tempfile_with(data[:fourth + 300])
+    try:
+        hhc = converter(path)
+        hhc.start()
+        assert [h.handid for h in hhc.processedHands] == handids[:3]
+        (index, kodec) = (hhc.getLastByteRead(), hhc.getKodec())
+        assert index <= fourth and data[index:fourth].strip() == ''
+
+        # nothing new, nothing read
+        hhc = converter(path, index, kodec)
+        hhc.start()
+        assert hhc.processedHands == [] and hhc.getLastByteRead() == index
+
+        write(path, data[fourth + 300:])
+        hhc = converter(path, index, kodec)
+        hhc.start()
+        assert [h.handid for h in hhc.processedHands] == handids[3:]
+        assert data[hhc.getLastByteRead():].strip() == ''
+    finally:
+        shutil.rmtree(tmp)
+
+def testTailSplitCharacter():
+    """A file ending inside a multi-byte character is read up to the character"""
+    text = u'Hand \xe9t\xe9\n'.encode('utf8')
+    (tmp, path) = tempfile_with(text[:6])
+    try:
+        hhc = converter(path, kodec = 'utf8')
+        hhc.readFile()
+        assert hhc.obs == u'Hand ' and hhc.getLastByteRead() == 5
+        write(path, text[6:])
+        hhc = converter(path, 5, 'utf8')
+        hhc.readFile()
+        assert hhc.obs == u'\xe9t\xe9\n' and hhc.getLastByteRead() == len(text)
+        # giving back characters moves the index by their size in bytes
+        hhc.unread(u't\xe9\n')
+        assert hhc.getLastByteRead() == len(u'Hand \xe9'.encode('utf8'))
+    finally:
+        shutil.rmtree(tmp)
+
+def testSavedCodecFails():
+    """Text added in another encoding than the saved codec is read with the site's codecs"""
+    (tmp, path) = tempfile_with('Hand ')
+    try:
+        write(path, u'\xe9t\xe9\n'.encode('cp1252'))
+        hhc = converter(path, 5, 'utf8')
+        assert hhc.readFile()
+        assert hhc.obs == u'\xe9t\xe9\n' and hhc.getKodec() == 'cp1252'
+        assert hhc.getLastByteRead() == 9
+    finally:
+        shutil.rmtree(tmp)
+
+def testTruncatedFile():
+    (tmp, path) = tempfile_with('x' * 100)
+    try:
+        write(path, 'PokerStars', 'wb')
+        hhc = converter(path, 100, 'utf8')
+        hhc.readFile()
+        assert hhc.obs == u'PokerStars' and hhc.getLastByteRead() == 10
+    finally:
+        shutil.rmtree(tmp)
+
+def checkIterHands(data):
+    (tmp, path) = tempfile_with(data)
+    try:
+        expected = converter(path, auto = False).allHandsAsList()
+        for size in (7, 64, 1000, 1 << 20):
+            hhc = converter(path, auto = False)
+            hhc.READ_CHUNK_SIZE = size
+            assert list(hhc.iterHands()) == expected, size
+            assert hhc.getLastByteRead() == len(data)
+    finally:
+        shutil.rmtree(tmp)
+    return expected
+
+def testIterHands():
+    data = open(HANDS, 'rb').read()
+    assert len(checkIterHands(data)) == 6
+    assert len(checkIterHands(data.replace('\r\n', '\n').replace('\n', '\r\n'))) == 6
+    assert len(checkIterHands('\n\n' + data + '\n\n\n')) == 6
+
+def testHandBatches():
+    """start() hands the parsed hands on a batch at a time and keeps none of them"""
+    whole = converter(HANDS, auto = False)
+    whole.start()
+    handids = [h.handid for h in whole.processedHands]
+    batches = []
+    hhc = converter(HANDS, auto = False)
+    hhc.setHandBatch(4, lambda hands: batches.append([h.handid for h in hands]))
+    hhc.start()
+    assert batches == [handids[:4], handids[4:]]
+    assert hhc.getProcessedHands() == [] and hhc.numHands == 6
+
+def testCodecChangesMidFile():
+    """A file that stops being utf8 after the first chunk is read on as the next codec"""
+    data = open(HANDS, 'rb').read()
+    (tmp, path) = tempfile_with(data + '\n\n' + data.replace('\xef\xbb\xbf', '').replace('Hero', 'H\xe9ro'))
+    try:
+        hhc = converter(path, auto = False)
+        hhc.READ_CHUNK_SIZE = 1000
+        hands = list(hhc.iterHands())
+        assert len(hands) == 12 and hhc.getKodec() == 'cp1252'
+        assert u'H\xe9ro' in hands[-1] and u'H\xe9ro' not in hands[0]
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import glob
+import os
+import shutil
+import tempfile
+
+import Configuration
+import Database
+import Importer
+
+TOURNEYS  = sorted(glob.glob('regression-test-files/tour/Stars/Flop/*.txt'))
+SUMMARIES = sorted(glob.glob('regression-test-files/summaries/Stars/*.txt'))
+
+def importer(dir):
+    """An importer with an empty sqlite database in dir"""
+    config = Configuration.Config(file = "HUD_config.test.xml")
+    config.dir_database = dir
+    Database.Database(config).recreate_tables()
+    settings = {}
+    settings.update(config.get_db_parameters())
+    settings.update(config.get_import_parameters())
+    settings.update(config.get_default_paths())
+    imp = Importer.Importer(False, settings, config, None)
+    imp.setCallHud(False)
+    imp.setQuiet(True)
+    imp.database.callHud = True     # the cache tables are kept
+    return imp
+
+def runImport(imp, files):
+    for f in files:
+        imp.clearFileList()
+        imp.addBulkImportImportFileOrDir(f, site = 'PokerStars')
+        try:
+            imp.runImport()
+        except Exception:
+            imp.database.rollback()    # some regression files don't import yet
+
+def caches(db):
+    """The rows of the cache tables, without their ids"""
+    c = db.get_cursor()
+    rows = {}
+    for table in ('HudCache', 'CardsCache', 'PositionsCache'):
+        columns = Database.CACHE_TABLE_KEYS[table] + Database.CACHE_KEYS
+        c.execute("SELECT %s FROM %s" % (', '.join(columns), table))
+        rows[table] = sorted(c.fetchall())
+    return rows
+
+def testRepairCaches():
+    """Summaries that retype the tourneys of imported hands leave the caches as a rebuild would"""
+    tmp = tempfile.mkdtemp()
+    try:
+        imp = importer(tmp)
+        db = imp.database
+        repairs = []
+        repair = db.repairCaches
+        def record(tables):
+            repairs.append(len(db.cachejournal))
+            return repair(tables)
+        db.repairCaches = record
+
+        runImport(imp, TOURNEYS)
+        db.rebuild_caches()     # the caches the repair starts from, as the hands have them now
+        runImport(imp, SUMMARIES)
+        assert [n for n in repairs if n], "no hands were journaled"
+        repaired = caches(db)
+        db.rebuild_caches()
+        assert caches(db) == repaired
+    finally:
+        shutil.rmtree(tmp)
+
+def testFailedRepair():
+    """A repair failing part way doesn't leave CacheJournal behind for the next one"""
+    tmp = tempfile.mkdtemp()
+    try:
+        imp = importer(tmp)
+        db = imp.database
+        runImport(imp, TOURNEYS[:3])
+        db.cachejournal = {}
+        c = db.get_cursor()
+        c.execute("SELECT id FROM Hands")
+        for (hid,) in c.fetchall():
+            db.journalHands((hid,), weekId = 0, monthId = 0)
+        def broken(table, bulk):
+            raise ValueError("broken")
+        db.storeCacheLines = broken
+        try:
+            db.repairCaches(('CardsCache',))
+        except ValueError:
+            db.rollback()
+        else:
+            assert False, "the repair did not fail"
+        del db.storeCacheLines
+        db.cachejournal = {}
+        db.repairCaches(('CardsCache',))
+        db.journalHands((1,), weekId = 0, monthId = 0)
+        db.repairCaches(('HudCache',))
+        assert db.cachejournal == {}
+    finally:
+        shutil.rmtree(tmp)
+
+CASH = ['regression-test-files/cash/Stars/Flop/' + f for f in
+        ('NLHE-2max-USD-0.25-0.50-201005.Hitnrun.txt', 'NLHE-6max-EUR-0.05-0.10-200911.txt',
+         'NLHE-6max-USD-0.05-0.10-200911.txt', 'NLHE-FR-USD-0.01-0.02-201005.microgrind.txt',
+         'PLO-FR-USD-0.01-0.02-201006.sidepots.txt', 'PLO8-6max-USD-0.01-0.02-200911.txt')]
+
+def importAll(dir, files, threads):
+    """Import files in one run, returns the counts and the Hands and cache rows stored"""
+    imp = importer(dir)
+    imp.setThreads(threads)
+    for f in files:
+        imp.addBulkImportImportFileOrDir(f, site = 'PokerStars')
+    counts = imp.runImport()[:5]
+    c = imp.database.get_cursor()
+    # ids are given in the order rows are stored, compare gametypes and players by value
+    c.execute("SELECT * FROM Gametypes")
+    gametypes = dict((row[0], row[1:]) for row in c.fetchall())
+    c.execute("SELECT id, name FROM Players")
+    players = dict(c.fetchall())
+    c.execute("""SELECT h.siteHandNo, h.gametypeId, h.startTime, hp.playerId, hp.winnings, hp.totalProfit
+                 FROM Hands h INNER JOIN HandsPlayers hp ON (hp.handId = h.id)""")
+    hands = sorted((r[0], gametypes[r[1]], r[2], players[r[3]]) + tuple(r[4:]) for r in c.fetchall())
+    rows = caches(imp.database)
+    for table in rows:
+        keys = Database.CACHE_TABLE_KEYS[table]
+        (g, p) = (keys.index('gametypeId'), keys.index('playerId'))
+        rows[table] = sorted(tuple(r[:g]) + (gametypes[r[g]],) + tuple(r[g+1:p]) + (players[r[p]],) + tuple(r[p+1:])
+                             for r in rows[table])
+    return (counts, hands, rows)
+
+def testParallelImport():
+    """Parser processes and a writer thread store what a serial import does"""
+    tmp = tempfile.mkdtemp()
+    try:
+        # the same hands in a second file are duplicates, whichever process parses them
+        again = os.path.join(tmp, 'again.txt')
+        shutil.copy(CASH[0], again)
+        files = CASH + [again]
+        serial = importAll(os.path.join(tmp, 'serial'), files, 1)
+        parallel = importAll(os.path.join(tmp, 'parallel'), files, 3)
+        assert serial[0] == parallel[0] == (267, 6, 0, 0, 0), (serial[0], parallel[0])
+        assert len(set(row[0] for row in serial[1])) == 267
+        assert serial[1] == parallel[1]
+        assert serial[2] == parallel[2]
+    finally:
+        shutil.rmtree(tmp)
+
+def testParallelFallback():
+    """A single file, or an sqlite :memory: database, is imported serially"""
+    tmp = tempfile.mkdtemp()
+    try:
+        imp = importer(tmp)
+        imp.setThreads(3)
+        imp.addBulkImportImportFileOrDir(CASH[0], site = 'PokerStars')
+        assert not imp.canImportParallel()
+        imp.addBulkImportImportFileOrDir(CASH[1], site = 'PokerStars')
+        assert imp.canImportParallel()
+        imp.database.database = ':memory:'
+        assert not imp.canImportParallel()
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import Stove
+
+def stove(board, hand, villain):
+    s = Stove.Stove()
+    s.set_board_string(board)
+    s.set_hero_cards_string(hand)
+    s.set_villain_range_string(villain)
+    return s
+
+def testParseWeight():
+    assert Stove.parse_weight('AKs') == ('AKs', 1.0)
+    assert Stove.parse_weight('JJ+:50%') == ('JJ+', 0.5)
+    assert Stove.parse_weight('76s+ : 0.25') == ('76s+', 0.25)
+
+def testCanonical():
+    board = ['2c', '7d', '9h', '__', '__']
+    assert Stove.canonical(['Ah', 'Kh'], ['Qs', 'Qc'], ['2c', '7c', '9c', '__', '__']) == \
+           Stove.canonical(['Ad', 'Kd'], ['Qh', 'Qs'], ['2s', '7s', '9s', '__', '__'])
+    assert Stove.canonical(['As', 'Ah'], ['Kc', 'Kd'], board) != \
+           Stove.canonical(['As', 'Ah'], ['Ks', 'Kd'], board)
+
+def testRangeDeduplicates():
+    s = stove('2c 7d 9h', 'As Ah', 'KK,KK:50%,AK')
+    hands = s.h_range.get()
+    assert len(hands) == 6 + 2 * 4
+    assert len(set(hands)) == len(hands)
+    assert s.h_range.weight(Stove.Cards('Kd', 'Kc')) == 0.5
+    assert s.h_range.weight(Stove.Cards('Ad', 'Kc')) == 1.0
+
+def testRangeEquity():
+    """Grouping by suit isomorphic matchup gives the combo by combo equity."""
+    s = stove('2c 7d 9h', 'As Ah', 'KK:50%,AKs,QQ+')
+    win = tie = lose = weight = 0.0
+    for h in s.h_range.get():
+        e = Stove._odds_for_hand(['As', 'Ah'], h.get(), s.board.get(), -1)
+        w = s.h_range.weight(h)
+        win += w * e.n_wins / e.n_hands
+        tie += w * e.n_ties / e.n_hands
+        lose += w * e.n_losses / e.n_hands
+        weight += w
+    Stove.equity_cache = Stove.LRUCache(Stove.EQUITY_CACHE_SIZE)
+    sev = Stove.odds_for_range(s)
+    assert abs(sev.n_wins / sev.weight - win / weight) < 1e-9
+    assert abs(sev.n_ties / sev.weight - tie / weight) < 1e-9
+    assert abs(sev.n_losses / sev.weight - lose / weight) < 1e-9
+    assert sev.weight == weight
+
+    # a second run is served from the cache
+    calls = []
+    odds = Stove.odds_for_hand
+    Stove.odds_for_hand = lambda *args, **kwargs: calls.append(args)
+    try:
+        again = Stove.odds_for_range(s)
+    finally:
+        Stove.odds_for_hand = odds
+    assert calls == []
+    assert again.n_wins == sev.n_wins
+
+def testZeroWeightRange():
+    """A range weighted 0 throughout gives the unweighted equity instead of dividing by 0."""
+    s = stove('2c 7d 9h', 'As Ah', 'KK:0,QQ:0')
+    sev = Stove.odds_for_range(s)
+    assert sev.weight == 0
+    unweighted = Stove.odds_for_range(stove('2c 7d 9h', 'As Ah', 'KK,QQ'))
+    for (r, expected) in zip(sev.rates(), unweighted.rates()):
+        assert abs(r - expected) < 1e-9
+    assert sev.rates()[0] > 0.8
+    assert Stove.SumEV().rates() == (0., 0., 0.)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in agpl-3.0.txt.
+
+import TourneySummary
+
+class SummaryDB:
+    """Answers the calls insertOrUpdate makes with what the tourney rows would give"""
+    def __init__(self, change, tpInserted = 0, tpUpdated = 0):
+        self.change = change
+        self.tp = (tpInserted, tpUpdated)
+    def set_printdata(self, printtest):
+        pass
+    def getSqlPlayerIDs(self, names, siteId, hero):
+        return dict((name, i) for (i, name) in enumerate(names))
+    def getTourneyCache(self, siteId, tourNo):
+        return None
+    def createOrUpdateTourneyType(self, summary, tour):
+        return 1
+    def createOrUpdateTourney(self, summary, tour):
+        return (1, self.change)
+    def createOrUpdateTourneysPlayers(self, summary, tour):
+        return self.tp
+    def commit(self):
+        pass
+
+class Summary(TourneySummary.TourneySummary):
+    def __init__(self, db):
+        self.db = db
+        self.players = {'hero': [0], 'villain': [0]}
+        self.siteId = 32
+        self.tourNo = '123'
+        self.hero = 'hero'
+
+def counts(db):
+    (stored, duplicates, updated, errors, ttime) = Summary(db).insertOrUpdate()
+    return (stored, duplicates, updated)
+
+def testInsertOrUpdateCounts():
+    assert counts(SummaryDB('insert', 2, 0)) == (1, 0, 0)
+    assert counts(SummaryDB('update')) == (0, 0, 1)
+    assert counts(SummaryDB(None)) == (0, 1, 0)
+
+def testPlayersOnlyUpdate():
+    """A summary adding or correcting only TourneysPlayers rows updates the tourney"""
+    assert counts(SummaryDB(None, tpUpdated = 2)) == (0, 0, 1)
+    assert counts(SummaryDB(None, tpInserted = 1)) == (0, 0, 1)